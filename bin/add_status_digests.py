@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Adds the digest columns to the changes and sourcestamps tables of an existing
+status database, and fills them in for existing rows.
+
+Databases created after the columns were added to the model already have
+them; running this against such a database only fills in missing digests.
+"""
+import sys
+
+import sqlalchemy
+
+import buildbotcustom.status.db.model as model
+
+def addColumn(engine, table):
+    columns = [c['name'] for c in
+               sqlalchemy.engine.reflection.Inspector.from_engine(engine).get_columns(table)]
+    if 'digest' in columns:
+        return
+    print "Adding %s.digest" % table
+    engine.execute("ALTER TABLE %s ADD COLUMN digest VARCHAR(40)" % table)
+    engine.execute("CREATE INDEX ix_%s_digest ON %s (digest)" % (table, table))
+
+def fillDigests(session, batch=1000):
+    n = 0
+    for c in session.query(model.Change).filter_by(digest=None):
+        c.digest = model.Change.makeDigest(c.number, c.branch, c.revision,
+                c.who, c.comments, c.when, [f.path for f in c.files])
+        n += 1
+        if n % batch == 0:
+            session.commit()
+    session.commit()
+    print "Updated %i changes" % n
+
+    n = 0
+    for s in session.query(model.SourceStamp).filter_by(digest=None):
+        if s.patch:
+            patch = (s.patch.patchlevel, s.patch.patch)
+        else:
+            patch = None
+        s.digest = model.SourceStamp.makeDigest(s.branch, s.revision, patch,
+                [sc.change.digest for sc in s.changes])
+        n += 1
+        if n % batch == 0:
+            session.commit()
+    session.commit()
+    print "Updated %i sourcestamps" % n
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print >> sys.stderr, "Usage: %s dburl" % sys.argv[0]
+        sys.exit(1)
+    engine = sqlalchemy.create_engine(sys.argv[1])
+    addColumn(engine, 'changes')
+    addColumn(engine, 'sourcestamps')
+    Session = model.connect(sys.argv[1])
+    fillDigests(Session())
@@ -3,12 +3,13 @@
 
 Uploads logs from build to the given host.
 """
-import sys, os, cPickle, gzip, subprocess, time
+import sys, os, cPickle, gzip, subprocess, time, pipes
 
 from buildbot import util
 from buildbot.status.builder import Results
 
 from buildbotcustom.process.factory import postUploadCmdPrefix
+from buildbotcustom.steps.transfer import chunkedUploadCommand
 
 from util.retry import retry
 
@@ -48,6 +49,14 @@ def scp(user, identity, host, files, remote_dir, port=22):
 
     return retry(do_cmd, attempts=retries, sleeptime=retry_sleep, args=(cmd,))
 
+def chunked_scp(user, identity, host, files, remote_dir, port=22):
+    "Like scp, but resumes interrupted uploads and uses parallel streams"
+    files = " ".join([pipes.quote(f) for f in files])
+    script = chunkedUploadCommand(files, user, host, remote_dir,
+            identity=identity, port=port, retries=retries,
+            retrySleep=retry_sleep)
+    return do_cmd(['bash', '-c', script])
+
 def getBuild(builder_path, build_number):
     build_path = os.path.join(builder_path, build_number)
 
@@ -163,6 +172,7 @@ if __name__ == "__main__":
             product="firefox",
             retries=retries,
             retry_sleep=retry_sleep,
+            chunked=False,
             )
     parser.add_option("-u", "--user", dest="user", help="upload user name")
     parser.add_option("-i", "--identity", dest="identity", help="ssh identity")
@@ -181,6 +191,8 @@ if __name__ == "__main__":
             help="upload to try build directory")
     parser.add_option("--shadow", dest="shadowbuild", action="store_true",
             help="upload to shadow build directory")
+    parser.add_option("--chunked", dest="chunked", action="store_true",
+            help="upload in resumable chunks over several connections")
 
     options, args = parser.parse_args()
 
@@ -192,6 +204,8 @@ if __name__ == "__main__":
 
     retries = options.retries
     retry_sleep = options.retry_sleep
+    if options.chunked:
+        scp = chunked_scp
 
     if len(args) != 3:
         parser.error("Need to specify host, builder_path and build number")
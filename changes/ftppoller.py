@@ -3,7 +3,8 @@ import re
 from twisted.python import log
 from twisted.internet import reactor
 from twisted.internet.task import LoopingCall
-from twisted.web.client import getPage
+from twisted.web.client import getPage, HTTPClientFactory
+from twisted.web import error
 
 from buildbot.changes import base, changes
 from buildbotcustom.l10n import ParseLocalesFile
@@ -127,6 +128,13 @@ class LocalesFtpPoller(FtpPollerBase):
     localesFile = None
     platform = None
     sl_platform_map = None
+    # ETag of the last version of localesFile we fetched, and the locales
+    # parsed from it
+    localesETag = None
+    locales = None
+    # Matches the names of the entries in a directory listing, which are
+    # followed by a / for directories
+    entryRe = re.compile(r'([^\s/"\'<>]+)/')
 
     def __init__(self, localesFile, platform, sl_platform_map, **kwargs):
         """
@@ -162,25 +170,67 @@ class LocalesFtpPoller(FtpPollerBase):
             log.msg("Not polling LocalesFtpPoller because last poll is still working (%s)" % (str(self.working)))
         else:
             self.working = self.working + 1
-            d = self._get_page(self.localesFile)
+            d = self._get_locales_page()
             d.addCallback(self._get_locales)
             for url in self.ftpURLs:
                 d.addCallback(self._get_ftp, url)
                 d.addCallback(self._process_changes, url)
             d.addBoth(self._finished)
 
+    def _get_locales_page(self):
+        """Fetch the locales file. Returns None instead of the contents if
+           it hasn't changed since the last time it was fetched."""
+        headers = {}
+        if self.localesETag and self.locales is not None:
+            headers['If-None-Match'] = self.localesETag
+        # Connect the factory ourselves, like getPage does, so that the
+        # response headers are available
+        factory = HTTPClientFactory(self.localesFile, headers=headers,
+                                    timeout=self.timeout)
+        if factory.scheme == 'https':
+            from twisted.internet import ssl
+            reactor.connectSSL(factory.host, factory.port, factory,
+                               ssl.ClientContextFactory())
+        else:
+            reactor.connectTCP(factory.host, factory.port, factory)
+
+        def _got_page(pageContents):
+            etag = (factory.response_headers or {}).get('etag')
+            if etag:
+                self.localesETag = etag[0]
+            else:
+                self.localesETag = None
+            return pageContents
+
+        def _not_modified(failure):
+            failure.trap(error.Error)
+            if failure.value.status != '304':
+                # Make sure we don't hang on to a stale list of locales
+                self.localesETag = None
+                self.locales = None
+                return failure
+            return None
+
+        d = factory.deferred
+        d.addCallbacks(_got_page, _not_modified)
+        return d
+
     def _get_locales(self, pageContents):
         """parse the locales file and filter by platform"""
+        if pageContents is None:
+            # Not modified since we last parsed it
+            return self.locales
         parsedLocales = ParseLocalesFile(pageContents)
-        return [re.compile(re.escape("%s/" % l)) for l in parsedLocales if len(parsedLocales[l]) == 0 or self.sl_platform_map[self.platform] in parsedLocales[l]]
+        self.locales = frozenset(l for l in parsedLocales if len(parsedLocales[l]) == 0 or self.sl_platform_map[self.platform] in parsedLocales[l])
+        return self.locales
 
+    def getEntries(self, pageContents):
+        """return the set of entry names in the ftp page"""
+        return set(self.entryRe.findall(pageContents))
 
     def searchAllStrings(self, pageContents, locales):
         """match the ftp page against the locales list"""
-        req_matches = len(locales)
-        #count number of strings with at least one positive match
-        matches = sum([1 for regex in locales if re.search(regex, pageContents)])
-        return matches == req_matches
+        return locales.issubset(self.getEntries(pageContents))
 
     def parseContents(self, pageContents, locales):
         """ Check through lines to see if file exists """
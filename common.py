@@ -27,6 +27,14 @@ def genBuildID(now=None):
         now = time.time()
     return time.strftime("%Y%m%d%H%M%S", time.localtime(now))
 
+def genBuildIDNumber(now=None):
+    """Return genBuildID(now) as an integer, without formatting a string"""
+    if not now:
+        now = time.time()
+    t = time.localtime(now)
+    return (((((t.tm_year * 100 + t.tm_mon) * 100 + t.tm_mday) * 100 +
+            t.tm_hour) * 100 + t.tm_min) * 100 + t.tm_sec)
+
 def genBuildUID():
     """Return a unique build uid"""
     return uuid.uuid4().hex
@@ -37,6 +37,8 @@
 #
 # ***** END LICENSE BLOCK *****
 
+import re
+
 from twisted.python import log
 from twisted.internet import defer
 from twisted.web.client import getPage
@@ -44,6 +46,7 @@ from buildbot.scheduler import Dependent, Triggerable, Nightly
 from buildbot.sourcestamp import SourceStamp
 from buildbot.process import properties
 from buildbot.status.builder import SUCCESS, WARNINGS
+from buildbot.util import LRUCache
 
 def ParseLocalesFile(data):
     """
@@ -68,6 +71,56 @@ def ParseLocalesFile(data):
             locales[locale] = buildPlatforms
     return locales
 
+# Parsed locales files, keyed by URL. Only URLs for a specific changeset are
+# cached since the contents at a branch name or tag like 'default' can change.
+_localesCache = LRUCache(max_size=100)
+# Deferreds for locales files that are currently being fetched, keyed by URL,
+# so that schedulers triggered at the same time share a single request.
+_localesPending = {}
+_changesetRe = re.compile(r'^[0-9a-f]{12,40}$')
+
+def _fireLocales(result, url, waiters):
+    """Fire the Deferreds in waiters, which were waiting on url, with result"""
+    # Compare against the list itself: this module may have been reloaded,
+    # replacing _localesPending, while the fetch was in progress
+    if _localesPending.get(url) is waiters:
+        del _localesPending[url]
+    for d in waiters:
+        d.callback(result)
+
+def getLocalesFile(url, revision):
+    """
+    Returns a Deferred that fires with the parsed contents of the locales
+    file at url, which is for revision.
+
+    If revision is a changeset id the parsed file is cached, and concurrent
+    requests for the same url only fetch it once.
+    """
+    if not _changesetRe.match(revision):
+        d = getPage(url, timeout = 5 * 60)
+        d.addCallback(ParseLocalesFile)
+        return d
+
+    locales = _localesCache.get(url)
+    if locales is not None:
+        log.msg("L10nMixin:: Using cached locales for: " + url)
+        return defer.succeed(locales)
+
+    d = defer.Deferred()
+    if url in _localesPending:
+        _localesPending[url].append(d)
+        return d
+    waiters = _localesPending[url] = [d]
+
+    def _cache(locales):
+        _localesCache.add(url, locales)
+        return locales
+    fetch = getPage(url, timeout = 5 * 60)
+    fetch.addCallback(ParseLocalesFile)
+    fetch.addCallback(_cache)
+    fetch.addBoth(_fireLocales, url, waiters)
+    return d
+
 class L10nMixin(object):
     """
     This class helps any of the L10n custom made schedulers
@@ -76,16 +129,21 @@ class L10nMixin(object):
 
     For each locale, there will be a build property 'locale' set to the
     inidividual locale to be built for that BuildSet.
+
+    If l10nChunks is set, the locales are instead split into that many
+    BuildSets, each with a build property 'locales' listing the locales to be
+    repacked in that build. 'locale' is set to the first of them.
     """
 
     def __init__(self, platform, repo='http://hg.mozilla.org/', branch=None,
             baseTag='default', localesFile="browser/locales/all-locales",
-            locales=None, localesURL=None):
+            locales=None, localesURL=None, l10nChunks=None):
         """
         You can call this class with either a defined list of locales or
         a URL that contains the list of locales
         """
         self.branch = branch
+        self.l10nChunks = l10nChunks
         self.baseTag = baseTag
         if localesURL:
             self.localesURL = localesURL
@@ -120,30 +178,60 @@ class L10nMixin(object):
         """
         log.msg("L10nMixin:: loaded locales' list")
         db = self.parent.db
-        for locale in locales:
-            # Ignore en-US. It appears in locales files but we do not repack it.
-            if locale == "en-US":
-                continue
-            # Some locales should only be built on certain platforms, make sure to
-            # obey those rules.
-            if len(locales[locale]) > 0:
-                if self.platform not in locales[locale]:
-                    continue
+        # All of the buildsets are for the same source, so they can share a
+        # single sourcestamp
+        ss = SourceStamp(branch=self.branch)
+        ssid = db.get_sourcestampid(ss, t)
+        for locale in self.filterLocales(locales):
             props = properties.Properties()
             props.updateFromProperties(self.properties)
             if set_props:
                 props.updateFromProperties(set_props)
             #I do not know exactly what to pass as the source parameter
-            props.update(dict(locale=locale), "Scheduler")
+            if isinstance(locale, list):
+                props.update(dict(locale=locale[0], locales=locale),
+                             "Scheduler")
+                log.msg('Submitted locales: ' + ', '.join(locale))
+            else:
+                props.update(dict(locale=locale), "Scheduler")
+                log.msg('Submitted '+locale+' locale')
             props.setProperty("en_revision", self.baseTag, "L10nMixin")
             props.setProperty("l10n_revision", self.baseTag, "L10nMixin")
-            log.msg('Submitted '+locale+' locale')
             # let's submit the BuildSet for this locale
-            # Create a sourcestamp
-            ss = SourceStamp(branch=self.branch)
-            ssid = db.get_sourcestampid(ss, t)
             self.create_buildset(ssid, reason, t, props=props)
 
+    def filterLocales(self, locales):
+        """
+        Returns the locales from the parsed locales file that should be
+        repacked on our platform. If l10nChunks is set, they are returned as
+        that many lists of locales instead.
+        """
+        wanted = []
+        for locale in sorted(locales):
+            # Ignore en-US. It appears in locales files but we do not repack it.
+            if locale == "en-US":
+                continue
+            # Some locales should only be built on certain platforms, make sure to
+            # obey those rules.
+            if len(locales[locale]) > 0:
+                if self.platform not in locales[locale]:
+                    continue
+            wanted.append(locale)
+
+        if not self.l10nChunks:
+            return wanted
+        # Split into l10nChunks contiguous chunks whose sizes differ by at
+        # most one
+        chunks = []
+        n, extra = divmod(len(wanted), self.l10nChunks)
+        start = 0
+        for i in range(self.l10nChunks):
+            end = start + n + (i < extra)
+            if end > start:
+                chunks.append(wanted[start:end])
+            start = end
+        return chunks
+
     def getLocales(self, revision=None):
         """
         It returns a list of locales if the user has set a list of locales
@@ -155,15 +243,13 @@ class L10nMixin(object):
             log.msg('L10nMixin.getLocales():: The user has set a list of locales')
             return self.locales
         else:
-            localePage = self.localesURL % {'revision': revision or self.baseTag}
+            revision = revision or self.baseTag
+            localePage = self.localesURL % {'revision': revision}
             log.msg("L10nMixin:: Getting locales from: "+localePage)
-            # we expect that getPage will return the output of "all-locales"
+            # we expect that the page is the output of "all-locales"
             # or "shipped-locales" or any file that contains a locale per line
             # in the begining of the line e.g. "en-GB" or "ja linux win32"
-            # getPage returns a defered that will return a string
-            d = getPage(localePage, timeout = 5 * 60)
-            d.addCallback(lambda data: ParseLocalesFile(data))
-            return d
+            return getLocalesFile(localePage, revision)
 
     def createL10nBuilds(self, revision=None, reason=None, set_props=None):
         """
@@ -184,7 +270,7 @@ class TriggerableL10n(Triggerable, L10nMixin):
     locale to build from the 'locale' build property.
     """
 
-    compare_attrs = ('name', 'builderNames', 'branch')
+    compare_attrs = ('name', 'builderNames', 'branch', 'l10nChunks')
 
     def __init__(self, name,  builderNames, **kwargs):
         L10nMixin.__init__(self, **kwargs)
@@ -201,7 +287,7 @@ class DependentL10n(Dependent, L10nMixin):
     'upstream' scheduler has completed successfully.
     """
 
-    compare_attrs = Dependent.compare_attrs[:]
+    compare_attrs = Dependent.compare_attrs + ('l10nChunks',)
 
     def __init__(self, name, upstream, builderNames, **kwargs):
         Dependent.__init__(self, name, upstream, builderNames)
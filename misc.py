@@ -5,8 +5,11 @@ try:
 except:
     import simplejson as json
 import collections
+import fnmatch
+import gc
 import random
 import re
+import resource
 import sys, os, time
 
 from copy import deepcopy
@@ -51,7 +54,8 @@ from buildbotcustom.process.factory import NightlyBuildFactory, \
   NightlyRepackFactory, UnittestBuildFactory, CodeCoverageFactory, \
   UnittestPackagedBuildFactory, TalosFactory, CCNightlyBuildFactory, \
   CCNightlyRepackFactory, CCUnittestBuildFactory, TryBuildFactory, \
-  TryUnittestBuildFactory, ScriptFactory, rc_eval_func
+  TryUnittestBuildFactory, ScriptFactory, rc_eval_func, getFactory, \
+  logFactoryStats
 from buildbotcustom.process.factory import RemoteUnittestFactory
 from buildbotcustom.scheduler import MultiScheduler, BuilderChooserScheduler, \
     PersistentScheduler, makePropertiesScheduler, SpecificNightly
@@ -69,6 +73,42 @@ from mozilla_buildtools.queuedir import QueueDir
 # This file contains misc. helper function that don't make sense to put in
 # other files. For example, functions that are called in a master.cfg
 
+# Set BUILDBOTCUSTOM_PROFILE_RECONFIG in the master's environment to log the
+# time, object counts and memory used by each generate*Objects call.
+profileReconfig = bool(os.environ.get('BUILDBOTCUSTOM_PROFILE_RECONFIG'))
+
+def profileObjects(nameArg=None):
+    """Decorator for functions returning a dict of buildbot objects (builders,
+    schedulers, ...). When profileReconfig is set, logs the wall time spent
+    in the function, how many of each kind of object it returned, the number
+    of live Python objects it added and the growth of the master's peak RSS.
+
+    nameArg is the index of the positional argument naming the branch, and is
+    included in the log message."""
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            if not profileReconfig:
+                return func(*args, **kwargs)
+            objectsBefore = len(gc.get_objects())
+            rssBefore = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            start = time.time()
+            retval = func(*args, **kwargs)
+            elapsed = time.time() - start
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            name = func.__name__
+            if nameArg is not None and len(args) > nameArg:
+                name += "(%s)" % args[nameArg]
+            counts = ", ".join(["%i %s" % (len(v), k)
+                                for k, v in sorted(retval.items())])
+            log.msg("reconfig profile: %s took %.2fs; %s; %i new objects; "
+                    "maxrss grew by %ikB" % (name, elapsed, counts,
+                    len(gc.get_objects()) - objectsBefore, rss - rssBefore))
+            return retval
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
+
 def get_l10n_repositories(file, l10nRepoPath, relbranch):
     """Reads in a list of locale names and revisions for their associated
        repository from 'file'.
@@ -129,13 +169,73 @@ def shouldBuild(change):
     """check for commit message disabling build for this change"""
     return "DONTBUILD" not in change.comments
 
+# For each key passed to sharedFileIsImportant(), the number of changes
+# classified, the number of classifications answered from an earlier
+# scheduler's result and the total time spent classifying.  They aren't
+# logged anywhere; look at them from the manhole.
+classificationStats = {}
+# For each key passed to sharedFileIsImportant(), the results by change
+# number.  Only the most recent maxClassificationResults changes are kept,
+# and reloading this module on reconfig starts over.
+classificationResults = {}
+maxClassificationResults = 1000
+
+def sharedFileIsImportant(key, fileIsImportant):
+    """Returns a wrapper around fileIsImportant that only calls it once per
+    change. Every scheduler that is given a wrapper with the same key shares
+    the result, so key must identify what fileIsImportant checks."""
+    stats = classificationStats.setdefault(key,
+                                           {'changes': 0, 'shared': 0,
+                                            'time': 0.0})
+    results = classificationResults.setdefault(key, {})
+    def _fileIsImportant(change):
+        if change.number in results:
+            stats['shared'] += 1
+            return results[change.number]
+        start = time.time()
+        important = bool(fileIsImportant(change))
+        stats['time'] += time.time() - start
+        stats['changes'] += 1
+        # Changes that aren't in the database yet have no number
+        if change.number is not None:
+            results[change.number] = important
+            if len(results) > maxClassificationResults:
+                for number in sorted(results)[:maxClassificationResults / 2]:
+                    del results[number]
+        return important
+    return _fileIsImportant
+
 def isImportantL10nFile(change, l10nModules):
+    # str.startswith checks all of the modules in one call
+    l10nModules = tuple(l10nModules)
     for f in change.files:
-        for basepath in l10nModules:
-            if f.startswith(basepath):
-                return True
+        if f.startswith(l10nModules):
+            return True
     return False
 
+def makeFileIsImportant(prefixes=(), patterns=()):
+    """Returns a function for use as a scheduler's fileIsImportant that
+    returns True if any of the change's files starts with one of `prefixes`
+    or matches one of the glob `patterns`.
+
+    The prefixes and patterns are only processed once, when the function is
+    created, rather than for every change."""
+    prefixes = tuple(prefixes)
+    if patterns:
+        patternRe = re.compile('|'.join(['(?:%s)' % fnmatch.translate(p)
+                                         for p in patterns]))
+    else:
+        patternRe = None
+
+    def fileIsImportant(change):
+        for f in change.files:
+            if prefixes and f.startswith(prefixes):
+                return True
+            if patternRe and patternRe.match(f):
+                return True
+        return False
+    return fileIsImportant
+
 def changeContainsProduct(change, productName):
     products = change.properties.getProperty("products")
     if isinstance(products, basestring) and \
@@ -347,11 +447,33 @@ def _nextSlowIdleSlave(nReserved):
         return sorted(slow, _recentSort(builder))[-1]
     return _nextslave
 
-nomergeBuilders = []
+class BuilderNameSet(set):
+    """A set of builder names. nomergeBuilders used to be a list, so append
+    and extend are kept as aliases for configs that still use them."""
+    append = set.add
+    extend = set.update
+
+nomergeBuilders = BuilderNameSet()
+
+def getMergeKey(req):
+    """Returns a key for the BuildRequest req such that two requests can be
+    merged if and only if their keys are equal.  This mirrors
+    SourceStamp.canBeMergedWith."""
+    ss = req.source
+    key = (ss.repository, ss.branch, ss.project)
+    if ss.changes:
+        key += ('changes',)
+    elif ss.patch:
+        # Patched builds can't be merged with anything
+        key += ('patch', id(req))
+    else:
+        key += ('revision', ss.revision)
+    return key
+
 def mergeRequests(builder, req1, req2):
     if builder.name in nomergeBuilders:
         return False
-    return req1.canBeMergedWith(req2)
+    return getMergeKey(req1) == getMergeKey(req2)
 
 def mergeBuildObjects(d1, d2):
     retval = d1.copy()
@@ -384,7 +506,7 @@ def generateTestBuilder(config, branch_name, platform, name_prefix,
                   'product': stageProduct}
     if pf.get('is_remote', False):
         hostUtils = pf['host_utils_url']
-        factory = RemoteUnittestFactory(
+        factory = getFactory(RemoteUnittestFactory,
             platform=platform,
             productName=productName,
             hostUtils=hostUtils,
@@ -395,6 +517,8 @@ def generateTestBuilder(config, branch_name, platform, name_prefix,
             branchName=branch_name,
             remoteExtras=pf.get('remote_extras'),
             downloadSymbols=pf.get('download_symbols', True),
+            downloadCacheDir=pf.get('download_cache_dir'),
+            downloadCacheSize=pf.get('download_cache_size'),
         )
         builder = {
             'name': '%s %s' % (name_prefix, suites_name),
@@ -409,7 +533,7 @@ def generateTestBuilder(config, branch_name, platform, name_prefix,
     elif mozharness:
         # suites is a dict!
         extra_args = suites.get('extra_args', [])
-        factory = ScriptFactory(
+        factory = getFactory(ScriptFactory,
             interpreter=mozharness_python,
             scriptRepo=suites['mozharness_repo'],
             scriptName=suites['script_path'],
@@ -437,7 +561,7 @@ def generateTestBuilder(config, branch_name, platform, name_prefix,
         if isinstance(suites, dict) and "totalChunks" in suites:
             totalChunks = suites['totalChunks']
             for i in range(totalChunks):
-                factory = UnittestPackagedBuildFactory(
+                factory = getFactory(UnittestPackagedBuildFactory,
                     platform=platform,
                     test_suites=[suites['suite']],
                     mochitest_leak_threshold=mochitestLeakThreshold,
@@ -456,6 +580,9 @@ def generateTestBuilder(config, branch_name, platform, name_prefix,
                     downloadSymbols=pf.get('download_symbols', True),
                     resetHwClock=resetHwClock,
                     stackwalk_cgi=config.get('stackwalk_cgi'),
+                    downloadCacheDir=pf.get('download_cache_dir'),
+                    downloadCacheSize=pf.get('download_cache_size'),
+                    parallelDownloads=pf.get('parallel_downloads', False),
                 )
                 builder = {
                     'name': '%s %s-%i/%i' % (name_prefix, suites_name, i+1, totalChunks),
@@ -470,7 +597,7 @@ def generateTestBuilder(config, branch_name, platform, name_prefix,
                 }
                 builders.append(builder)
         else:
-            factory = UnittestPackagedBuildFactory(
+            factory = getFactory(UnittestPackagedBuildFactory,
                 platform=platform,
                 test_suites=suites,
                 mochitest_leak_threshold=mochitestLeakThreshold,
@@ -486,6 +613,9 @@ def generateTestBuilder(config, branch_name, platform, name_prefix,
                 env=pf.get('unittest-env', {}),
                 resetHwClock=resetHwClock,
                 stackwalk_cgi=config.get('stackwalk_cgi'),
+                downloadCacheDir=pf.get('download_cache_dir'),
+                downloadCacheSize=pf.get('download_cache_size'),
+                parallelDownloads=pf.get('parallel_downloads', False),
             )
             builder = {
                 'name': '%s %s' % (name_prefix, suites_name),
@@ -500,6 +630,7 @@ def generateTestBuilder(config, branch_name, platform, name_prefix,
             builders.append(builder)
     return builders
 
+@profileObjects(nameArg=1)
 def generateBranchObjects(config, name, secrets=None):
     """name is the name of branch which is usually the last part of the path
        to the repository. For example, 'mozilla-central', 'mozilla-aurora', or
@@ -614,6 +745,8 @@ def generateBranchObjects(config, name, secrets=None):
                     '%s %s %s l10n nightly' % (pf['product_name'].capitalize(),
                                        name, platform)
                 l10nNightlyBuilders[builder]['platform'] = platform
+                l10nNightlyBuilders[builder]['l10n_repack_chunks'] = \
+                    pf.get('l10n_repack_chunks')
             if config['enable_shark'] and pf.get('enable_shark'):
                 nightlyBuilders.append('%s shark' % base_name)
             if config['enable_valgrind'] and \
@@ -728,7 +861,7 @@ def generateBranchObjects(config, name, secrets=None):
         if l10n_binaryURL.endswith('/'):
             l10n_binaryURL = l10n_binaryURL[:-1]
         l10n_binaryURL += "-l10n"
-        nomergeBuilders.extend(l10n_builders)
+        nomergeBuilders.update(l10n_builders)
 
         branchObjects['status'].append(TinderboxMailNotifier(
             fromaddr="bootstrap@mozilla.com",
@@ -807,15 +940,17 @@ def generateBranchObjects(config, name, secrets=None):
         scheduler_class = makePropertiesScheduler(Scheduler, [buildIDSchedFunc, buildUIDSchedFunc])
 
     if not config.get('enable_merging', True):
-        nomergeBuilders.extend(builders + unittestBuilders + debugBuilders)
-    nomergeBuilders.extend(periodicPgoBuilders) # these should never, ever merge
+        nomergeBuilders.update(builders + unittestBuilders + debugBuilders)
+    nomergeBuilders.update(periodicPgoBuilders) # these should never, ever merge
     extra_args['treeStableTimer'] = None
 
     branchObjects['schedulers'].append(scheduler_class(
         name=name,
         branch=config['repo_path'],
         builderNames=builders + unittestBuilders + debugBuilders,
-        fileIsImportant=lambda c: isHgPollerTriggered(c, config['hgurl']) and shouldBuild(c),
+        fileIsImportant=sharedFileIsImportant(
+            'hgpoller %s' % config['hgurl'],
+            lambda c: isHgPollerTriggered(c, config['hgurl']) and shouldBuild(c)),
         **extra_args
     ))
 
@@ -829,7 +964,9 @@ def generateBranchObjects(config, name, secrets=None):
             branch=config['l10n_repo_path'],
             treeStableTimer=None,
             builderNames=l10n_builders,
-            fileIsImportant=lambda c: isImportantL10nFile(c, config['l10n_modules']),
+            fileIsImportant=sharedFileIsImportant(
+                'l10n %s' % ','.join(config['l10n_modules']),
+                makeFileIsImportant(prefixes=config['l10n_modules'])),
             properties={
                 'app': 'browser',
                 'en_revision': 'default',
@@ -842,7 +979,7 @@ def generateBranchObjects(config, name, secrets=None):
         for test in test_builders:
             unittestSuites.append(test.split(' ')[-1])
         if not merge:
-            nomergeBuilders.extend(test_builders)
+            nomergeBuilders.update(test_builders)
         extra_args = {}
         if config.get('enable_try'):
             scheduler_class = BuilderChooserScheduler
@@ -923,7 +1060,8 @@ def generateBranchObjects(config, name, secrets=None):
                                    builderNames=[l10n_builder],
                                    branch=config['repo_path'],
                                    baseTag='default',
-                                   localesURL=config.get('localesURL', None)
+                                   localesURL=config.get('localesURL', None),
+                                   l10nChunks=l10nNightlyBuilders[builder]['l10n_repack_chunks']
                                   ))
 
     weekly_scheduler = Nightly(
@@ -1089,7 +1227,7 @@ def generateBranchObjects(config, name, secrets=None):
                 # We deal with turning on PGO for these old branches in the actual factory
                 factory_kwargs['profiledBuild'] = False
 
-            mozilla2_dep_factory = factory_class(**factory_kwargs)
+            mozilla2_dep_factory = getFactory(factory_class, **factory_kwargs)
             mozilla2_dep_builder = {
                 'name': '%s build' % pf['base_name'],
                 'slavenames': pf['slaves'],
@@ -1116,7 +1254,7 @@ def generateBranchObjects(config, name, secrets=None):
                 pgo_kwargs['profiledBuild'] = True
                 pgo_kwargs['stagePlatform'] += '-pgo'
                 pgo_kwargs['unittestBranch'] = pgoUnittestBranch
-                pgo_factory = factory_class(**pgo_kwargs)
+                pgo_factory = getFactory(factory_class, **pgo_kwargs)
                 pgo_builder = {
                     'name': '%s pgo-build' % pf['base_name'],
                     'slavenames': pf['slaves'],
@@ -1750,8 +1888,10 @@ def generateBranchObjects(config, name, secrets=None):
         }
         branchObjects['builders'].append(bundle_builder)
 
+    logFactoryStats(name)
     return branchObjects
 
+@profileObjects(nameArg=1)
 def generateCCBranchObjects(config, name, secrets=None):
     """name is the name of branch which is usually the last part of the path
        to the repository. For example, 'comm-central-trunk', or 'comm-aurora'
@@ -1866,6 +2006,8 @@ def generateCCBranchObjects(config, name, secrets=None):
                     '%s %s %s l10n nightly' % (pf['product_name'].capitalize(),
                                        name, platform)
                 l10nNightlyBuilders[builder]['platform'] = platform
+                l10nNightlyBuilders[builder]['l10n_repack_chunks'] = \
+                    pf.get('l10n_repack_chunks')
             if config['enable_shark'] and pf.get('enable_shark'):
                 nightlyBuilders.append('%s shark' % base_name)
             if config['enable_valgrind'] and \
@@ -1981,7 +2123,7 @@ def generateCCBranchObjects(config, name, secrets=None):
         if l10n_binaryURL.endswith('/'):
             l10n_binaryURL = l10n_binaryURL[:-1]
         l10n_binaryURL += "-l10n"
-        nomergeBuilders.extend(l10n_builders)
+        nomergeBuilders.update(l10n_builders)
 
         branchObjects['status'].append(TinderboxMailNotifier(
             fromaddr="comm.buildbot@build.mozilla.org",
@@ -2072,15 +2214,17 @@ def generateCCBranchObjects(config, name, secrets=None):
         scheduler_class = makePropertiesScheduler(Scheduler, [buildIDSchedFunc, buildUIDSchedFunc])
 
     if not config.get('enable_merging', True):
-        nomergeBuilders.extend(builders + unittestBuilders + debugBuilders)
-    nomergeBuilders.extend(periodicPgoBuilders) # these should never, ever merge
+        nomergeBuilders.update(builders + unittestBuilders + debugBuilders)
+    nomergeBuilders.update(periodicPgoBuilders) # these should never, ever merge
     extra_args['treeStableTimer'] = None
 
     branchObjects['schedulers'].append(scheduler_class(
         name=name,
         branch=config['repo_path'],
         builderNames=builders + unittestBuilders + debugBuilders,
-        fileIsImportant=lambda c: isHgPollerTriggered(c, config['hgurl']) and shouldBuild(c),
+        fileIsImportant=sharedFileIsImportant(
+            'hgpoller %s' % config['hgurl'],
+            lambda c: isHgPollerTriggered(c, config['hgurl']) and shouldBuild(c)),
         **extra_args
     ))
 
@@ -2094,7 +2238,9 @@ def generateCCBranchObjects(config, name, secrets=None):
             branch=config['l10n_repo_path'],
             treeStableTimer=None,
             builderNames=l10n_builders,
-            fileIsImportant=lambda c: isImportantL10nFile(c, config['l10n_modules']),
+            fileIsImportant=sharedFileIsImportant(
+                'l10n %s' % ','.join(config['l10n_modules']),
+                makeFileIsImportant(prefixes=config['l10n_modules'])),
             properties={
                 'app': pf['app_name'],
                 'en_revision': 'default',
@@ -2107,7 +2253,7 @@ def generateCCBranchObjects(config, name, secrets=None):
         for test in test_builders:
             unittestSuites.append(test.split(' ')[-1])
         if not merge:
-            nomergeBuilders.extend(test_builders)
+            nomergeBuilders.update(test_builders)
         extra_args = {}
         if config.get('enable_try'):
             scheduler_class = BuilderChooserScheduler
@@ -2188,7 +2334,8 @@ def generateCCBranchObjects(config, name, secrets=None):
                                    builderNames=[l10n_builder],
                                    branch=config['repo_path'],
                                    baseTag='default',
-                                   localesURL=config.get('localesURL', None)
+                                   localesURL=config.get('localesURL', None),
+                                   l10nChunks=l10nNightlyBuilders[builder]['l10n_repack_chunks']
                                   ))
 
     weekly_scheduler = Nightly(
@@ -2358,7 +2505,7 @@ def generateCCBranchObjects(config, name, secrets=None):
                 # We deal with turning on PGO for these old branches in the actual factory
                 factory_kwargs['profiledBuild'] = False
 
-            mozilla2_dep_factory = factory_class(**factory_kwargs)
+            mozilla2_dep_factory = getFactory(factory_class, **factory_kwargs)
             mozilla2_dep_builder = {
                 'name': '%s build' % pf['base_name'],
                 'slavenames': pf['slaves'],
@@ -2385,7 +2532,7 @@ def generateCCBranchObjects(config, name, secrets=None):
                 pgo_kwargs['profiledBuild'] = True
                 pgo_kwargs['stagePlatform'] += '-pgo'
                 pgo_kwargs['unittestBranch'] = pgoUnittestBranch
-                pgo_factory = factory_class(**pgo_kwargs)
+                pgo_factory = getFactory(factory_class, **pgo_kwargs)
                 pgo_builder = {
                     'name': '%s pgo-build' % pf['base_name'],
                     'slavenames': pf['slaves'],
@@ -3034,9 +3181,11 @@ def generateCCBranchObjects(config, name, secrets=None):
         }
         branchObjects['builders'].append(bundle_builder)
 
+    logFactoryStats(name)
     return branchObjects
 
 
+@profileObjects(nameArg=0)
 def generateTalosBranchObjects(branch, branch_config, PLATFORMS, SUITES,
         ACTIVE_UNITTEST_PLATFORMS, factory_class=TalosFactory):
     branchObjects = {'schedulers': [], 'builders': [], 'status': [], 'change_source': []}
@@ -3138,7 +3287,7 @@ def generateTalosBranchObjects(branch, branch_config, PLATFORMS, SUITES,
 
                     builddir = "%s_%s_test-%s" % (branch, slave_platform, suite)
                     slavebuilddir= 'test'
-                    factory = factory_class(**factory_kwargs)
+                    factory = getFactory(factory_class, **factory_kwargs)
                     builder = {
                         'name': "%s %s talos %s" % (platform_name, branch, suite),
                         'slavenames': platform_config[slave_platform]['slaves'],
@@ -3157,7 +3306,7 @@ def generateTalosBranchObjects(branch, branch_config, PLATFORMS, SUITES,
                     }
 
                     if not merge:
-                        nomergeBuilders.append(builder['name'])
+                        nomergeBuilders.add(builder['name'])
 
                     talos_builders.setdefault(tests, []).append(builder['name'])
                     branchObjects['builders'].append(builder)
@@ -3168,7 +3317,7 @@ def generateTalosBranchObjects(branch, branch_config, PLATFORMS, SUITES,
                         pgo_factory_kwargs = factory_kwargs.copy()
                         pgo_factory_kwargs['branchName'] = branchName
                         pgo_factory_kwargs['talosBranch'] = talosBranch
-                        pgo_factory = factory_class(**pgo_factory_kwargs)
+                        pgo_factory = getFactory(factory_class, **pgo_factory_kwargs)
                         pgo_builder = {
                             'name': "%s %s pgo talos %s" % (platform_name, branch, suite),
                             'slavenames': platform_config[slave_platform]['slaves'],
@@ -3187,7 +3336,7 @@ def generateTalosBranchObjects(branch, branch_config, PLATFORMS, SUITES,
                         }
 
                         if not merge:
-                            nomergeBuilders.append(pgo_builder['name'])
+                            nomergeBuilders.add(pgo_builder['name'])
                         branchObjects['builders'].append(pgo_builder)
                         talos_pgo_builders.setdefault(tests, []).append(pgo_builder['name'])
                         branch_builders[tinderboxTree].append(pgo_builder['name'])
@@ -3270,7 +3419,7 @@ def generateTalosBranchObjects(branch, branch_config, PLATFORMS, SUITES,
                                 unittestSuites.append(test.split(' ')[-1])
                             scheduler_branch = ('%s-%s-%s-unittest' % (branch, platform, test_type))
                             if not merge:
-                                nomergeBuilders.extend(test_builders)
+                                nomergeBuilders.update(test_builders)
                             extra_args = {}
                             if branch == "try":
                                 scheduler_class = BuilderChooserScheduler
@@ -3292,7 +3441,7 @@ def generateTalosBranchObjects(branch, branch_config, PLATFORMS, SUITES,
                                 unittestSuites.append(test.split(' ')[-1])
                             scheduler_branch = '%s-%s-pgo-unittest' % (branch, platform)
                             if not merge:
-                                nomergeBuilders.extend(pgo_builders)
+                                nomergeBuilders.update(pgo_builders)
                             extra_args = {}
                             if branch == "try":
                                 scheduler_class = BuilderChooserScheduler
@@ -3404,6 +3553,7 @@ def generateTalosBranchObjects(branch, branch_config, PLATFORMS, SUITES,
                 branch_config, PLATFORMS, SUITES, ACTIVE_UNITTEST_PLATFORMS, factory_class)
         for k,v in releaseObjects.items():
             branchObjects[k].extend(v)
+    logFactoryStats(branch)
     return branchObjects
 
 def generateTalosReleaseBranchObjects(branch, branch_config, PLATFORMS, SUITES,
@@ -3487,7 +3637,7 @@ def generateFuzzingObjects(config, SLAVES):
                    'env': env,
                   }
         builders.append(builder)
-        nomergeBuilders.append(builder)
+        nomergeBuilders.add(builder['name'])
     fuzzing_scheduler = PersistentScheduler(
             name="fuzzer",
             builderNames=[b['name'] for b in builders],
@@ -3533,7 +3683,7 @@ def generateNanojitObjects(config, SLAVES):
                    'properties': {'branch': branch},
                   }
         builders.append(builder)
-        nomergeBuilders.append(builder)
+        nomergeBuilders.add(builder['name'])
 
     # Set up polling
     poller = HgPoller(
@@ -3612,19 +3762,13 @@ def generateSpiderMonkeyObjects(config, SLAVES):
                     }
             builders.append(builder)
 
-    def isImportant(change):
-        for f in change.files:
-            if f.startswith("js/src"):
-                return True
-        return False
-
     # Set up scheduler
     scheduler = Scheduler(
             name="%s_spidermonkey" % branch,
             branch=config['repo_path'],
             treeStableTimer=None,
             builderNames=[b['name'] for b in builders],
-            fileIsImportant=isImportant,
+            fileIsImportant=makeFileIsImportant(prefixes=["js/src"]),
             )
 
     # Tinderbox notifier
@@ -3678,7 +3822,7 @@ def generateJetpackObjects(config, SLAVES):
                            'env': MozillaEnvironments.get("%s" % config['platforms'][platform].get('env'), {}).copy(),
                           }
                 builders.append(builder)
-                nomergeBuilders.append(builder)
+                nomergeBuilders.add(builder['name'])
 
     # Set up polling
     poller = HgPoller(
@@ -4,6 +4,7 @@ from datetime import datetime
 import os.path, re
 import urllib
 import random
+import time
 
 from twisted.python import log
 
@@ -55,12 +56,14 @@ from buildbotcustom.steps.base import ShellCommand, SetProperty, Mercurial, \
   Trigger, RetryingShellCommand, RetryingSetProperty
 from buildbotcustom.steps.misc import TinderboxShellCommand, SendChangeStep, \
   GetBuildID, MozillaClobberer, FindFile, DownloadFile, UnpackFile, \
+  DownloadAndUnpackFiles, SetFileProperties, isAbsolutePath, \
   SetBuildProperty, DisconnectStep, OutputStep, ScratchboxCommand, \
   RepackPartners, UnpackTest, FunctionalStep, setBuildIDProps, \
   RetryingScratchboxProperty
 from buildbotcustom.steps.release import UpdateVerify, L10nVerifyMetaDiff, \
   SnippetComparison
-from buildbotcustom.steps.source import MercurialCloneCommand
+from buildbotcustom.steps.source import MercurialCloneCommand, \
+  hgUpdateOrCloneCommand, hgUpdateOrCloneEvaluator
 from buildbotcustom.steps.test import AliveTest, \
   CompareLeakLogs, Codesighs, GraphServerPost
 from buildbotcustom.steps.updates import CreateCompleteUpdateSnippet, \
@@ -68,7 +71,7 @@ from buildbotcustom.steps.updates import CreateCompleteUpdateSnippet, \
 from buildbotcustom.steps.signing import SigningServerAuthenication
 from buildbotcustom.env import MozillaEnvironments
 from buildbotcustom.common import getSupportedPlatforms, getPlatformFtpDir, \
-  genBuildID, reallyShort
+  genBuildID, genBuildIDNumber, reallyShort
 
 import buildbotcustom.steps.unittest as unittest_steps
 
@@ -111,6 +114,66 @@ def makeDummyBuilder(name, slaves, category=None, delay=0, triggers=None):
         builder['category'] = category
     return builder
 
+# Factories created through getFactory() are shared by every builder that
+# asks for the same factory class with the same arguments.  misc.py reloads
+# this module on every reconfig, which also throws this cache away, so stale
+# factories never outlive the configuration that created them.
+_factoryCache = {}
+# Maps factory class name to a dict of 'built' and 'reused' counts and the
+# total 'time' spent in the constructor, see logFactoryStats()
+factoryStats = {}
+
+def _factoryCacheKey(value):
+    """Returns a hashable representation of a factory argument, raising
+    TypeError if the argument can't be compared by value."""
+    if isinstance(value, dict):
+        return (dict, tuple(sorted([(k, _factoryCacheKey(v))
+                                    for k, v in value.iteritems()])))
+    if isinstance(value, (list, tuple)):
+        return (value.__class__,
+                tuple([_factoryCacheKey(v) for v in value]))
+    hash(value)
+    # Include the class so that 1, 1.0 and True don't collide
+    return (value.__class__, value)
+
+def getFactory(factoryClass, **kwargs):
+    """Returns factoryClass(**kwargs), reusing a factory created earlier
+    with the same class and arguments when there is one.
+
+    Factories are only templates for builds, so a single instance can be
+    shared between builders.  Arguments that can't be compared by value
+    (e.g. lambdas) simply result in a new factory."""
+    stats = factoryStats.setdefault(factoryClass.__name__,
+                                    {'built': 0, 'reused': 0, 'time': 0.0})
+    try:
+        key = (factoryClass, _factoryCacheKey(kwargs))
+    except TypeError:
+        key = None
+
+    if key is not None and key in _factoryCache:
+        stats['reused'] += 1
+        return _factoryCache[key]
+
+    start = time.time()
+    factory = factoryClass(**kwargs)
+    stats['time'] += time.time() - start
+    stats['built'] += 1
+    if key is not None:
+        _factoryCache[key] = factory
+    return factory
+
+def logFactoryStats(label):
+    """Logs how many factories of each class were built or reused by
+    getFactory() and the time spent building them, slowest first, then
+    resets the counts so that the next call only covers what came after.
+    label says what the factories were built for, e.g. a branch name."""
+    items = sorted(factoryStats.items(), key=lambda i: i[1]['time'],
+                   reverse=True)
+    for name, stats in items:
+        log.msg("factory %s %s: %i built, %i reused, %.2fs" %
+                (label, name, stats['built'], stats['reused'], stats['time']))
+    factoryStats.clear()
+
 def postUploadCmdPrefix(upload_dir=None,
         branch=None,
         product=None,
@@ -352,7 +415,7 @@ class RequestSortingBuildFactory(BuildFactory):
             # Catch things like "The web-page 'rebuild' ...", or self-serve
             # messages, "Rebuilt by ..."
             if 'rebuil' in request.reason.lower():
-                return int(genBuildID(request.submittedAt))
+                return genBuildIDNumber(request.submittedAt)
 
             buildids = []
 
@@ -366,7 +429,7 @@ class RequestSortingBuildFactory(BuildFactory):
 
             if buildids:
                 return max(buildids)
-            return int(genBuildID(request.submittedAt))
+            return genBuildIDNumber(request.submittedAt)
 
         try:
             sorted_requests = sorted(requests, key=sortkey)
@@ -446,15 +509,13 @@ class MozillaBuildFactory(RequestSortingBuildFactory):
             property='builddir',
             workdir='.',
         ))
-        self.addStep(ShellCommand(
-         name='rm_buildtools',
-         command=['rm', '-rf', 'tools'],
-         description=['clobber', 'build tools'],
-         workdir='.'
-        ))
+        # Keep the tools checkout between builds and only pull what's new;
+        # it is recloned if it is missing or broken
         self.addStep(MercurialCloneCommand(
          name='clone_buildtools',
-         command=['hg', 'clone', self.buildToolsRepo, 'tools'],
+         command=hgUpdateOrCloneCommand(self.buildToolsRepo, 'tools',
+                    WithProperties('%(tools_revision:-default)s')),
+         log_eval_func=hgUpdateOrCloneEvaluator,
          description=['clone', 'build tools'],
          workdir='.',
          retry=False
@@ -578,73 +639,20 @@ class MozillaBuildFactory(RequestSortingBuildFactory):
             return False
         return packageFilename
 
-    def parseFileSize(self, propertyName):
-        def getSize(rv, stdout, stderr):
-            stdout = stdout.strip()
-            return {propertyName: stdout.split()[4]}
-        return getSize
-
-    def parseFileHash(self, propertyName):
-        def getHash(rv, stdout, stderr):
-            stdout = stdout.strip()
-            return {propertyName: stdout.split(' ',2)[1]}
-        return getHash
-
-    def unsetFilepath(self, rv, stdout, stderr):
-        return {'filepath': None}
-
     def addFilePropertiesSteps(self, filename, directory, fileType, 
                                doStepIf=True, maxDepth=1, haltOnFailure=False):
-        self.addStep(FindFile(
-            name='find_filepath',
-            description=['find', 'filepath'],
+        self.addStep(SetFileProperties(
+            name='set_'+fileType.lower()+'_properties',
+            description=['set', fileType.lower(), 'properties'],
             doStepIf=doStepIf,
             filename=filename,
             directory=directory,
-            filetype='file',
-            max_depth=maxDepth,
-            property_name='filepath',
+            fileType=fileType,
+            hashTypes=[self.hashType],
+            maxDepth=maxDepth,
             workdir='.',
             haltOnFailure=haltOnFailure
         ))
-        self.addStep(SetProperty(
-            description=['set', fileType.lower(), 'filename'],
-            doStepIf=doStepIf,
-            command=['basename', WithProperties('%(filepath)s')],
-            property=fileType+'Filename',
-            workdir='.',
-            name='set_'+fileType.lower()+'_filename',
-            haltOnFailure=haltOnFailure
-        ))
-        self.addStep(SetProperty(
-            description=['set', fileType.lower(), 'size',],
-            doStepIf=doStepIf,
-            command=['bash', '-c', 
-                     WithProperties("ls -l %(filepath)s")],
-            workdir='.',
-            name='set_'+fileType.lower()+'_size',
-            extract_fn = self.parseFileSize(propertyName=fileType+'Size'),
-            haltOnFailure=haltOnFailure
-        ))
-        self.addStep(SetProperty(
-            description=['set', fileType.lower(), 'hash',],
-            doStepIf=doStepIf,
-            command=['bash', '-c', 
-                     WithProperties('openssl ' + 'dgst -' + self.hashType +
-                                    ' %(filepath)s')],
-            workdir='.',
-            name='set_'+fileType.lower()+'_hash',
-            extract_fn=self.parseFileHash(propertyName=fileType+'Hash'),
-            haltOnFailure=haltOnFailure
-        ))
-        self.addStep(SetProperty(
-            description=['unset', 'filepath',],
-            doStepIf=doStepIf,
-            name='unset_filepath',
-            command='echo "filepath:"',
-            workdir=directory,
-            extract_fn = self.unsetFilepath,
-        ))
 
     def makeHgtoolStep(self, name='hg_update', repo_url=None, wc=None,
             mirrors=None, bundles=None, env=None,
@@ -3083,6 +3091,10 @@ class BaseRepackFactory(MozillaBuildFactory):
         if stageSshKey:
             self.uploadEnv['UPLOAD_SSH_KEY'] = '~/.ssh/%s' % stageSshKey
 
+        # Indexes of the setup steps that are specific to the locale, and of
+        # the first step of the repack itself. These are repeated for each
+        # locale in builds that repack several locales; see newBuild.
+        self.perLocaleSteps = []
         self.preClean()
 
         # Need to override toolsdir as set by MozillaBuildFactory because
@@ -3107,9 +3119,12 @@ class BaseRepackFactory(MozillaBuildFactory):
         self.updateSources()
         self.getMozconfig()
         self.configure()
-        self.tinderboxPrintBuildInfo()
         self.downloadBuilds()
         self.updateEnUS()
+        # Everything above is shared by all of the locales in a batched
+        # build; everything below is run again for each of them
+        self.localeStepsStart = len(self.steps)
+        self.tinderboxPrintBuildInfo()
         self.tinderboxPrintRevisions()
         self.compareLocalesSetup()
         self.compareLocales()
@@ -3120,6 +3135,58 @@ class BaseRepackFactory(MozillaBuildFactory):
         if self.testPrettyNames:
             self.doTestPrettyNames()
 
+    def addPerLocaleStep(self, step):
+        '''Add a setup step that needs to be run again for each locale in
+        builds that repack several, e.g. getting the locale's source.
+        '''
+        self.perLocaleSteps.append(len(self.steps))
+        self.addStep(step)
+
+    def newBuild(self, requests):
+        '''Builds requested with a 'locales' property repack each of the
+        listed locales in turn, sharing the en-US checkout and configure
+        steps between them.
+        '''
+        b = MozillaBuildFactory.newBuild(self, requests)
+        locales = []
+        l10n_revision = None
+        for r in requests:
+            for locale in r.properties.getProperty('locales', []):
+                if locale not in locales:
+                    locales.append(locale)
+            l10n_revision = r.properties.getProperty('l10n_revision',
+                                                     l10n_revision)
+        if locales:
+            b.setStepFactories(self.getLocaleStepFactories(locales,
+                                                           l10n_revision))
+        return b
+
+    def getLocaleStepFactories(self, locales, l10n_revision=None):
+        '''Return the step factories for a build that repacks all of
+        locales.
+        '''
+        shared = [s for i, s in enumerate(self.steps[:self.localeStepsStart])
+                  if i not in self.perLocaleSteps]
+        perLocale = [self.steps[i] for i in self.perLocaleSteps] + \
+                    self.steps[self.localeStepsStart:]
+        steps = list(shared)
+        for locale in locales:
+            steps.append(SetBuildProperty(
+             name='set_locale',
+             property_name='locale',
+             value=locale,
+            ).getStepFactory())
+            if l10n_revision:
+                # updateSources replaces l10n_revision with the previous
+                # locale's revision
+                steps.append(SetBuildProperty(
+                 name='reset_l10n_revision',
+                 property_name='l10n_revision',
+                 value=l10n_revision,
+                ).getStepFactory())
+            steps.extend(perLocale)
+        return steps
+
     def processCommand(self, **kwargs):
         '''This function is overriden by MaemoNightlyRepackFactory to
         adjust the command and workdir approprietaly for scratchbox
@@ -3257,7 +3324,7 @@ class BaseRepackFactory(MozillaBuildFactory):
                 use_properties=False,
                 mirrors=[],
                 )
-        self.addStep(step)
+        self.addPerLocaleStep(step)
 
     def updateEnUS(self):
         '''Update the en-US source files to the revision used by
@@ -3344,7 +3411,7 @@ class BaseRepackFactory(MozillaBuildFactory):
         pass
 
     def preClean(self):
-        self.addStep(ShellCommand(
+        self.addPerLocaleStep(ShellCommand(
          name='rm_dist_upload',
          command=['sh', '-c',
                   'if [ -d '+self.mozillaObjdir+'/dist/upload ]; then ' +
@@ -3355,7 +3422,7 @@ class BaseRepackFactory(MozillaBuildFactory):
          haltOnFailure=True
         ))
 
-        self.addStep(ShellCommand(
+        self.addPerLocaleStep(ShellCommand(
          name='rm_dist_update',
          command=['sh', '-c',
                   'if [ -d '+self.mozillaObjdir+'/dist/update ]; then ' +
@@ -3582,14 +3649,14 @@ class NightlyRepackFactory(BaseRepackFactory, NightlyBuildFactory):
             return self.ausFullUploadDir
 
     def updateSources(self):
-        self.addStep(ShellCommand(
+        self.addPerLocaleStep(ShellCommand(
          name='update_locale_source',
          command=['hg', 'up', '-C', '-r', self.l10nTag],
          description='update workdir',
          workdir=WithProperties('build/' + self.l10nRepoPath + '/%(locale)s'),
          haltOnFailure=True
         ))
-        self.addStep(SetProperty(
+        self.addPerLocaleStep(SetProperty(
                      command=['hg', 'ident', '-i'],
                      haltOnFailure=True,
                      property='l10n_revision',
@@ -3871,7 +3938,7 @@ class CCReleaseRepackFactory(CCBaseRepackFactory, ReleaseFactory):
          haltOnFailure=True,
          timeout=30*60 # 30 minutes
         ))
-        self.addStep(MercurialCloneCommand(
+        self.addPerLocaleStep(MercurialCloneCommand(
          name='get_locale_src',
          command=['sh', '-c',
           WithProperties('if [ -d %(locale)s/.hg ]; then ' +
@@ -3931,13 +3998,13 @@ class CCReleaseRepackFactory(CCBaseRepackFactory, ReleaseFactory):
                       'to %s' % self.buildRevision],
          haltOnFailure=True
         ))
-        self.addStep(ShellCommand(
+        self.addPerLocaleStep(ShellCommand(
          name='update_locale_sources',
          command=['hg', 'up', '-C', '-r', self.buildRevision],
          workdir=WithProperties('build/' + self.l10nRepoPath + '/%(locale)s'),
          description=['update to', self.buildRevision]
         ))
-        self.addStep(SetProperty(
+        self.addPerLocaleStep(SetProperty(
                      command=['hg', 'ident', '-i'],
                      haltOnFailure=True,
                      property='l10n_revision',
@@ -6527,12 +6594,44 @@ def parse_sendchange_files(build, include_substr='', exclude_substrs=[]):
     assert len(potential_files) == 1, 'Ambiguous testing sendchange!'
     return potential_files[0]
 
+def get_test_build_url(build):
+    '''Make sure that there is at least one build in the file list'''
+    assert len(build.source.changes[-1].files) > 0, 'Unittest sendchange has no files'
+    return parse_sendchange_files(build, exclude_substrs=['.crashreporter-symbols.',
+                                           '.tests.'])
+
+def get_test_symbols_url(build):
+    '''If there are two files, we assume that the second file is the tests tarball
+    and use the same location as the build, with the build's file extension replaced
+    with .crashreporter-symbols.zip.  If there are three or more files then we figure
+    out which is the real file'''
+    if len(build.source.changes[-1].files) < 3:
+        build_url = build.getProperty('build_url')
+        for suffix in ('.tar.bz2', '.zip', '.dmg', '.exe', '.apk'):
+            if build_url.endswith(suffix):
+                return build_url[:-len(suffix)] + '.crashreporter-symbols.zip'
+    else:
+        return parse_sendchange_files(build, include_substr='.crashreporter-symbols.')
+
+def get_test_tests_url(build):
+    '''If there is only one file, we assume that the tests package is at
+    the same location with the file extension of the browser replaced with
+    .tests.tar.bz2, otherwise we try to find the explicit file'''
+    if len(build.source.changes[-1].files) < 2:
+        build_url = build.getProperty('build_url')
+        for suffix in ('.tar.bz2', '.zip', '.dmg', '.exe'):
+            if build_url.endswith(suffix):
+                return build_url[:-len(suffix)] + '.tests.tar.bz2'
+    else:
+        return parse_sendchange_files(build, include_substr='.tests.')
+
 
 class MozillaTestFactory(MozillaBuildFactory):
     def __init__(self, platform, productName='firefox',
                  downloadSymbols=True, downloadTests=False,
                  posixBinarySuffix='-bin', resetHwClock=False, stackwalk_cgi=None,
-                 **kwargs):
+                 downloadCacheDir=None, downloadCacheSize=None,
+                 parallelDownloads=False, **kwargs):
         #Note: the posixBinarySuffix is needed because some products (firefox)
         #use 'firefox-bin' and some (fennec) use 'fennec' for the name of the
         #actual application binary.  This is only applicable to posix-like
@@ -6549,6 +6648,18 @@ class MozillaTestFactory(MozillaBuildFactory):
         self.downloadTests = downloadTests
         self.resetHwClock = resetHwClock
         self.stackwalk_cgi = stackwalk_cgi
+        # downloadCacheDir must be an absolute path on the slave, e.g.
+        # '/builds/download-cache', so that every suite and chunk builder on
+        # the slave shares it; a relative path would give each builder its
+        # own cache.  Put it where purge_builds.py reclaims it like any other
+        # build directory when the slave runs short of space.
+        # downloadCacheSize is the budget in MB.
+        assert downloadCacheDir is None or isAbsolutePath(downloadCacheDir), \
+                "downloadCacheDir must be absolute: %s" % downloadCacheDir
+        self.downloadCacheDir = downloadCacheDir
+        self.downloadCacheSize = downloadCacheSize
+        # Fetch the build, symbols and tests at once in a single step
+        self.parallelDownloads = parallelDownloads
 
         assert self.platform in getSupportedPlatforms()
 
@@ -6559,6 +6670,8 @@ class MozillaTestFactory(MozillaBuildFactory):
             self.ignoreCerts = True
 
         self.addCleanupSteps()
+        if self.parallelDownloads:
+            self.addPrepareArtifactsSteps()
         self.addPrepareBuildSteps()
         if self.downloadSymbols:
             self.addPrepareSymbolsSteps()
@@ -6595,6 +6708,13 @@ class MozillaTestFactory(MozillaBuildFactory):
 
         MozillaBuildFactory.addInitialSteps(self)
 
+    def getDownloadCacheArgs(self):
+        '''Returns the DownloadFile arguments to use the download cache'''
+        if not self.downloadCacheDir:
+            return {}
+        return {'cache_dir': self.downloadCacheDir,
+                'cache_size': self.downloadCacheSize}
+
     def addCleanupSteps(self):
         '''Clean up the relevant places before starting a build'''
         #On windows, we should try using cmd's attrib and native rmdir
@@ -6604,29 +6724,63 @@ class MozillaTestFactory(MozillaBuildFactory):
             workdir='.'
         ))
 
-    def addPrepareBuildSteps(self):
-        '''This function understands how to prepare a build for having tests run
-        against it.  It downloads, unpacks then sets important properties for use
-        during testing'''
-        def get_build_url(build):
-            '''Make sure that there is at least one build in the file list'''
-            assert len(build.source.changes[-1].files) > 0, 'Unittest sendchange has no files'
-            return parse_sendchange_files(build, exclude_substrs=['.crashreporter-symbols.',
-                                                   '.tests.'])
-        self.addStep(DownloadFile(
-            url_fn=get_build_url,
+    def addPrepareArtifactsSteps(self):
+        '''Downloads the build, symbols and tests in one step, unpacking the
+        build and symbols as they arrive.  This replaces the separate download
+        and unpack steps of addPrepare{Build,Symbols,Tests}Steps'''
+        artifacts = [dict(
+            name='build',
+            url_fn=get_test_build_url,
             filename_property='build_filename',
             url_property='build_url',
-            haltOnFailure=True,
-            ignore_certs=self.ignoreCerts,
-            name='download_build',
-        ))
-        self.addStep(UnpackFile(
-            filename=WithProperties('%(build_filename)s'),
             scripts_dir='../tools/buildfarm/utils',
+            **self.getDownloadCacheArgs()
+        )]
+        if self.downloadSymbols and not self.stackwalk_cgi:
+            artifacts.append(dict(
+                name='symbols',
+                url_fn=get_test_symbols_url,
+                filename_property='symbols_filename',
+                url_property='symbols_url',
+                subdir='symbols',
+                **self.getDownloadCacheArgs()
+            ))
+        if self.downloadTests:
+            artifacts.append(dict(
+                name='tests',
+                url_fn=get_test_tests_url,
+                filename_property='tests_filename',
+                url_property='tests_url',
+                unpack=False,
+                **self.getDownloadCacheArgs()
+            ))
+        self.addStep(DownloadAndUnpackFiles(
+            artifacts=artifacts,
             haltOnFailure=True,
-            name='unpack_build',
+            ignore_certs=self.ignoreCerts,
+            name='download_and_unpack',
         ))
+
+    def addPrepareBuildSteps(self):
+        '''This function understands how to prepare a build for having tests run
+        against it.  It downloads, unpacks then sets important properties for use
+        during testing'''
+        if not self.parallelDownloads:
+            self.addStep(DownloadFile(
+                url_fn=get_test_build_url,
+                filename_property='build_filename',
+                url_property='build_url',
+                haltOnFailure=True,
+                ignore_certs=self.ignoreCerts,
+                name='download_build',
+                **self.getDownloadCacheArgs()
+            ))
+            self.addStep(UnpackFile(
+                filename=WithProperties('%(build_filename)s'),
+                scripts_dir='../tools/buildfarm/utils',
+                haltOnFailure=True,
+                name='unpack_build',
+            ))
         # Find the application binary!
         if self.platform.startswith('macosx'):
             self.addStep(FindFile(
@@ -6667,58 +6821,38 @@ class MozillaTestFactory(MozillaBuildFactory):
 
     def addPrepareSymbolsSteps(self):
         '''This function knows how to setup the symbols for a build to be useful'''
-        def get_symbols_url(build):
-            '''If there are two files, we assume that the second file is the tests tarball
-            and use the same location as the build, with the build's file extension replaced
-            with .crashreporter-symbols.zip.  If there are three or more files then we figure
-            out which is the real file'''
-            if len(build.source.changes[-1].files) < 3:
-                build_url = build.getProperty('build_url')
-                for suffix in ('.tar.bz2', '.zip', '.dmg', '.exe', '.apk'):
-                    if build_url.endswith(suffix):
-                        return build_url[:-len(suffix)] + '.crashreporter-symbols.zip'
-            else:
-                return parse_sendchange_files(build, include_substr='.crashreporter-symbols.')
-
-        if not self.stackwalk_cgi:
+        if self.stackwalk_cgi:
+            self.addStep(SetBuildProperty(
+                property_name='symbols_url',
+                value=get_test_symbols_url,
+            ))
+        elif not self.parallelDownloads:
             self.addStep(DownloadFile(
-                url_fn=get_symbols_url,
+                url_fn=get_test_symbols_url,
                 filename_property='symbols_filename',
                 url_property='symbols_url',
                 name='download_symbols',
                 ignore_certs=self.ignoreCerts,
-                workdir='build/symbols'
+                workdir='build/symbols',
+                **self.getDownloadCacheArgs()
             ))
             self.addStep(UnpackFile(
                 filename=WithProperties('%(symbols_filename)s'),
                 name='unpack_symbols',
                 workdir='build/symbols'
             ))
-        else:
-            self.addStep(SetBuildProperty(
-                property_name='symbols_url',
-                value=get_symbols_url,
-            ))
 
     def addPrepareTestsSteps(self):
-        def get_tests_url(build):
-            '''If there is only one file, we assume that the tests package is at
-            the same location with the file extension of the browser replaced with
-            .tests.tar.bz2, otherwise we try to find the explicit file'''
-            if len(build.source.changes[-1].files) < 2:
-                build_url = build.getProperty('build_url')
-                for suffix in ('.tar.bz2', '.zip', '.dmg', '.exe'):
-                    if build_url.endswith(suffix):
-                        return build_url[:-len(suffix)] + '.tests.tar.bz2'
-            else:
-                return parse_sendchange_files(build, include_substr='.tests.')
+        if self.parallelDownloads:
+            return
         self.addStep(DownloadFile(
-            url_fn=get_tests_url,
+            url_fn=get_test_tests_url,
             filename_property='tests_filename',
             url_property='tests_url',
             haltOnFailure=True,
             ignore_certs=self.ignoreCerts,
             name='download tests',
+            **self.getDownloadCacheArgs()
         ))
 
     def addIdentifySteps(self):
@@ -6796,6 +6930,9 @@ class UnittestPackagedBuildFactory(MozillaTestFactory):
         self.totalChunks = totalChunks
         self.thisChunk = thisChunk
         self.chunkByDir = chunkByDir
+        # Parts of the tests package unpacked so far; None once the whole
+        # package has been unpacked
+        self.unpackedTests = set()
 
         testEnv = MozillaEnvironments['%s-unittest' % platform].copy()
         if stackwalk_cgi and kwargs.get('downloadSymbols'):
@@ -6820,6 +6957,24 @@ class UnittestPackagedBuildFactory(MozillaTestFactory):
                 env=self.env,
             ))
 
+    def addUnpackTestStep(self, testtype, name):
+        '''Unpacks the parts of the tests package needed by testtype, unless
+        an earlier suite has already unpacked them'''
+        members = UnpackTest.manifests.get(testtype)
+        if self.unpackedTests is None or \
+           (members and set(members) <= self.unpackedTests):
+            return
+        self.addStep(UnpackTest(
+         filename=WithProperties('%(tests_filename)s'),
+         testtype=testtype,
+         haltOnFailure=True,
+         name=name,
+         ))
+        if members:
+            self.unpackedTests.update(members)
+        else:
+            self.unpackedTests = None
+
     def addRunTestSteps(self):
         if self.platform.startswith('macosx64'):
             self.addStep(resolution_step())
@@ -6835,12 +6990,7 @@ class UnittestPackagedBuildFactory(MozillaTestFactory):
                 # set differently compared to non-mobile specific tests
                 real_suite = suite[len('mobile-'):]
                 # Unpack the tests
-                self.addStep(UnpackTest(
-                 filename=WithProperties('%(tests_filename)s'),
-                 testtype='mochitest',
-                 haltOnFailure=True,
-                 name='unpack mochitest tests',
-                 ))
+                self.addUnpackTestStep('mochitest', 'unpack mochitest tests')
 
                 variant = real_suite.split('-', 1)[1]
                 self.addStep(unittest_steps.MozillaPackagedMochitests(
@@ -6856,12 +7006,7 @@ class UnittestPackagedBuildFactory(MozillaTestFactory):
                 ))
             elif suite.startswith('mochitest'):
                 # Unpack the tests
-                self.addStep(UnpackTest(
-                 filename=WithProperties('%(tests_filename)s'),
-                 testtype='mochitest',
-                 haltOnFailure=True,
-                 name='unpack mochitest tests',
-                 ))
+                self.addUnpackTestStep('mochitest', 'unpack mochitest tests')
 
                 variant = suite.split('-', 1)[1]
                 self.addStep(unittest_steps.MozillaPackagedMochitests(
@@ -6876,12 +7021,7 @@ class UnittestPackagedBuildFactory(MozillaTestFactory):
                 ))
             elif suite == 'xpcshell':
                 # Unpack the tests
-                self.addStep(UnpackTest(
-                 filename=WithProperties('%(tests_filename)s'),
-                 testtype='xpcshell',
-                 haltOnFailure=True,
-                 name='unpack xpcshell tests',
-                 ))
+                self.addUnpackTestStep('xpcshell', 'unpack xpcshell tests')
 
                 self.addStep(unittest_steps.MozillaPackagedXPCShellTests(
                  env=self.env,
@@ -6892,12 +7032,7 @@ class UnittestPackagedBuildFactory(MozillaTestFactory):
             elif suite in ('jsreftest', ):
                 # Specialized runner for jsreftest because they take so long to unpack and clean up
                 # Unpack the tests
-                self.addStep(UnpackTest(
-                 filename=WithProperties('%(tests_filename)s'),
-                 testtype='jsreftest',
-                 haltOnFailure=True,
-                 name='unpack jsreftest tests',
-                 ))
+                self.addUnpackTestStep('jsreftest', 'unpack jsreftest tests')
 
                 self.addStep(unittest_steps.MozillaPackagedReftests(
                  suite=suite,
@@ -6908,12 +7043,7 @@ class UnittestPackagedBuildFactory(MozillaTestFactory):
                 ))
             elif suite == 'jetpack':
                 # Unpack the tests
-                self.addStep(UnpackTest(
-                 filename=WithProperties('%(tests_filename)s'),
-                 testtype='jetpack',
-                 haltOnFailure=True,
-                 name='unpack jetpack tests',
-                 ))
+                self.addUnpackTestStep('jetpack', 'unpack jetpack tests')
 
                 self.addStep(unittest_steps.MozillaPackagedJetpackTests(
                   suite=suite,
@@ -6930,12 +7060,7 @@ class UnittestPackagedBuildFactory(MozillaTestFactory):
                 if suite in ('reftest-ipc', 'crashtest-ipc'):
                     self.env.update({'MOZ_LAYERS_FORCE_SHMEM_SURFACES':'1'})
                 # Unpack the tests
-                self.addStep(UnpackTest(
-                 filename=WithProperties('%(tests_filename)s'),
-                 testtype='reftest',
-                 haltOnFailure=True,
-                 name='unpack reftest tests',
-                 ))
+                self.addUnpackTestStep('reftest', 'unpack reftest tests')
                 self.addStep(unittest_steps.MozillaPackagedReftests(
                  suite=suite,
                  env=self.env,
@@ -6946,12 +7071,7 @@ class UnittestPackagedBuildFactory(MozillaTestFactory):
             elif suite == 'mozmill':
 
                 # Unpack the tests
-                self.addStep(UnpackTest(
-                 filename=WithProperties('%(tests_filename)s'),
-                 testtype='mozmill',
-                 haltOnFailure=True,
-                 name='unpack mochitest tests',
-                 ))
+                self.addUnpackTestStep('mozmill', 'unpack mochitest tests')
 
                 # install mozmill into its virtualenv
                 self.addStep(ShellCommand(
@@ -7089,6 +7209,7 @@ class RemoteUnittestFactory(MozillaTestFactory):
             haltOnFailure=True,
             ignore_certs=self.ignoreCerts,
             name='download_build',
+            **self.getDownloadCacheArgs()
         ))
         self.addStep(UnpackFile(
             filename=WithProperties('../%(build_filename)s'),
@@ -8241,22 +8362,12 @@ class ScriptFactory(BuildFactory):
             workdir=".",
         ))
         self.addStep(ShellCommand(
-            name="clobber_scripts",
-            command=['rm', '-rf', 'scripts'],
-            workdir=".",
-        ))
-        self.addStep(ShellCommand(
-            name="clone_scripts",
-            command=[hg_bin, 'clone', scriptRepo, 'scripts'],
+            name="update_scripts",
+            command=hgUpdateOrCloneCommand(scriptRepo, 'scripts',
+                WithProperties('%(script_repo_revision:-default)s'), hg_bin),
+            log_eval_func=hgUpdateOrCloneEvaluator,
             workdir=".",
             haltOnFailure=True))
-        self.addStep(ShellCommand(
-            name="update_scripts",
-            command=[hg_bin, 'update', '-C', '-r',
-                     WithProperties('%(script_repo_revision:-default)s')],
-            haltOnFailure=True,
-            workdir='scripts'
-        ))
         self.runScript()
         self.reboot()
 
@@ -28,7 +28,7 @@ from buildbotcustom.status.mail import ChangeNotifier
 from buildbotcustom.misc import get_l10n_repositories, \
   generateTestBuilderNames, generateTestBuilder, _nextFastReservedSlave, \
   makeLogUploadCommand, changeContainsProduct, nomergeBuilders, \
-  changeContainsProperties
+  changeContainsProperties, profileObjects
 from buildbotcustom.common import reallyShort
 from buildbotcustom.process.factory import StagingRepositorySetupFactory, \
   ScriptFactory, SingleSourceFactory, ReleaseBuildFactory, \
@@ -52,6 +52,7 @@ import BuildSlaves
 
 DEFAULT_PARALLELIZATION = 3
 
+@profileObjects()
 def generateReleaseBranchObjects(releaseConfig, branchConfig,
                                  releaseConfigFile, sourceRepoKey="mozilla",
                                  secrets=None):
@@ -1701,7 +1702,7 @@ def generateReleaseBranchObjects(releaseConfig, branchConfig,
     ))
 
     # Don't merge release builder requests
-    nomergeBuilders.extend([b['name'] for b in builders + test_builders])
+    nomergeBuilders.update([b['name'] for b in builders + test_builders])
 
     return {
             "builders": builders,
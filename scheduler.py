@@ -31,22 +31,35 @@ class MultiScheduler(Scheduler):
         self.numberOfBuildsToTrigger = numberOfBuildsToTrigger
         Scheduler.__init__(self, **kwargs)
 
+    def create_buildsets(self, t, buildsets, reason="scheduler"):
+        """Create numberOfBuildsToTrigger buildsets for each (ssid,
+        builderNames) pair in `buildsets`, all within transaction `t`.
+
+        The sourcestamps are shared between the repeated buildsets rather
+        than being re-inserted for each one.  Buildsets are created through
+        create_buildset so that subclasses adding properties still apply."""
+        bsids = []
+        for i in range(self.numberOfBuildsToTrigger):
+            for ssid, builderNames in buildsets:
+                bsids.append(self.create_buildset(ssid, reason, t,
+                                                  builderNames=builderNames))
+        return bsids
+
     # NOTE: this is overriding an internal scheduler method and may break unexpectedly!
     def _add_build_and_remove_changes(self, t, important, unimportant):
         all_changes = sorted(important + unimportant, key=lambda c : c.number)
         db = self.parent.db
-        for i in range(self.numberOfBuildsToTrigger):
-            if self.treeStableTimer is None:
-                # each *important* Change gets a separate build.  Unimportant
-                # builds get ignored.
-                for c in important:
-                    ss = SourceStamp(changes=[c])
-                    ssid = db.get_sourcestampid(ss, t)
-                    self.create_buildset(ssid, "scheduler", t)
-            else:
-                ss = SourceStamp(changes=all_changes)
-                ssid = db.get_sourcestampid(ss, t)
-                self.create_buildset(ssid, "scheduler", t)
+        buildsets = []
+        if self.treeStableTimer is None:
+            # each *important* Change gets a separate build.  Unimportant
+            # builds get ignored.
+            for c in important:
+                ss = SourceStamp(changes=[c])
+                buildsets.append((db.get_sourcestampid(ss, t), None))
+        else:
+            ss = SourceStamp(changes=all_changes)
+            buildsets.append((db.get_sourcestampid(ss, t), None))
+        self.create_buildsets(t, buildsets)
 
         # and finally retire the changes from scheduler_changes
         changeids = [c.number for c in all_changes]
@@ -201,24 +214,25 @@ class BuilderChooserScheduler(MultiScheduler):
                 return
 
             db = self.parent.db
-            for i in range(self.numberOfBuildsToTrigger):
-                if self.treeStableTimer is None:
-                    # each Change gets a separate build
-                    for c in all_changes:
-                        if c not in buildersPerChange:
-                            continue
-                        ss = SourceStamp(changes=[c])
-                        ssid = db.get_sourcestampid(ss, t)
-                        self.create_buildset(ssid, "scheduler", t, builderNames=buildersPerChange[c])
-                else:
-                    # Grab all builders
-                    builderNames = set()
-                    for names in buildersPerChange.values():
-                        builderNames.update(names)
-                    builderNames = list(builderNames)
-                    ss = SourceStamp(changes=all_changes)
+            buildsets = []
+            if self.treeStableTimer is None:
+                # each Change gets a separate build
+                for c in all_changes:
+                    if c not in buildersPerChange:
+                        continue
+                    ss = SourceStamp(changes=[c])
                     ssid = db.get_sourcestampid(ss, t)
-                    self.create_buildset(ssid, "scheduler", t, builderNames=builderNames)
+                    buildsets.append((ssid, buildersPerChange[c]))
+            else:
+                # Grab all builders
+                builderNames = set()
+                for names in buildersPerChange.values():
+                    builderNames.update(names)
+                builderNames = list(builderNames)
+                ss = SourceStamp(changes=all_changes)
+                ssid = db.get_sourcestampid(ss, t)
+                buildsets.append((ssid, builderNames))
+            self.create_buildsets(t, buildsets)
 
             # and finally retire the changes from scheduler_changes
             changeids = [c.number for c in all_changes]
@@ -342,6 +356,25 @@ class TriggerBouncerCheck(Triggerable):
         self.working = False
         return None # eat the failure
 
+class BuildsetSubscription(object):
+    """Passes the database's modify-buildset notifications on to `callback`
+    until cancel() is called.
+
+    DBConnector has no way to unsubscribe an observer, so this object stays
+    subscribed after cancel(); it just stops passing notifications on, and
+    no longer keeps the callback's owner alive."""
+
+    def __init__(self, db, callback):
+        self.callback = callback
+        db.subscribe_to("modify-buildset", self)
+
+    def __call__(self, category, *bsids):
+        if self.callback:
+            self.callback(category, *bsids)
+
+    def cancel(self):
+        self.callback = None
+
 class AggregatingScheduler(BaseScheduler, Triggerable):
     """This scheduler waits until at least one build of each of
     `upstreamBuilders` completes with a result in `okResults`. Once this
@@ -349,13 +382,20 @@ class AggregatingScheduler(BaseScheduler, Triggerable):
     Use trigger() method to reset its state.
 
     `okResults` should be a tuple of acceptable result codes, and defaults to
-    (SUCCESS,WARNINGS)."""
+    (SUCCESS,WARNINGS).
+
+    Completed builds are noticed through the database's modify-buildset
+    notifications. Those are only sent by the master that finished the
+    build, so the buildrequests table is also scanned on startup and every
+    `pollInterval` seconds, to catch up on builds that completed while the
+    scheduler wasn't running or on another master sharing the database."""
 
     compare_attrs = ('name', 'branch', 'builderNames', 'properties',
-                     'upstreamBuilders', 'okResults')
+                     'upstreamBuilders', 'okResults', 'pollInterval')
 
     def __init__(self, name, branch, builderNames, upstreamBuilders,
-                 okResults=(SUCCESS,WARNINGS), properties={}):
+                 okResults=(SUCCESS,WARNINGS), properties={},
+                 pollInterval=300):
         BaseScheduler.__init__(self, name, builderNames, properties)
         self.branch = branch
         self.lock = Lock()
@@ -363,6 +403,12 @@ class AggregatingScheduler(BaseScheduler, Triggerable):
         self.upstreamBuilders = upstreamBuilders
         self.reason = "AccumulatingScheduler(%s)" % name
         self.okResults = okResults
+        self.pollInterval = pollInterval
+        # ids of buildsets modified since the last run()
+        self._modifiedBsids = []
+        self._subscription = None
+        # when run() next scans all completed builds
+        self._nextCatchup = 0
         self.log_prefix = '%s(%s) <id=%s>' % (self.__class__.__name__, name,
                                               id(self))
 
@@ -379,8 +425,21 @@ class AggregatingScheduler(BaseScheduler, Triggerable):
 
     def startService(self):
         self.parent.db.runInteractionNow(self._startService)
+        self._nextCatchup = now() + self.pollInterval
+        # Completed upstream builds are picked up from the database's
+        # notifications rather than by polling the buildrequests table.
+        # retire-buildrequest would be the obvious choice, but it is sent
+        # without any brids, so listen for the buildsets being modified.
+        self._subscription = BuildsetSubscription(self.parent.db,
+                                                  self._buildsetsModified)
         BaseScheduler.startService(self)
 
+    def stopService(self):
+        if self._subscription:
+            self._subscription.cancel()
+            self._subscription = None
+        return BaseScheduler.stopService(self)
+
     def _startService(self, t):
         state = self.get_state(t)
         old_state = state.copy()
@@ -403,9 +462,14 @@ class AggregatingScheduler(BaseScheduler, Triggerable):
             log.msg('%s: old state: %s' % (self.log_prefix, old_state))
             log.msg('%s: new state: %s' % (self.log_prefix, state))
         self.set_state(t, state)
+        # Catch up on builds that completed while we weren't listening
+        self.processRequest(t, catchup=True)
 
     def trigger(self, ss, set_props=None):
         """Reset scheduler state"""
+        # Anything completed before the reset doesn't count towards the next
+        # round
+        self._modifiedBsids = []
         self.parent.db.runInteractionNow(self._trigger)
 
     def _trigger(self, t):
@@ -419,8 +483,19 @@ class AggregatingScheduler(BaseScheduler, Triggerable):
         self.lock.release()
         log.msg('%s: _trigger released Lock' % self.log_prefix)
 
+    def _buildsetsModified(self, category, *bsids):
+        self._modifiedBsids.extend(bsids)
+
     def run(self):
-        d = self.parent.db.runInteraction(self._run)
+        catchup = now() >= self._nextCatchup
+        if not self._modifiedBsids and not catchup:
+            # Nothing has completed since we last looked
+            return self._nextCatchup
+        if catchup:
+            self._nextCatchup = now() + self.pollInterval
+        bsids, self._modifiedBsids = self._modifiedBsids, []
+        d = self.parent.db.runInteraction(self._run, bsids, catchup)
+        d.addCallback(lambda ign: self._nextCatchup)
         return d
 
     def findNewBuilds(self, db, t, lastCheck):
@@ -440,33 +515,74 @@ class AggregatingScheduler(BaseScheduler, Triggerable):
                   (lastCheck,))
         return t.fetchall()
 
-    def _run(self, t):
+    def findCompletedBuilds(self, db, t, bsids, lastCheck):
+        """Return the names of our upstream builders that have a request in
+        one of `bsids` that completed successfully after `lastCheck`."""
+        builders = set()
+        bsids = list(set(bsids))
+        # Keep the IN clause to a reasonable size, like
+        # DBConnector._txn_retire_buildreqs does
+        while bsids:
+            batch, bsids = bsids[:100], bsids[100:]
+            q = """SELECT DISTINCT buildername FROM buildrequests WHERE
+                   buildsetid IN %s AND
+                   buildername IN %s AND
+                   complete = 1 AND
+                   results IN %s AND
+                   complete_at > ?
+                """ % (
+                        db.parmlist(len(batch)),
+                        db.parmlist(len(self.upstreamBuilders)),
+                        db.parmlist(len(self.okResults)),
+                        )
+            q = db.quoteq(q)
+            t.execute(q, tuple(batch) + tuple(self.upstreamBuilders) +
+                      tuple(self.okResults) + (lastCheck,))
+            builders.update(row[0] for row in t.fetchall())
+        return builders
+
+    def _run(self, t, bsids, catchup=False):
         log.msg('%s: _run attempting to acquire Lock' % self.log_prefix)
         self.lock.acquire()
         log.msg('%s: _run acquired Lock' % self.log_prefix)
         try:
-            self.processRequest(t)
+            self.processRequest(t, bsids=bsids, catchup=catchup)
         finally:
             self.lock.release()
             log.msg('%s: _run released Lock' % self.log_prefix)
 
-    def processRequest(self, t):
+    def processRequest(self, t, bsids=None, catchup=False):
+        """Remove upstream builders that have completed from the list we're
+        waiting on, and start a build once it's empty.
+
+        Completed builds are looked for in the buildsets in `bsids`, and, if
+        `catchup` is set, in all builds completed since the last time the
+        state was saved.  The state is only written back if it
+        changes."""
         db = self.parent.db
         state = self.get_state(t)
-        # Check for new builds completed since lastCheck
         lastCheck = state['lastCheck']
         remainingBuilders = state['remainingBuilders']
 
         n = now()
-        newBuilds = self.findNewBuilds(db, t, lastCheck)
-        state['lastCheck'] = n
+        completed = set()
+        if bsids:
+            completed.update(self.findCompletedBuilds(db, t, bsids,
+                                                      lastCheck))
+        if catchup:
+            newBuilds = self.findNewBuilds(db, t, lastCheck)
+            completed.update(builder for builder, ssid in newBuilds)
+
+        finished = [b for b in remainingBuilders if b in completed]
+        if not finished:
+            return
 
-        for builder, ssid in newBuilds:
-            if builder in remainingBuilders:
-                remainingBuilders.remove(builder)
+        for builder in finished:
+            remainingBuilders.remove(builder)
 
         if remainingBuilders:
             state['remainingBuilders'] = remainingBuilders
+            state['lastCheck'] = n
         else:
             ss = SourceStamp(branch=self.branch)
             ssid = db.get_sourcestampid(ss, t)
@@ -1,4 +1,5 @@
 import datetime
+import hashlib
 import sqlalchemy
 from sqlalchemy import Column, Integer, String, Unicode, UnicodeText, \
         Boolean, Text, DateTime, ForeignKey, Table, UniqueConstraint, \
@@ -10,6 +11,37 @@ from jsoncol import JSONColumn
 
 from twisted.python import log
 
+def _digest(values):
+    """Returns a hex sha1 of a sequence of values, which may be None, strings,
+    numbers, datetimes or nested lists or tuples of those."""
+    h = hashlib.sha1()
+    def add(v):
+        if v is None:
+            h.update('N')
+        elif isinstance(v, (list, tuple)):
+            h.update('L%i:' % len(v))
+            for i in v:
+                add(i)
+        else:
+            if isinstance(v, datetime.datetime):
+                v = v.isoformat()
+            if isinstance(v, unicode):
+                v = v.encode('utf8')
+            elif not isinstance(v, str):
+                v = str(v)
+            h.update('S%i:%s' % (len(v), v))
+    add(values)
+    return h.hexdigest()
+
+def _revision(revision):
+    """Returns revision as stored in the revision columns.  Rows written
+    before the digests were added store a missing revision as u'None', so
+    that is treated as None too, keeping their digests equal to those of new
+    rows."""
+    if revision is None or unicode(revision) == u'None':
+        return None
+    return unicode(revision)
+
 Base = declarative_base()
 metadata = Base.metadata
 Session = None
@@ -222,6 +254,9 @@ class Change(Base):
     files = relation(File, secondary=file_changes)
     comments = Column(UnicodeText, nullable=True)
     when = Column(DateTime, nullable=True)
+    # sha1 over all of the above, including the sorted file paths.  Used to
+    # look up existing changes without comparing every column.
+    digest = Column(String(40), nullable=True, index=True)
 
     def equals(self, bbChange):
         """Returns True if this Change refers to the same thing as a buildbot
@@ -247,35 +282,30 @@ class Change(Base):
         return True
 
     @classmethod
-    def fromBBChange(cls, session, change):
-        """Return a Change database object that reflects a buildbot Change
-        object object."""
-        # Look for a change object in the database
+    def bbDigest(cls, change):
+        """Returns the digest of a buildbot Change object, as stored in the
+        digest column of the matching database Change."""
         if change.when:
             when = datetime.datetime.utcfromtimestamp(change.when)
         else:
             when = None
+        return cls.makeDigest(change.number, unicode(change.branch),
+                change.revision, unicode(change.who),
+                unicode(change.comments), when, change.files)
 
-        if change.revision is None:
-            revision = None
-        else:
-            revision = unicode(change.revision)
-        possible_changes_q = session.query(cls).filter_by(
-                number=change.number,
-                branch=unicode(change.branch),
-                revision=revision,
-                who=unicode(change.who),
-                comments=unicode(change.comments),
-                when=when,
-                )
-        possible_changes = possible_changes_q.all()
-
-        # Look at files
-        for c in possible_changes:
-            files = [f.path for f in c.files]
-            files.sort()
-            if files != sorted([f.path for f in c.files]):
-                continue
+    @staticmethod
+    def makeDigest(number, branch, revision, who, comments, when, files):
+        return _digest((number, branch, _revision(revision), who, comments,
+                        when, sorted(unicode(f) for f in files)))
+
+    @classmethod
+    def fromBBChange(cls, session, change):
+        """Return a Change database object that reflects a buildbot Change
+        object object."""
+        # Look for a change object in the database
+        digest = cls.bbDigest(change)
+        c = session.query(cls).filter_by(digest=digest).first()
+        if c:
             return c
 
         # We didn't find an existing object in the database, so
@@ -286,10 +316,11 @@ class Change(Base):
             when = None
         c = cls(number=change.number,
                 branch=unicode(change.branch),
-                revision=unicode(change.revision),
+                revision=_revision(change.revision),
                 who=unicode(change.who),
                 comments=unicode(change.comments),
                 when=when,
+                digest=digest,
                 )
         c.files = [File.get(session, path) for path in change.files]
         return c
@@ -316,6 +347,8 @@ class SourceStamp(Base):
     patch_id = Column(Integer, ForeignKey(Patch.id), nullable=True)
     patch = relation(Patch)
     changes = relation(SourceChange, order_by=SourceChange.order)
+    # sha1 over branch, revision, patch and the digests of the changes
+    digest = Column(String(40), nullable=True, index=True)
 
     def equals(self, bbSource):
         """Returns True if this SourceStamp refers to the same thing as a buildbot
@@ -346,29 +379,31 @@ class SourceStamp(Base):
 
         return True
 
+    @staticmethod
+    def makeDigest(branch, revision, patch, change_digests):
+        return _digest((branch, _revision(revision), patch, change_digests))
+
     @classmethod
     def fromBBSourcestamp(cls, session, ss):
         """Return a database SourceStamp object that reflect a buildbot SourceStamp"""
         changes = [Change.fromBBChange(session, c) for c in ss.changes]
-        changes = [SourceChange(change=change, order=i) for i,change in enumerate(changes)]
         if ss.patch:
             patchlevel, patchdata = ss.patch
-            patch = Patch(patch=patchdata, patchlevel=patchlevel)
+            patch = (patchlevel, patchdata)
         else:
             patch = None
-        s = session.query(cls).filter_by(branch=unicode(ss.branch),
-                revision=unicode(ss.revision),
-                patch=patch).first()
-        # Compare list of changes
-        if s:
-            if sorted([c.change.id for c in s.changes]) == sorted([c.change.id for c in changes]):
-                return s
-            s = None
+        digest = cls.makeDigest(unicode(ss.branch), unicode(ss.revision),
+                patch, [c.digest for c in changes])
+        s = session.query(cls).filter_by(digest=digest).first()
         if not s:
+            if patch:
+                patch = Patch(patch=patchdata, patchlevel=patchlevel)
+            changes = [SourceChange(change=change, order=i) for i,change in enumerate(changes)]
             s = cls(branch=unicode(ss.branch),
                     revision=unicode(ss.revision),
                     patch=patch,
-                    changes=changes)
+                    changes=changes,
+                    digest=digest)
         return s
 
 class Request(Base):
@@ -447,6 +482,19 @@ class Step(Base):
             session.add(s)
         return s
 
+    @classmethod
+    def insertBBSteps(cls, session, build_id, steps):
+        """Insert rows for a list of buildbot steps belonging to build_id using
+        a single executemany, and return a mapping of step name to the id of
+        the new row."""
+        if not steps:
+            return {}
+        session.execute(cls.__table__.insert(),
+                [dict(name=step.name, description=step.text,
+                      build_id=build_id, order=i)
+                 for i, step in enumerate(steps)])
+        return dict(session.query(cls.name, cls.id).filter_by(build_id=build_id))
+
 class Build(Base):
     __tablename__ = "builds"
     id = Column(Integer, primary_key=True)
@@ -468,7 +516,7 @@ class Build(Base):
     steps = relation(Step, order_by=Step.order, collection_class=ordering_list('order'), backref='build')
     lost = Column(Boolean, nullable=False, default=False)
 
-    def updateFromBBBuild(self, session, build):
+    def updateFromBBBuild(self, session, build, updateSteps=True):
         self.properties = Property.fromBBProperties(session, build.getProperties())
 
         if build.started:
@@ -479,7 +527,7 @@ class Build(Base):
             self.endtime = finished
             self.result = build.results
 
-        if build.steps:
+        if updateSteps and build.steps:
             mysteps = dict((s.name, s) for s in self.steps)
             for i,step in enumerate(build.steps):
                 s = mysteps.get(step.name)
@@ -510,8 +558,10 @@ class Build(Base):
                 self.steps.remove(s)
 
     @classmethod
-    def fromBBBuild(cls, session, build, builderName, master_id, request_mapping=None):
-        """Create a database Build object from a buildbot Build"""
+    def fromBBBuild(cls, session, build, builderName, master_id,
+            request_mapping=None, addSteps=True):
+        """Create a database Build object from a buildbot Build.  If addSteps
+        is False, the build's steps aren't added; see Step.insertBBSteps"""
         builder = Builder.get(session, builderName, master_id)
         slave = Slave.get(session, build.getSlavename())
         b = cls(buildnumber=build.number, builder=builder,
@@ -534,6 +584,6 @@ class Build(Base):
 
         # Updates times, steps, properties
         session.add(b)
-        b.updateFromBBBuild(session, build)
+        b.updateFromBBBuild(session, build, updateSteps=addSteps)
 
         return b
@@ -20,9 +20,13 @@ class DBBuildStatus(base.StatusReceiver):
     along with the database step object (the logChunk notification receives
     only the database id for the step, to prevent excessive database lookups).
 
-    It updates the database on stepStarted and stepFinished events."""
-    def __init__(self, build_id, subscribers=None):
+    It updates the database on stepStarted and stepFinished events.
+
+    step_ids maps step names to the ids of their rows in the database, so
+    that known steps can be updated by primary key."""
+    def __init__(self, build_id, subscribers=None, step_ids=None):
         self.build_id = build_id
+        self.step_ids = step_ids or {}
 
         self.subscribers = subscribers or []
 
@@ -35,15 +39,28 @@ class DBBuildStatus(base.StatusReceiver):
         # happening.
         self.Session = model.Session
 
+    def getStep(self, session, name):
+        """Returns the database Step for the step called name, creating it if
+        it doesn't exist yet"""
+        step_id = self.step_ids.get(name)
+        if step_id is not None:
+            s = session.query(model.Step).get(step_id)
+            if s:
+                return s
+        # Load the build along with its steps so that Step.get doesn't have
+        # to load them one by one
+        session.query(model.Build).options(model.eagerload('steps')).get(self.build_id)
+        return model.Step.get(session, name=name, build_id=self.build_id)
+
     def stepStarted(self, build, step):
         """Create this step in the database, and give it a start time"""
         session = self.Session()
         try:
-            b = session.query(model.Build).options(model.eagerload('steps')).get(self.build_id)
-            s = model.Step.get(session, name=step.name, build_id=self.build_id)
+            s = self.getStep(session, step.name)
             s.starttime = datetime.utcfromtimestamp(step.started)
             s.description = step.text
             session.commit()
+            self.step_ids[step.name] = s.id
             # Keep track of our current step
             self.current_step = s
             self.current_step_id = s.id
@@ -72,7 +89,7 @@ class DBBuildStatus(base.StatusReceiver):
             # does.  This can happen if the master is reconfigured while steps
             # are currently active.
             if not self.current_step:
-                s = model.Step.get(session, name=step.name, build_id=self.build_id)
+                s = self.getStep(session, step.name)
                 # This may not be set
                 if s.starttime:
                     s.starttime = datetime.utcfromtimestamp(step.started)
@@ -271,7 +288,10 @@ class DBStatus(base.StatusReceiverMultiService):
             # Check any builds that aren't finished in the database
             # they could still be running (if the master was just reconfigured),
             # or they could now be stopped (if the master was stopped)
-            for build in session.query(model.Build).filter_by(endtime=None, master=master):
+            unfinished = session.query(model.Build).\
+                    filter_by(endtime=None, master=master).\
+                    options(model.eagerload('builder'))
+            for build in unfinished:
                 force_done = False
                 master_build = None
                 lost = False
@@ -315,26 +335,57 @@ class DBStatus(base.StatusReceiverMultiService):
             # - Add them into self.request_mapper if they match
             # On a restart, none of the builders will have pending
             # requests, so we won't find any to store in self.request_mapper
+            #
+            # All of this master's unstarted requests are loaded with a single
+            # query and indexed by builder and submit time, rather than
+            # looking up each pending request separately.  Submit times are
+            # compared to the second since not all databases store
+            # microseconds.
+            unstarted = session.query(model.Request).\
+                    filter_by(startcount=0, lost=False).\
+                    join(model.Builder).filter_by(master_id=self.master_id).\
+                    options(model.eagerload('source')).all()
+            candidates = {}
+            for req in unstarted:
+                if req.cancelled or req.submittime is None:
+                    continue
+                key = (req.builder_id, req.submittime.replace(microsecond=0))
+                candidates.setdefault(key, []).append(req)
+
+            db_builders = dict((b.name, b) for b in
+                    session.query(model.Builder).filter_by(master_id=self.master_id))
             for builderName in self.status.getBuilderNames():
                 master_builder = self.status.getBuilder(builderName)
-                db_builder = model.Builder.get(session, builderName, self.master_id)
+                db_builder = db_builders.get(builderName)
+                if not db_builder:
+                    # A new builder, so there are no requests for it in the
+                    # database yet
+                    model.Builder.get(session, builderName, self.master_id)
+                    continue
                 for p in master_builder.getPendingBuilds():
-                    r = model.Request.get(session, builder=db_builder,
-                            submittime=datetime.utcfromtimestamp(p.getSubmitTime()),
-                            source=p.source)
-                    if r:
-                        log.msg("DBMSG: Found matching request for db request %i" % r.id)
-                        self.request_mapping[p] = r
+                    submittime = datetime.utcfromtimestamp(p.getSubmitTime())
+                    key = (db_builder.id, submittime.replace(microsecond=0))
+                    for r in candidates.get(key, []):
+                        if r.source.equals(p.source):
+                            log.msg("DBMSG: Found matching request for db request %i" % r.id)
+                            self.request_mapping[p] = r
+                            candidates[key].remove(r)
+                            break
 
             # Go though and mark any requests which don't have an entry in
             # request_mapping as lost This means that they were never built,
             # and aren't in any builder's list of pending builds, so they will
             # never be built.
-            known_requests = self.request_mapping.values()
-            for req in session.query(model.Request).filter_by(startcount=0, lost=False).join(model.Builder).filter_by(master_id=self.master_id):
-                if req not in known_requests:
-                    log.msg("DBMSG: Marking request %i as lost and gone forever" % req.id)
-                    req.lost = True
+            known_requests = set(r.id for r in self.request_mapping.values())
+            lost_requests = [r.id for r in unstarted if r.id not in known_requests]
+            if lost_requests:
+                log.msg("DBMSG: Marking requests %s as lost and gone forever" %
+                        ", ".join(str(i) for i in lost_requests))
+            # Update in batches to keep the IN clause to a reasonable size
+            for i in range(0, len(lost_requests), 500):
+                session.query(model.Request).\
+                        filter(model.Request.id.in_(lost_requests[i:i+500])).\
+                        update({'lost': True}, synchronize_session=False)
 
             session.commit()
             self.status.subscribe(self)
@@ -383,7 +434,8 @@ class DBStatus(base.StatusReceiverMultiService):
                 if not db_build:
                     continue
                 db_build.updateFromBBBuild(session, build)
-                status = DBBuildStatus(db_build.id, self.subscribers)
+                step_ids = dict((s.name, s.id) for s in db_build.steps if s.id)
+                status = DBBuildStatus(db_build.id, self.subscribers, step_ids)
                 build.subscribe(status)
                 d = build.waitUntilFinished()
                 d.addCallback(lambda s: s.unsubscribe(status))
@@ -399,10 +451,10 @@ class DBStatus(base.StatusReceiverMultiService):
         try:
             b = model.Build.fromBBBuild(session, build, builderName,
                     self.master_id,
-                    self.request_mapping)
-
-            for s in build.steps:
-                b.steps.append(model.Step(name=s.name, description=s.text))
+                    self.request_mapping, addSteps=False)
+            # Flush to get the build's id, then add all of its steps at once
+            session.flush()
+            step_ids = model.Step.insertBBSteps(session, b.id, build.steps)
 
             session.commit()
             for sub in self.subscribers:
@@ -412,7 +464,7 @@ class DBStatus(base.StatusReceiverMultiService):
                     except:
                         log.msg("DBERROR: Couldn't notify subscriber %s of build starting" % sub)
                         log.err()
-            return DBBuildStatus(b.id, self.subscribers)
+            return DBBuildStatus(b.id, self.subscribers, step_ids)
         except:
             if sys.exc_info()[0] is sqlalchemy.exc.OperationalError:
                 self.lostConnection()
@@ -32,6 +32,9 @@ from twisted.internet.defer import Deferred, TimeoutError
 
 import os
 import re
+import pipes
+import posixpath
+from hashlib import sha1
 
 from buildbot.process.buildstep import LoggedRemoteCommand, BuildStep
 from buildbot.steps.shell import WithProperties
@@ -436,18 +439,77 @@ class SendChangeStep(ShellCommand):
             return self.finished(FAILURE)
 
 
+def shellQuote(args):
+    return ' '.join([pipes.quote(a) for a in args])
+
+# wget -N says one of these when the cached copy is still current, depending
+# on its version
+downloadCacheHitRe = re.compile('not retrieving|not modified on server')
+
+def isAbsolutePath(path):
+    """Returns whether path is absolute on the slave, which may be windows
+    even though the master isn't"""
+    return path.startswith('/') or \
+            re.match(r'^[A-Za-z]:[/\\]', path) is not None
+
+def getDownloadCacheTrimCommand(cache_dir, cache_size):
+    """Returns a shell command that removes the least recently used entries
+    of cache_dir until it is no bigger than cache_size MB"""
+    # Trimming the cache shouldn't fail the download
+    return ('{ (cd %s && while [ $(du -sm . | cut -f1) -gt %i ] &&'
+            ' [ $(ls | wc -l) -gt 1 ]; do rm -rf "$(ls -tr | head -n 1)";'
+            ' done); true; }' % (pipes.quote(cache_dir), int(cache_size)))
+
+def getDownloadCacheCommand(wget, url, cache_dir, cache_size=None):
+    """Returns a shell command that runs wget in the cache entry for url and
+    links the result into the current directory, then trims the cache if
+    cache_size is given"""
+    entry = '%s/%s' % (cache_dir, sha1(url).hexdigest())
+    filename = os.path.basename(url)
+    cached = '%s/%s' % (entry, filename)
+    cmd = '(mkdir -p %s && cd %s && %s && touch . %s)' % (
+            pipes.quote(entry), pipes.quote(entry), shellQuote(wget),
+            pipes.quote(filename))
+    cmd += ' && (ln -f %s %s 2>/dev/null || cp -f %s %s)' % (
+            pipes.quote(cached), pipes.quote(filename),
+            pipes.quote(cached), pipes.quote(filename))
+    if cache_size is not None:
+        cmd += ' && ' + getDownloadCacheTrimCommand(cache_dir, cache_size)
+    return cmd
+
+def getUnpackCommand(filename, scripts_dir='.'):
+    if filename.endswith(".zip") or filename.endswith(".apk"):
+        return ['unzip', '-o', filename]
+    elif filename.endswith(".tar.gz"):
+        return ['tar', '-zxvf', filename]
+    elif filename.endswith(".tar.bz2"):
+        return ['tar', '-jxvf', filename]
+    elif filename.endswith(".dmg"):
+        return ['bash', '%s/installdmg.sh' % scripts_dir, filename]
+    else:
+        raise ValueError("Don't know how to handle %s" % filename)
+
 class DownloadFile(ShellCommand):
     haltOnFailure = True
     name = "download"
     description = ["download"]
 
     def __init__(self, url_fn=None, url=None, url_property=None, filename_property=None,
-            ignore_certs=False, wget_args=None, **kwargs):
+            ignore_certs=False, wget_args=None, cache_dir=None, cache_size=None,
+            **kwargs):
+        """If cache_dir is set, the file is downloaded into an entry of that
+        directory named after the sha1 of its url and linked into the workdir
+        from there.  wget -N revalidates the entry against the server's
+        timestamp and size, so only changed files are fetched again.
+        cache_size is the size in MB the cache directory is trimmed to,
+        least recently used entries first, after each download."""
         self.url = url
         self.url_fn = url_fn
         self.url_property = url_property
         self.filename_property = filename_property
         self.ignore_certs = ignore_certs
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
         assert bool(self.url) ^ bool(self.url_fn), \
                 "One of url_fn or url must be set, not both (%s %s)"
         if wget_args:
@@ -458,7 +520,13 @@ class DownloadFile(ShellCommand):
         self.super_class.__init__(self, **kwargs)
         self.addFactoryArguments(url_fn=url_fn, url=url,
                 url_property=url_property, filename_property=filename_property,
-                ignore_certs=ignore_certs, wget_args=wget_args)
+                ignore_certs=ignore_certs, wget_args=wget_args,
+                cache_dir=cache_dir, cache_size=cache_size)
+
+    def getCacheCommand(self, wget, url):
+        return ['bash', '-c',
+                getDownloadCacheCommand(wget, url, self.cache_dir,
+                                        self.cache_size)]
 
     def start(self):
         try:
@@ -478,11 +546,25 @@ class DownloadFile(ShellCommand):
                     os.path.basename(renderedUrl), "DownloadFile")
 
         if self.ignore_certs:
-            self.setCommand(["wget"] + self.wget_args + ["-N", "--no-check-certificate", url])
+            wget = ["wget"] + self.wget_args + ["-N", "--no-check-certificate", renderedUrl]
+        else:
+            wget = ["wget"] + self.wget_args + ["-N", renderedUrl]
+        if self.cache_dir:
+            self.setCommand(self.getCacheCommand(wget, renderedUrl))
         else:
-            self.setCommand(["wget"] + self.wget_args + ["-N", url])
+            self.setCommand(wget)
         self.super_class.start(self)
 
+    def commandComplete(self, cmd):
+        if not self.cache_dir or cmd.rc != 0:
+            return
+        if downloadCacheHitRe.search(cmd.logs['stdio'].getText()):
+            prop = 'download_cache_hits'
+        else:
+            prop = 'download_cache_misses'
+        count = self.build.getProperties().getProperty(prop, 0)
+        self.setProperty(prop, count + 1, "DownloadFile")
+
     def evaluateCommand(self, cmd):
         superResult = self.super_class.evaluateCommand(self, cmd)
         if SUCCESS != superResult:
@@ -504,19 +586,7 @@ class UnpackFile(ShellCommand):
     def start(self):
         filename = self.build.getProperties().render(self.filename)
         self.filename = filename
-        if filename.endswith(".zip") or filename.endswith(".apk"):
-            self.setCommand(['unzip', '-o', filename])
-        elif filename.endswith(".tar.gz"):
-            self.setCommand(['tar', '-zxvf', filename])
-        elif filename.endswith(".tar.bz2"):
-            self.setCommand(['tar', '-jxvf', filename])
-        elif filename.endswith(".dmg"):
-            self.setCommand(['bash',
-             '%s/installdmg.sh' % self.scripts_dir,
-             filename]
-            )
-        else:
-            raise ValueError("Don't know how to handle %s" % filename)
+        self.setCommand(getUnpackCommand(filename, self.scripts_dir))
         self.super_class.start(self)
 
     def evaluateCommand(self, cmd):
@@ -528,8 +598,165 @@ class UnpackFile(ShellCommand):
 
         return SUCCESS
 
+class DownloadAndUnpackFiles(ShellCommand):
+    """Downloads several files concurrently in a single command, unpacking
+    each one as soon as it arrives.  tarballs are unpacked while they are
+    being downloaded.
+
+    artifacts is a list of dicts, each with these keys:
+      name: used to label the artifact's output and timing properties
+      url_fn: called with the build to get the url to download
+      url_property, filename_property: as for DownloadFile
+      subdir: directory below the workdir to download into (default '.')
+      unpack: whether to unpack the file (default True)
+      scripts_dir: as for UnpackFile, relative to subdir
+      cache_dir, cache_size: as for DownloadFile, relative to subdir
+
+    Each cache is trimmed once, after all of the downloads have finished,
+    to the smallest cache_size given for it.  url_fns are called in order,
+    so they can use the properties set for the artifacts before them.  The time spent downloading and unpacking
+    each artifact is set in the <name>_download_time and <name>_unpack_time
+    properties, in seconds; a streamed tarball only gets a download time."""
+    haltOnFailure = True
+    name = "download_and_unpack"
+    description = ["download", "and", "unpack"]
+
+    def __init__(self, artifacts, ignore_certs=False, wget_args=None,
+                 **kwargs):
+        self.artifacts = artifacts
+        self.ignore_certs = ignore_certs
+        if wget_args:
+            self.wget_args = wget_args
+        else:
+            self.wget_args = ['--progress=dot:mega']
+        self.super_class = ShellCommand
+        self.super_class.__init__(self, **kwargs)
+        self.addFactoryArguments(artifacts=artifacts,
+                ignore_certs=ignore_certs, wget_args=wget_args)
+
+    def getArtifactCommand(self, artifact, url):
+        name = artifact['name']
+        filename = os.path.basename(url)
+        wget = ['wget'] + self.wget_args
+        if self.ignore_certs:
+            wget.append('--no-check-certificate')
+        timing = 'echo "TIMING %s %%s $((SECONDS - start))"' % name
+
+        cmds = ['set -o pipefail',
+                'mkdir -p %s' % pipes.quote(artifact.get('subdir', '.')),
+                'cd %s' % pipes.quote(artifact.get('subdir', '.')),
+                'start=$SECONDS']
+        unpack = artifact.get('unpack', True)
+        streaming = unpack and not artifact.get('cache_dir') and \
+                (filename.endswith('.tar.bz2') or filename.endswith('.tar.gz'))
+        if streaming:
+            if filename.endswith('.tar.bz2'):
+                tar = ['tar', '-jxvf', '-']
+            else:
+                tar = ['tar', '-zxvf', '-']
+            cmds.append('%s | tee %s | %s' % (
+                shellQuote(wget + ['-O', '-', url]), pipes.quote(filename),
+                shellQuote(tar)))
+            cmds.append(timing % 'download')
+        else:
+            if artifact.get('cache_dir'):
+                cmds.append(getDownloadCacheCommand(wget + ['-N', url], url,
+                        artifact['cache_dir']))
+            else:
+                cmds.append(shellQuote(wget + ['-N', url]))
+            cmds.append(timing % 'download')
+            if unpack:
+                cmds.append('start=$SECONDS')
+                cmds.append(shellQuote(getUnpackCommand(filename,
+                        artifact.get('scripts_dir', '.'))))
+                cmds.append(timing % 'unpack')
+        return '(%s) > %s 2>&1 &' % (' && '.join(cmds),
+                                     pipes.quote('.download-%s.log' % name))
+
+    def getDownloadCommand(self, urls):
+        script = ['pids=""']
+        for artifact, url in zip(self.artifacts, urls):
+            script.append(self.getArtifactCommand(artifact, url))
+            script.append('pids="$pids $!"')
+        script.append('rc=0')
+        script.append('for pid in $pids; do wait $pid || rc=1; done')
+        script.extend([getDownloadCacheTrimCommand(cache_dir, cache_size)
+                       for cache_dir, cache_size in self.getCacheSizes()])
+        for artifact in self.artifacts:
+            log = pipes.quote('.download-%s.log' % artifact['name'])
+            script.append('echo "=== %s ==="; cat %s; rm -f %s' % (
+                artifact['name'], log, log))
+        script.append('exit $rc')
+        return ['bash', '-c', '\n'.join(script)]
+
+    def getCacheSizes(self):
+        """Returns (cache_dir, cache_size) for each cache the artifacts use
+        that needs trimming, with cache_dir relative to the workdir."""
+        sizes = {}
+        for artifact in self.artifacts:
+            if not artifact.get('cache_dir') or \
+                    artifact.get('cache_size') is None:
+                continue
+            cache_dir = artifact['cache_dir']
+            if not isAbsolutePath(cache_dir):
+                cache_dir = posixpath.normpath(posixpath.join(
+                        artifact.get('subdir', '.'), cache_dir))
+            sizes[cache_dir] = min(sizes.get(cache_dir, artifact['cache_size']),
+                                   artifact['cache_size'])
+        return sorted(sizes.items())
+
+    def start(self):
+        urls = []
+        for artifact in self.artifacts:
+            try:
+                url = artifact['url_fn'](self.build)
+            except Exception, e:
+                self.addCompleteLog("errors", "Automation Error: %s" % str(e))
+                return self.finished(FAILURE)
+            url = self.build.getProperties().render(url)
+            if artifact.get('url_property'):
+                self.setProperty(artifact['url_property'], url,
+                                 "DownloadAndUnpackFiles")
+            if artifact.get('filename_property'):
+                self.setProperty(artifact['filename_property'],
+                                 os.path.basename(url),
+                                 "DownloadAndUnpackFiles")
+            urls.append(url)
+        self.setCommand(self.getDownloadCommand(urls))
+        self.super_class.start(self)
+
+    def commandComplete(self, cmd):
+        text = cmd.logs['stdio'].getText()
+        for name, kind, seconds in re.findall(
+                r'^TIMING (\S+) (download|unpack) (\d+)$', text, re.M):
+            self.setProperty('%s_%s_time' % (name, kind), int(seconds),
+                             "DownloadAndUnpackFiles")
+        if cmd.rc != 0:
+            return
+        sections = re.split(r'(?m)^=== (\S+) ===$', text)
+        output = dict(zip(sections[1::2], sections[2::2]))
+        for artifact in self.artifacts:
+            if not artifact.get('cache_dir'):
+                continue
+            if downloadCacheHitRe.search(output.get(artifact['name'], '')):
+                prop = 'download_cache_hits'
+            else:
+                prop = 'download_cache_misses'
+            count = self.build.getProperties().getProperty(prop, 0)
+            self.setProperty(prop, count + 1, "DownloadAndUnpackFiles")
+
 class UnpackTest(ShellCommand):
     description = ["unpack", "tests"]
+    # The top level directories of the tests package each testtype needs.
+    # Other testtypes get the whole package.
+    manifests = {
+        'mochitest': ['bin', 'certs', 'mochitest'],
+        'xpcshell': ['bin', 'certs', 'xpcshell'],
+        # jsreftest needs both jsreftest/ and reftest/
+        'jsreftest': ['bin', 'certs', 'jsreftest', 'reftest'],
+        'reftest': ['bin', 'certs', 'reftest'],
+        'jetpack': ['bin', 'certs', 'jetpack'],
+    }
 
     def __init__(self, filename, testtype, scripts_dir=".", **kwargs):
         self.super_class = ShellCommand
@@ -542,27 +769,24 @@ class UnpackTest(ShellCommand):
     def start(self):
         filename = self.build.getProperties().render(self.filename)
         self.filename = filename
+        # extract only the files we need - the test directory and bin/ and certs/
+        members = self.manifests.get(self.testtype, [])
         if filename.endswith(".zip"):
-            # modify the commands to extract only the files we need - the test directory and bin/ and certs/
-            if self.testtype == "mochitest":
-                self.setCommand(['unzip', '-o', filename, 'bin*', 'certs*', 'mochitest*'])
-            elif self.testtype == "xpcshell":
-                self.setCommand(['unzip', '-o', filename, 'bin*', 'certs*', 'xpcshell*'])
-            elif self.testtype == "jsreftest":
-                # jsreftest needs both jsreftest/ and reftest/ in addition to bin/ and certs/
-                self.setCommand(['unzip', '-o', filename, 'bin*', 'certs*', 'jsreftest*', 'reftest*'])
-            elif self.testtype == "reftest":
-                self.setCommand(['unzip', '-o', filename, 'bin*', 'certs*', 'reftest*'])
-            elif self.testtype == "jetpack":
-                self.setCommand(['unzip', '-o', filename, 'bin*', 'certs*', 'jetpack*'])
+            self.setCommand(['unzip', '-o', filename] +
+                            ['%s*' % m for m in members])
+        elif filename.endswith("tar.bz2") or filename.endswith("tar.gz"):
+            if filename.endswith("tar.bz2"):
+                tar = ['tar', '-jxvf', filename]
+            else:
+                tar = ['tar', '-zxvf', filename]
+            if members:
+                # tar extracts whole directories when given their names, but
+                # fails if the package was made with a ./ prefix, so fall
+                # back to extracting everything
+                self.setCommand(['bash', '-c', '%s || %s' % (
+                    shellQuote(tar + members), shellQuote(tar))])
             else:
-                # If it all fails, we extract the whole shebang
-                self.setCommand(['unzip', '-o', filename])
-        #If we come across a test not packaged as a zip file, try unpacking the whole thing using tar+gzip/bzip2
-        elif filename.endswith("tar.bz2"):
-            self.setCommand(['tar', '-jxvf', filename])
-        elif filename.endswith("tar.gz"):
-            self.setCommand(['tar', '-zxvf', filename])
+                self.setCommand(tar)
         else:
             # TODO: The test package is .zip across all three platforms, so we're special casing for that
             raise ValueError("Don't know how to handle %s" % filename)
@@ -610,6 +834,78 @@ class FindFile(ShellCommand):
             pass
         return worst
 
+# Finds the first file matching a pattern and prints its name, size and
+# digests, reading the file once for all of them
+filePropertiesScript = """\
+import fnmatch, hashlib, os, sys
+top, maxDepth, pattern = sys.argv[1], int(sys.argv[2]), sys.argv[3]
+hashTypes = sys.argv[4:]
+found = None
+for root, dirs, files in os.walk(top):
+    depth = root[len(top):].count(os.sep) + 1
+    matches = sorted(fnmatch.filter(files, pattern))
+    if matches:
+        found = os.path.join(root, matches[0])
+        break
+    if depth >= maxDepth:
+        del dirs[:]
+    dirs.sort()
+if not found:
+    sys.stdout.write('No file matching %s in %s\\n' % (pattern, top))
+    sys.exit(1)
+hashes = [hashlib.new(h) for h in hashTypes]
+size = 0
+f = open(found, 'rb')
+while True:
+    block = f.read(1024 * 1024)
+    if not block:
+        break
+    size += len(block)
+    for h in hashes:
+        h.update(block)
+f.close()
+sys.stdout.write('filename: %s\\n' % os.path.basename(found))
+sys.stdout.write('size: %i\\n' % size)
+for hashType, h in zip(hashTypes, hashes):
+    sys.stdout.write('%s: %s\\n' % (hashType, h.hexdigest()))
+"""
+
+class SetFileProperties(ShellCommand):
+    """Sets the <fileType>Filename, <fileType>Size and <fileType>Hash
+    properties for the first file called filename (a shell pattern) in
+    directory, like find -maxdepth maxDepth would.  Every digest in
+    hashTypes is computed in the same pass over the file; <fileType>Hash is
+    the first one, and the others are set as <fileType>Hash_<hashType>."""
+    def __init__(self, filename, directory, fileType, hashTypes=('sha512',),
+                 maxDepth=1, **kwargs):
+        self.super_class = ShellCommand
+        self.super_class.__init__(self, **kwargs)
+        self.addFactoryArguments(filename=filename, directory=directory,
+                fileType=fileType, hashTypes=hashTypes, maxDepth=maxDepth)
+        self.fileType = fileType
+        self.hashTypes = list(hashTypes)
+        self.setCommand(['python', '-c', filePropertiesScript, directory,
+                         str(maxDepth), filename] + self.hashTypes)
+
+    def commandComplete(self, cmd):
+        if cmd.rc != 0:
+            return
+        values = {}
+        for line in cmd.logs['stdio'].getText().splitlines():
+            if ': ' in line:
+                key, value = line.split(': ', 1)
+                values[key] = value.strip()
+        self.setProperty(self.fileType + 'Filename', values['filename'],
+                         'SetFileProperties')
+        self.setProperty(self.fileType + 'Size', values['size'],
+                         'SetFileProperties')
+        for i, hashType in enumerate(self.hashTypes):
+            if i == 0:
+                prop = self.fileType + 'Hash'
+            else:
+                prop = '%sHash_%s' % (self.fileType, hashType)
+            self.setProperty(prop, values[hashType], 'SetFileProperties')
+
 class MozillaClobberer(ShellCommand):
     flunkOnFailure = False
     description=['checking', 'clobber', 'times']
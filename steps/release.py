@@ -1,6 +1,5 @@
 import re
 
-from buildbot.process.properties import WithProperties
 from buildbot.status.builder import FAILURE, SUCCESS, WARNINGS, worst_status
 
 from buildbotcustom.steps.base import ShellCommand
@@ -78,27 +77,97 @@ class L10nVerifyMetaDiff(TinderboxShellCommand):
 
 
 
+# Compares the chan1 snippets under dir1 with the chan2 snippets under dir2.
+# Snippets live in <dir>/<product>/<version>/<platform>/<buildid>/<locale>/
+# <channel>/ and are parsed into key/value pairs; positional (version 0)
+# snippet lines are keyed by line number.  Prints one tab separated line per
+# problem:
+#   MISSING <path>                 only in dir1
+#   EXTRA <path>                   only in dir2
+#   DIFF <path> <key> <v1> <v2>    present in both with different values
+# followed by "COMPARED <n>".  Paths are relative to the snippet dirs, with
+# chan1 as the channel.  Whether the problems matter is up to the step, so
+# the script only fails if it can't produce the report.
+snippetComparisonScript = """\
+import os, sys
+dir1, chan1, dir2, chan2 = sys.argv[1:5]
+workers = int(sys.argv[5])
+
+def findSnippets(top, chan):
+    found = set()
+    for root, dirs, files in os.walk(top):
+        if os.path.basename(root) == chan:
+            parent = os.path.dirname(os.path.relpath(root, top))
+            for f in files:
+                found.add(os.path.join(parent, f))
+    return found
+
+def parseSnippet(path):
+    values = {}
+    f = open(path)
+    for n, line in enumerate(f.read().splitlines()):
+        if '=' in line:
+            key, value = line.split('=', 1)
+            values[key] = value
+        elif line:
+            values['#%i' % n] = line
+    f.close()
+    return values
+
+def compare(snippet):
+    parent, name = os.path.split(snippet)
+    a = parseSnippet(os.path.join(dir1, parent, chan1, name))
+    b = parseSnippet(os.path.join(dir2, parent, chan2, name))
+    diffs = []
+    for key in sorted(set(a) | set(b)):
+        if a.get(key) != b.get(key):
+            diffs.append((key, a.get(key, ''), b.get(key, '')))
+    return snippet, diffs
+
+def show(kind, snippet, *fields):
+    parent, name = os.path.split(snippet)
+    line = '\\t'.join((kind, os.path.join(parent, chan1, name)) + fields)
+    sys.stdout.write(line + '\\n')
+
+snippets1 = findSnippets(dir1, chan1)
+snippets2 = findSnippets(dir2, chan2)
+common = sorted(snippets1 & snippets2)
+if workers > 1 and len(common) > 1:
+    import multiprocessing
+    pool = multiprocessing.Pool(workers)
+    results = pool.imap(compare, common, 64)
+else:
+    pool = None
+    results = map(compare, common)
+for snippet in sorted(snippets1 - snippets2):
+    show('MISSING', snippet)
+for snippet in sorted(snippets2 - snippets1):
+    show('EXTRA', snippet)
+for snippet, diffs in results:
+    for key, value1, value2 in diffs:
+        show('DIFF', snippet, key, value1, value2)
+if pool:
+    pool.close()
+sys.stdout.write('COMPARED %i\\n' % len(common))
+"""
+
 class SnippetComparison(ShellCommand):
-    # Alphas/Betas are WARN'ed about in a releasetest vs release comparison
-    # because they were shipped on the 'beta' channel, which means patcher
-    # will not generate release channel snippets for them. This is OK, but we
-    # need to ensure we don't fail the whole comparison because of it
-    acceptable_warnings_regex = re.compile('WARN: [\w.]+/\w+/[0-9.]+[ab][0-9]+/.*release.* exists')
-    # If we find +++ at the start of a line, let's assume it's output from
-    # 'diff', which is always cause for concern.
-    diff_regex = re.compile('^---')
+    # Alphas/Betas are reported as missing or extra in a releasetest vs release
+    # comparison because they were shipped on the 'beta' channel, which means
+    # patcher will not generate release channel snippets for them. This is OK,
+    # but we need to ensure we don't fail the whole comparison because of it
+    prerelease_regex = re.compile('^[0-9.]+[ab][0-9]+$')
 
     # command and name get overridden at runtime with whatever is passed to
     # ShellCommand.__init__
     def __init__(self, chan1, chan2, dir1, dir2, name=None, command=None,
                  timeout=10*60, description=['snippet', 'compare'],
                  warnOnFailure=True, warnOnWarnings=True, flunkOnFailure=False,
-                 **kwargs):
+                 workers=4, **kwargs):
         self.super_class = ShellCommand
         if command is None:
-            command = ['bash',
-                       WithProperties('%(toolsdir)s/release/compare-channel-snippets.sh'),
-                       dir1, chan1, dir2, chan2]
+            command = ['python', '-c', snippetComparisonScript,
+                       dir1, chan1, dir2, chan2, str(workers)]
         if name is None:
             name = 'compare_%s_to_%s' % (chan1, chan2)
         self.super_class.__init__(self,
@@ -110,30 +179,49 @@ class SnippetComparison(ShellCommand):
                                   warnOnWarnings=warnOnWarnings,
                                   flunkOnFailure=flunkOnFailure,
                                   **kwargs)
-        self.addFactoryArguments(chan1=chan1, chan2=chan2, dir1=dir1, dir2=dir2)
+        self.addFactoryArguments(chan1=chan1, chan2=chan2, dir1=dir1, dir2=dir2,
+                                 workers=workers)
         self.warnings = False
+        self.compared = None
+
+    def isAcceptable(self, kind, path):
+        # path is <product>/<version>/...
+        parts = path.split('/')
+        return kind in ('MISSING', 'EXTRA') and len(parts) > 1 and \
+          self.prerelease_regex.match(parts[1]) is not None
+
+    def parseReport(self, text):
+        """Returns (problems, compared) from the comparison script's output,
+        where problems is a list of the fields of each reported problem."""
+        problems = []
+        compared = None
+        for line in text.splitlines():
+            fields = line.split('\t')
+            if fields[0] in ('MISSING', 'EXTRA', 'DIFF') and len(fields) > 1:
+                problems.append(fields)
+            elif line.startswith('COMPARED '):
+                compared = int(line.split()[1])
+        return problems, compared
 
     def createSummary(self, stdio):
+        problems, self.compared = self.parseReport(stdio.getText())
         unacceptable_warnings = []
-        diffs = []
-        lines = stdio.readlines()
-        i = 0
-        while i < len(lines):
-            line = lines[i]
-            if line.startswith('WARN') and \
-              not self.acceptable_warnings_regex.search(line):
-                unacceptable_warnings.extend(lines[i:i+2])
-            if self.diff_regex.search(line):
-                diffs.extend(lines[i:i+2])
-            i += 1
+        diffs = {}
+        for fields in problems:
+            kind, path = fields[:2]
+            if kind == 'DIFF':
+                diffs.setdefault(path, []).append(
+                    "  %s: %s -> %s\n" % tuple(fields[2:5]))
+            elif not self.isAcceptable(kind, path):
+                unacceptable_warnings.append("%s: %s\n" % (kind, path))
 
         if len(unacceptable_warnings) > 0:
             self.addCompleteLog('Warnings', "".join(unacceptable_warnings))
             self.warnings = True
         if len(diffs) > 0:
             log = "The following files have differences:\n\n"
-            log += "".join(diffs)
-            log += "\nFull details are in the stdio log.\n"
+            for path in sorted(diffs):
+                log += path + "\n" + "".join(diffs[path])
             self.addCompleteLog('Diffs', log)
             self.warnings = True
 
@@ -142,6 +230,9 @@ class SnippetComparison(ShellCommand):
         # If it catches something we don't, it's almost certainly worse
         if super_result not in (SUCCESS, WARNINGS):
             return super_result
+        # A comparison that died part way through doesn't print its summary
+        if self.compared is None:
+            return WARNINGS
         # Warnings already excludes warnings we know to be OK, so if that log
         # exists we can assume we should warn because of it
         if self.warnings:
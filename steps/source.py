@@ -1,4 +1,5 @@
 from buildbot.process.buildstep import regex_log_evaluator
+from buildbot.status.builder import SUCCESS, FAILURE, worst_status
 
 from buildbotcustom.steps.base import RetryingShellCommand
 from buildbotcustom.status.errors import hg_errors
@@ -10,3 +11,51 @@ class MercurialCloneCommand(RetryingShellCommand):
         if not log_eval_func:
             log_eval_func = lambda c,s: regex_log_evaluator(c, s, hg_errors)
         self.super_class.__init__(self, log_eval_func=log_eval_func, **kwargs)
+
+
+# Updates an existing checkout in place, or makes a fresh clone if there is
+# no usable checkout yet.  Takes the hg binary, repository, destination,
+# revision, number of pull attempts and seconds to sleep between them as
+# positional arguments so that they can be WithProperties.  The pull is
+# retried so that a transient server error doesn't cost a full clone.  Each
+# attempt starts with hgUpdateOrCloneMarker so that only the output of the
+# last one needs to be checked for errors.
+hgUpdateOrCloneMarker = 'hg_update_or_clone: attempt'
+hgUpdateOrCloneScript = '''\
+hg="$1"; repo="$2"; dest="$3"; rev="$4"; attempts="$5"; sleep="$6"
+if [ -d "$dest/.hg" ]; then
+    for ((attempt = 1; attempt <= attempts; attempt++)); do
+        [ $attempt = 1 ] || sleep $sleep
+        echo "%(marker)s $attempt: pull"
+        if "$hg" -R "$dest" pull "$repo"; then
+            "$hg" -R "$dest" update -C -r "$rev" &&
+            "$hg" -R "$dest" --config extensions.purge= purge --all &&
+            echo "Updated $dest in place in $SECONDS seconds" &&
+            exit 0
+            # The checkout itself is broken, so start over
+            break
+        fi
+    done
+fi
+echo "%(marker)s: clone"
+rm -rf "$dest" && "$hg" clone -U "$repo" "$dest" &&
+    "$hg" -R "$dest" update -C -r "$rev" &&
+    echo "Cloned $dest in $SECONDS seconds"
+''' % {'marker': hgUpdateOrCloneMarker}
+
+def hgUpdateOrCloneCommand(repo, dest, rev='default', hg_bin='hg',
+                           pullAttempts=3, retrySleep=30):
+    return ['bash', '-c', hgUpdateOrCloneScript, 'hg_update_or_clone',
+            hg_bin, repo, dest, rev, str(pullAttempts), str(retrySleep)]
+
+def hgUpdateOrCloneEvaluator(cmd, step_status):
+    """Evaluates hgUpdateOrCloneCommand like MercurialCloneCommand does,
+    but ignores errors from attempts that were followed by another one."""
+    worst = SUCCESS
+    if cmd.rc != 0:
+        worst = FAILURE
+    lastAttempt = cmd.logs['stdio'].getText().split(hgUpdateOrCloneMarker)[-1]
+    for err, possible_status in hg_errors:
+        if err.search(lastAttempt):
+            worst = worst_status(worst, possible_status)
+    return worst
@@ -28,6 +28,7 @@
 from buildbot.status.builder import FAILURE, SUCCESS, WARNINGS, EXCEPTION, \
   worst_status
 from buildbot.process.properties import WithProperties
+from buildbot.util import json
 
 from twisted.internet.defer import DeferredList, Deferred
 from twisted.python import log
@@ -120,7 +121,9 @@ def tinderboxPrint(testName,
 class CompareBloatLogs(ShellCommand):
     warnOnWarnings = True
     warnOnFailure = True
-    
+    # TOTAL 23 0% 876224
+    totalRe = re.compile('TOTAL\s+(\d+)\s+[\-\d\.]+\%\s+(\d+)')
+
     def __init__(self, bloatLog, testname="", testnameprefix="",
                        bloatDiffPath="tools/rb/bloatdiff.pl",
                        mozillaDir="", tbPrint=True, **kwargs):
@@ -158,24 +161,24 @@ class CompareBloatLogs(ShellCommand):
         return superResult
             
     def createSummary(self, log):
-        summary = "######################## BLOAT STATISTICS\n"
-        totalLineList = []
+        # Collect lines in a list and join them once; appending to a string
+        # is quadratic in the size of the bloatdiff output.
+        summary = ["######################## BLOAT STATISTICS\n"]
         leaks = 0
         bloat = 0
+        found = False
         for line in log.readlines():
-            summary += line
-            if leaks == 0 and bloat == 0:
-                if "TOTAL" in line:
-                    m = re.search('TOTAL\s+(\d+)\s+[\-\d\.]+\%\s+(\d+)',
-                                  line)
-                    leaks = int(m.group(1))
-                    bloat = int(m.group(2))
-        summary += "######################## END BLOAT STATISTICS\n\n"
-
-        # Scrape for leak/bloat totals from TOTAL line
-        # TOTAL 23 0% 876224        
-        summary += "leaks = %d\n" % leaks
-        summary += "bloat = %d\n" % bloat
+            summary.append(line)
+            # Scrape for leak/bloat totals from the first TOTAL line
+            if not found and "TOTAL" in line:
+                m = self.totalRe.search(line)
+                leaks = int(m.group(1))
+                bloat = int(m.group(2))
+                found = leaks != 0 or bloat != 0
+        summary.append("######################## END BLOAT STATISTICS\n\n")
+
+        summary.append("leaks = %d\n" % leaks)
+        summary.append("bloat = %d\n" % bloat)
 
         leaksAbbr = "%sRLk" % self.testnameprefix
         leaksTestname = ("%srefcnt_leaks" % self.testnameprefix).replace(' ', '_')
@@ -189,13 +192,17 @@ class CompareBloatLogs(ShellCommand):
                                         leaksAbbr,
                                         formatBytes(leaks,3)
                                         )
-            summary += tinderLink
+            summary.append(tinderLink)
 
         self.setProperty('leaks',leaks)
         self.setProperty('bloat',bloat)
         self.setProperty('testresults', [(leaksAbbr, leaksTestname, leaks, formatBytes(leaks,3))])
         self.addCompleteLog(leaksAbbr + ":" + formatBytes(leaks,3),
-                            summary)
+                            ''.join(summary))
+        # Machine readable copy of the totals for consumers that would
+        # otherwise have to scrape the log above.
+        self.addCompleteLog('bloat.json',
+                            json.dumps({'leaks': leaks, 'bloat': bloat}))
 
 class CompareLeakLogs(ShellCommand):
     warnOnWarnings = True
@@ -249,7 +256,6 @@ class CompareLeakLogs(ShellCommand):
         leakStats = {}
         leakStats['old'] = {}
         leakStats['new'] = {}
-        summary = self.testname + " trace-malloc bloat test: leakstats\n"
 
         lkAbbr = "%sLk" % self.testnameprefix
         lkTestname = ("%strace_malloc_leaks" % self.testnameprefix).replace(' ','_')
@@ -260,7 +266,6 @@ class CompareLeakLogs(ShellCommand):
 
         resultSet = 'new'
         for line in log.readlines():
-            summary += line
             m = self.leaksAllocsRe.search(line)
             if m:
                 leakStats[resultSet]['leaks'] = m.group(1)
@@ -318,6 +323,7 @@ class CompareLeakLogs(ShellCommand):
             logText += "%s: %s\n%s: %s\n%s: %s\n" % (lkAbbr, lk, mhAbbr, mh, aAbbr, a)
 
         self.addCompleteLog(slug, logText)
+        self.addCompleteLog('leakstats.json', json.dumps(leakStats['new']))
 
 
 class Codesighs(ShellCommand):
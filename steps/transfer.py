@@ -1,10 +1,73 @@
 from os import path
+from pipes import quote
 from time import gmtime, strftime, strptime
 
 import buildbot
 from buildbotcustom.common import getSupportedPlatforms
 from buildbotcustom.steps.base import ShellCommand
 
+# Uploads one file in chunks, several at a time.  Chunks go into
+# .<file>.chunks next to the destination and are checksummed against the ones
+# already there first, so a retried upload only sends the missing or damaged
+# ones.  The server then joins them and checks the whole file's sha1 before
+# moving it into place.
+chunkedUploadFunction = r'''
+upload_chunked() {
+    f="$1"; dest="$2"
+    b=$(basename "$f")
+    chunks="$dest/.$b.chunks"
+    sum=$(openssl sha1 < "$f" | sed 's/^.* //')
+    tmp=$(mktemp -d "${TMPDIR:-/tmp}/upload.XXXXXX") || return 1
+    if split -b "$CHUNK_SIZE" -a 4 "$f" "$tmp/$b.part." &&
+       { [ -e "$tmp/$b.part.aaaa" ] || : > "$tmp/$b.part.aaaa"; } &&
+       $SSH "mkdir -p $chunks && cd $chunks && (sha1sum $b.part.* 2>/dev/null; true)" > "$tmp/have" &&
+       (cd "$tmp" && for p in "$b".part.*; do
+           psum=$(openssl sha1 < "$p" | sed 's/^.* //')
+           grep -q "^$psum  $p\$" have || echo "$p"
+        done > need) &&
+       (cd "$tmp" && xargs -P "$STREAMS" -I{} $SCP {} "$TARGET:$chunks/" < need) &&
+       parts=$(cd "$tmp" && echo "$b".part.*) &&
+       $SSH "cd $dest && (cd .$b.chunks && cat $parts) > $b.tmp && test \$(sha1sum < $b.tmp | cut -c1-40) = $sum && mv $b.tmp $b && rm -rf .$b.chunks || { rm -rf .$b.chunks $b.tmp; false; }"
+    then
+        rm -rf "$tmp"
+        return 0
+    fi
+    rm -rf "$tmp"
+    return 1
+}
+'''
+
+def chunkedUploadCommand(files, username, host, remoteDir, identity=None,
+                         port=22, chunkSize=8*1024*1024, streams=4,
+                         retries=5, retrySleep=30):
+    """Returns a bash script that uploads files to remoteDir on host in
+    chunks of chunkSize bytes, streams chunks at a time, resuming up to
+    retries times.  files is inserted into the script as is, so it may
+    contain shell wildcards."""
+    ssh = ['ssh', '-l', username, '-p', str(port)]
+    scp = ['scp', '-P', str(port)]
+    if identity:
+        ssh.extend(['-i', identity])
+        scp.extend(['-i', identity])
+    ssh.append(host)
+    script = [chunkedUploadFunction,
+              'SSH="%s"' % ' '.join(ssh),
+              'SCP="%s"' % ' '.join(scp),
+              'TARGET=%s' % quote('%s@%s' % (username, host)),
+              'CHUNK_SIZE=%i' % chunkSize,
+              'STREAMS=%i' % streams,
+              'for f in %s; do' % files,
+              '    [ -f "$f" ] || { echo "No such file: $f"; exit 1; }',
+              '    n=1',
+              '    until upload_chunked "$f" %s; do' % quote(remoteDir),
+              '        [ $n -ge %i ] && exit 1' % retries,
+              '        n=$((n + 1))',
+              '        echo "Retrying upload of $f"',
+              '        sleep %i' % retrySleep,
+              '    done',
+              'done']
+    return '\n'.join(script)
+
 class MozillaStageUpload(ShellCommand):
     def __init__(self, objdir, username, milestone, platform, remoteHost,
                  remoteBasePath, group=None, chmodMode=755, sshKey=None,
@@ -12,7 +75,8 @@ class MozillaStageUpload(ShellCommand):
                  releaseToTinderboxBuilds=True, tinderboxBuildsDir=None,
                  releaseToCandidates=False, remoteCandidatesPath=None,
                  dependToDated=True, uploadCompleteMar=True,
-                 uploadLangPacks=False, packageGlob=None, **kwargs):
+                 uploadLangPacks=False, packageGlob=None, singleUpload=False,
+                 chunkedUpload=False, **kwargs):
         """
         @type  objdir: string
         @param objdir: The obj directory used for the build. This is needed to
@@ -115,6 +179,21 @@ class MozillaStageUpload(ShellCommand):
                             a sensible default in objdir/dist/*.{ext} with ext tailored
                             for that platform (i.e. .zip, .dmg, .tar.gz)
 
+        @type  singleUpload: bool
+        @param singleUpload: When True, all the files are sent once, as a tar
+                             stream over a single ssh connection, and a
+                             script on remoteHost hardlinks them into the
+                             other directories and fixes their permissions.
+                             Otherwise every directory gets its own mkdir,
+                             scp, chmod, etc. Default: False
+
+        @type  chunkedUpload: bool
+        @param chunkedUpload: When True, files are uploaded with
+                              chunkedUploadCommand instead of scp, so that
+                              large packages go up over several connections
+                              and dropped uploads resume.  It has no effect
+                              when singleUpload is True. Default: False
+
         """
 
         ShellCommand.__init__(self, **kwargs)
@@ -136,7 +215,9 @@ class MozillaStageUpload(ShellCommand):
                                  remoteCandidatesPath=remoteCandidatesPath,
                                  dependToDated=dependToDated,
                                  uploadCompleteMar=uploadCompleteMar,
-                                 uploadLangPacks=uploadLangPacks)
+                                 uploadLangPacks=uploadLangPacks,
+                                 singleUpload=singleUpload,
+                                 chunkedUpload=chunkedUpload)
 
         assert platform in getSupportedPlatforms()
         if releaseToCandidates:
@@ -160,6 +241,8 @@ class MozillaStageUpload(ShellCommand):
         self.dependToDated = dependToDated
         self.uploadCompleteMar = uploadCompleteMar
         self.uploadLangPacks = uploadLangPacks
+        self.singleUpload = singleUpload
+        self.chunkedUpload = chunkedUpload
 
         self.description = ["uploading package(s) to", remoteHost]
         self.descriptionDone = ["upload package(s) to", remoteHost]
@@ -245,11 +328,20 @@ class MozillaStageUpload(ShellCommand):
         return self._getBaseCommand(ssh=True) + ' ' + self.remoteHost + \
                ' mkdir -p ' + dir
 
-    def uploadCommand(self, dir):
-        return self._getBaseCommand(scp=True) + ' ' + self.getPackageGlob() + \
+    def _getUploadCommand(self, packageGlob, dir):
+        if self.chunkedUpload:
+            identity = None
+            if self.sshKey:
+                identity = '$HOME/.ssh/%s' % self.sshKey
+            return 'bash -c ' + quote(chunkedUploadCommand(packageGlob,
+                    self.username, self.remoteHost, dir, identity=identity))
+        return self._getBaseCommand(scp=True) + ' ' + packageGlob + \
                  ' ' + self.username + '@' + self.remoteHost + ':' + \
                  dir
 
+    def uploadCommand(self, dir):
+        return self._getUploadCommand(self.getPackageGlob(), dir)
+
     def chmodCommand(self, dir):
         return self._getBaseCommand(ssh=True) + ' ' + self.remoteHost + \
                ' chmod -R ' + str(self.chmodMode) + ' ' + dir
@@ -277,15 +369,73 @@ class MozillaStageUpload(ShellCommand):
 
     def uploadCompleteMarCommand(self, dir):
         packageGlob = '%s/dist/update/*.complete.mar' % self.objdir
-        return self._getBaseCommand(scp=True) + ' ' + packageGlob + \
-                 ' ' + self.username + '@' + self.remoteHost + ':' + \
-                 dir
+        return self._getUploadCommand(packageGlob, dir)
 
     def uploadLangPacksCommand(self, dir):
         packageGlob = '%s/dist/install/*.langpack.xpi' % self.objdir
-        return self._getBaseCommand(scp=True) + ' ' + packageGlob + \
-                 ' ' + self.username + '@' + self.remoteHost + ':' + \
-                 dir
+        return self._getUploadCommand(packageGlob, dir)
+
+    def collectFilesCommand(self, packageGlob, var):
+        # Appends the basename of every file matching packageGlob to var,
+        # and tar arguments to pick it up from its directory to tarargs.
+        # tar resolves a relative -C against the previous one, so the
+        # directories are made absolute.
+        return 'for f in ' + packageGlob + '; do ' + \
+               '[ -f "$f" ] || { echo "No such file: $f"; exit 1; }; ' + \
+               var + '="$' + var + ' $(basename "$f")"; ' + \
+               'tarargs="$tarargs -C $(cd "$(dirname "$f")" && pwd) ' + \
+               '$(basename "$f")"; done'
+
+    def singleUploadCommand(self, datedDir, latestDir, tinderboxBuildsDir,
+                            candidatesDir):
+        # The files for every directory are uploaded once, into the first
+        # one; dated and latest also get the extras (complete mar, langpacks)
+        dirs = []
+        if self.releaseToDated:
+            dirs.append((datedDir, '$packages $extras'))
+        if self.releaseToLatest:
+            if self.releaseToDated:
+                # Like the rsync, take everything from the dated directory
+                dirs.append((latestDir, '.'))
+            else:
+                dirs.append((latestDir, '$packages $extras'))
+        if self.releaseToTinderboxBuilds:
+            dirs.append((tinderboxBuildsDir, '$packages'))
+        if self.releaseToCandidates:
+            dirs.append((candidatesDir, '$packages'))
+        if not dirs:
+            return 'true'
+        allDirs = ' '.join([d for d, files in dirs])
+
+        local = ['packages=""', 'extras=""', 'tarargs=""',
+                 self.collectFilesCommand(self.getPackageGlob(), 'packages')]
+        if self.releaseToDated or self.releaseToLatest:
+            if self.uploadCompleteMar:
+                local.append(self.collectFilesCommand(
+                    '%s/dist/update/*.complete.mar' % self.objdir, 'extras'))
+            if self.uploadLangPacks:
+                local.append(self.collectFilesCommand(
+                    '%s/dist/install/*.langpack.xpi' % self.objdir, 'extras'))
+
+        primary = dirs[0][0]
+        remote = ['mkdir -p ' + allDirs,
+                  'cd ' + primary,
+                  'tar -xf -']
+        for dir, files in dirs[1:]:
+            # Hardlink when the directories share a filesystem
+            remote.append('(cp -alf %s %s/ 2>/dev/null || cp -af %s %s/)' % (
+                          files, dir, files, dir))
+        remote.append('chmod -R %s %s' % (self.chmodMode, allDirs))
+        if self.group:
+            remote.append('chgrp -R %s %s' % (self.group, allDirs))
+        if self.releaseToDated:
+            targetDir = path.join(self.remoteBasePath, 'nightly','')
+            remote.append('ln -fs %s %s' % (datedDir.replace(targetDir, ''),
+                                            targetDir))
+
+        return '(' + '; '.join(local) + ' && tar -cf - $tarargs | ' + \
+               self._getBaseCommand(ssh=True) + ' ' + self.remoteHost + \
+               ' "' + ' && '.join(remote) + '")'
 
     def start(self):
         datedDir = self.getLongDatedPath()
@@ -293,6 +443,12 @@ class MozillaStageUpload(ShellCommand):
         tinderboxBuildsDir = self.getTinderboxBuildsPath()
         candidatesDir = self.getCandidatesPath()
 
+        if self.singleUpload:
+            self.setCommand(self.singleUploadCommand(datedDir, latestDir,
+                    tinderboxBuildsDir, candidatesDir))
+            ShellCommand.start(self)
+            return
+
         commands = []
         if self.releaseToDated:
             # 1) Create the directory on the staging server.
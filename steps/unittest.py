@@ -26,8 +26,10 @@
 # ***** END LICENSE BLOCK *****
 
 import re
+import sys
 
 from buildbot.steps.shell import WithProperties
+from buildbot.process.buildstep import LogLineObserver
 from buildbot.status.builder import SUCCESS, WARNINGS, FAILURE, HEADER, worst_status
 
 from buildbotcustom.steps.base import ShellCommand
@@ -73,168 +75,244 @@ def summaryText(passCount, failCount, knownFailCount=None,
 
     return summary
 
+# Regular expression for crash and leak detections.
+harnessErrorsRe = re.compile(r"TEST-UNEXPECTED-FAIL \| .* \| (Browser crashed \(minidump found\)|missing output line for total leaks!|negative leaks caught!|leaked \d+ bytes during test execution)")
+tunitHarnessErrorsRe = re.compile(r"TEST-UNEXPECTED-FAIL \| .* \| (missing output line for total leaks!|negative leaks caught!|leaked \d+ bytes during test execution)")
+
+class LogSummarizer(object):
+    """Base class for test log summarizers.
+
+    Summarizers are fed one line at a time through processLine(), either
+    from a finished log or incrementally by a SummaryLogObserver while the
+    step is running, so the whole log never needs to be held in memory.
+    summary() returns the TinderboxPrint text for the lines seen so far.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def processLine(self, line):
+        raise NotImplementedError
+
+    def summary(self):
+        raise NotImplementedError
+
+    def processLog(self, log):
+        for line in log.readlines():
+            self.processLine(line)
+        return self.summary()
+
 # otherIdent can be None if the test suite does not have this feature (yet).
-def summarizeLog(name, log, successIdent, failureIdent, otherIdent, infoRe):
-    # Counts and flags.
-    successCount = -1
-    failureCount = -1
-    otherCount = otherIdent and -1
-    crashed = False
-    leaked = False
-
-    # Regular expression for result summary details.
-    # Reuse 'infoRe'.
-    infoRe = re.compile(infoRe)
-    # Regular expression for crash and leak detections.
-    harnessErrorsRe = re.compile(r"TEST-UNEXPECTED-FAIL \| .* \| (Browser crashed \(minidump found\)|missing output line for total leaks!|negative leaks caught!|leaked \d+ bytes during test execution)")
-    # Process the log.
-    for line in log.readlines():
+class InfoLogSummarizer(LogSummarizer):
+    def __init__(self, name, successIdent, failureIdent, otherIdent, infoRe):
+        LogSummarizer.__init__(self, name)
+        self.successIdent = successIdent
+        self.failureIdent = failureIdent
+        self.otherIdent = otherIdent
+        # Regular expression for result summary details.
+        self.infoRe = re.compile(infoRe)
+
+        # Counts and flags.
+        self.successCount = -1
+        self.failureCount = -1
+        self.otherCount = otherIdent and -1
+        self.crashed = False
+        self.leaked = False
+
+    def processLine(self, line):
         # Set the counts.
-        m = infoRe.match(line)
+        m = self.infoRe.match(line)
         if m:
             r = m.group(1)
-            if r == successIdent:
-                successCount = int(m.group(2))
-            elif r == failureIdent:
-                failureCount = int(m.group(2))
+            if r == self.successIdent:
+                self.successCount = int(m.group(2))
+            elif r == self.failureIdent:
+                self.failureCount = int(m.group(2))
             # If otherIdent == None, then infoRe should not match it,
             # so this test is fine as is.
-            elif r == otherIdent:
-                otherCount = int(m.group(2))
-            continue
+            elif r == self.otherIdent:
+                self.otherCount = int(m.group(2))
+            return
         # Set the error flags.
         m = harnessErrorsRe.match(line)
         if m:
             r = m.group(1)
             if r == "Browser crashed (minidump found)":
-                crashed = True
+                self.crashed = True
             elif r == "missing output line for total leaks!":
-                leaked = None
+                self.leaked = None
             else:
-                leaked = True
-            # continue
-
-    # Return the summary.
-    return "TinderboxPrint: %s<br/>%s\n" % (name,
-        summaryText(successCount, failureCount, otherCount, crashed, leaked))
-
-def summarizeLogMochitest(name, log):
-    infoRe = r"\d+ INFO (Passed|Failed|Todo):\ +(\d+)"
-    # Support browser-chrome result summary format which differs from MozillaMochitest's.
-    if name == 'mochitest-browser-chrome':
-        infoRe = r"\t(Passed|Failed|Todo): (\d+)"
-
-    return summarizeLog(
-        name, log, "Passed", "Failed", "Todo",
-        infoRe)
-
-def summarizeLogRemoteMochitest(name, log):
-    keys    = ('Passed', 'Failed', 'Todo')
-    d       = {}
-    summary = ""
-    found   = False
-
-    for s in keys:
-        d[s] = '0'
-    for line in log.readlines():
-        if found:
-            s = line.strip()
-            l = s.split(': ')
-            if len(l) == 2 and l[0] in keys:
-                if l[0] in d:
-                    d[l[0]] = l[1]
-        else:
-            if line.startswith('Browser Chrome Test Summary'):
-                found = True
-    if found:
-        if d.has_key('Failed') and str(d['Failed']) != '0':
-            d['Failed'] = emphasizeFailureText(d['Failed'])
-        summary = "%(Passed)s/%(Failed)s/%(Todo)s" % d
-    # Return the summary.
-    return "TinderboxPrint: %s<br/>%s\n" % (name, summary)
-
-def summarizeLogReftest(name, log):
-    return summarizeLog(
-        name, log, "Successful", "Unexpected", "Known problems",
-        r"REFTEST INFO \| (Successful|Unexpected|Known problems): (\d+) \(")
+                self.leaked = True
+
+    def summary(self):
+        return "TinderboxPrint: %s<br/>%s\n" % (self.name,
+            summaryText(self.successCount, self.failureCount,
+                        self.otherCount, self.crashed, self.leaked))
+
+class MochitestSummarizer(InfoLogSummarizer):
+    def __init__(self, name):
+        infoRe = r"\d+ INFO (Passed|Failed|Todo):\ +(\d+)"
+        # Support browser-chrome result summary format which differs from MozillaMochitest's.
+        if name == 'mochitest-browser-chrome':
+            infoRe = r"\t(Passed|Failed|Todo): (\d+)"
+        InfoLogSummarizer.__init__(self, name, "Passed", "Failed", "Todo",
+                                   infoRe)
+
+class ReftestSummarizer(InfoLogSummarizer):
+    def __init__(self, name):
+        InfoLogSummarizer.__init__(self, name,
+            "Successful", "Unexpected", "Known problems",
+            r"REFTEST INFO \| (Successful|Unexpected|Known problems): (\d+) \(")
+
+class XpcshellSummarizer(InfoLogSummarizer):
+    def __init__(self, name):
+        InfoLogSummarizer.__init__(self, name, "Passed", "Failed", None,
+                                   r"INFO \| (Passed|Failed): (\d+)")
+
+class RemoteMochitestSummarizer(LogSummarizer):
+    keys = ('Passed', 'Failed', 'Todo')
+
+    def __init__(self, name):
+        LogSummarizer.__init__(self, name)
+        self.counts = dict([(k, '0') for k in self.keys])
+        self.found = False
+
+    def processLine(self, line):
+        if self.found:
+            l = line.strip().split(': ')
+            if len(l) == 2 and l[0] in self.keys:
+                self.counts[l[0]] = l[1]
+        elif line.startswith('Browser Chrome Test Summary'):
+            self.found = True
+
+    def summary(self):
+        summary = ""
+        if self.found:
+            d = self.counts.copy()
+            if str(d['Failed']) != '0':
+                d['Failed'] = emphasizeFailureText(d['Failed'])
+            summary = "%(Passed)s/%(Failed)s/%(Todo)s" % d
+        # Return the summary.
+        return "TinderboxPrint: %s<br/>%s\n" % (self.name, summary)
+
+class JetpackSummarizer(LogSummarizer):
+    infoRe = re.compile(r"(\d+) of (\d+) tests passed")
 
-def summarizeLogXpcshelltests(name, log):
-    return summarizeLog(
-        name, log, "Passed", "Failed", None,
-        r"INFO \| (Passed|Failed): (\d+)")
+    def __init__(self, name):
+        LogSummarizer.__init__(self, name)
+        self.successCount = 0
+        self.totalCount = 0
 
-def summarizeLogJetpacktests(name, log):
-    log = log.getText()
-    infoRe = re.compile(r"(\d+) of (\d+) tests passed")
-    successCount = 0
-    failCount = 0
-    totalCount = 0
-    summary=""
-    for line in log.splitlines():
-        m = infoRe.match(line)
+    def processLine(self, line):
+        m = self.infoRe.match(line)
         if m:
-            successCount += int(m.group(1))
-            totalCount += int(m.group(2))
-    failCount = int(totalCount - successCount)
-    # Handle failCount.
-    failCountStr = str(failCount)
-    if failCount > 0:
-        failCountStr = emphasizeFailureText(failCountStr)
-    # Format the counts
-    summary = "%d/%d" % (totalCount, failCount)
-    # Return the summary.
-    return "TinderboxPrint:%s<br />%s\n" % (name, summary)
-
-def summarizeTUnit(name, log):
-    # Counts and flags.
-    passCount = 0
-    failCount = 0
-    leaked = False
-
-    # Regular expression for crash and leak detections.
-    harnessErrorsRe = re.compile(r"TEST-UNEXPECTED-FAIL \| .* \| (missing output line for total leaks!|negative leaks caught!|leaked \d+ bytes during test execution)")
-    # Process the log.
-    for line in log.readlines():
+            self.successCount += int(m.group(1))
+            self.totalCount += int(m.group(2))
+
+    def summary(self):
+        failCount = int(self.totalCount - self.successCount)
+        # Format the counts
+        summary = "%d/%d" % (self.totalCount, failCount)
+        # Return the summary.
+        return "TinderboxPrint:%s<br />%s\n" % (self.name, summary)
+
+class TUnitSummarizer(LogSummarizer):
+    def __init__(self, name):
+        LogSummarizer.__init__(self, name)
+        self.passCount = 0
+        self.failCount = 0
+        self.leaked = False
+
+    def processLine(self, line):
         if "TEST-PASS" in line:
-            passCount += 1
-            continue
+            self.passCount += 1
+            return
         if "TEST-UNEXPECTED-" in line:
             # Set the error flags.
             # Or set the failure count.
-            m = harnessErrorsRe.match(line)
+            m = tunitHarnessErrorsRe.match(line)
             if m:
                 r = m.group(1)
                 if r == "missing output line for total leaks!":
-                    leaked = None
+                    self.leaked = None
                 else:
-                    leaked = True
+                    self.leaked = True
             else:
-                failCount += 1
-            # continue
+                self.failCount += 1
 
-    # Return the summary.
-    return "TinderboxPrint: %s<br/>%s\n" % (name,
-        summaryText(passCount, failCount, leaked = leaked))
+    def summary(self):
+        return "TinderboxPrint: %s<br/>%s\n" % (self.name,
+            summaryText(self.passCount, self.failCount, leaked=self.leaked))
 
-def summarizeMozmillLog(name, log):
-    log = log.getText()
-    summary = { 'Passed': None,
-                'Failed': None,
-                'Skipped': None }
-    beginnings = dict([(i, 'INFO %s:' % i) for i in summary])
-    for line in log.splitlines():
-        for condition in summary:
-            beginning = beginnings[condition]
+class MozmillSummarizer(LogSummarizer):
+    beginnings = dict([(i, 'INFO %s:' % i)
+                       for i in ('Passed', 'Failed', 'Skipped')])
+
+    def __init__(self, name):
+        LogSummarizer.__init__(self, name)
+        self.counts = dict([(i, None) for i in self.beginnings])
+
+    def processLine(self, line):
+        for condition, beginning in self.beginnings.items():
             if line.startswith(beginning):
                 n = line.split(beginning, 1)[-1].strip()
                 try:
-                    summary[condition] = int(n)
+                    self.counts[condition] = int(n)
                 except ValueError:
                     continue
-    
-    _summaryText = summaryText(summary.get('Passed', 0),
-                               summary.get('Failed', 0))
-    return 'TinderboxPrint: %s<br/>%s\n' % (name, _summaryText)
+
+    def summary(self):
+        _summaryText = summaryText(self.counts.get('Passed', 0),
+                                   self.counts.get('Failed', 0))
+        return 'TinderboxPrint: %s<br/>%s\n' % (self.name, _summaryText)
+
+class SummaryLogObserver(LogLineObserver):
+    """Feeds each stdout line of a running step to a LogSummarizer."""
+    def __init__(self, summarizer):
+        LogLineObserver.__init__(self)
+        # Test output often has very long lines, and the default limit drops
+        # the rest of the chunk after one
+        self.setMaxLineLength(sys.maxint)
+        self.summarizer = summarizer
+        self.partialLine = False
+
+    def outReceived(self, data):
+        if data:
+            self.partialLine = not data.endswith('\n')
+        LogLineObserver.outReceived(self, data)
+
+    def finish(self):
+        """Feeds the summarizer the last line if it had no newline."""
+        if self.partialLine:
+            self.outReceived('\n')
+
+    def outLineReceived(self, line):
+        self.summarizer.processLine(line)
+
+# otherIdent can be None if the test suite does not have this feature (yet).
+def summarizeLog(name, log, successIdent, failureIdent, otherIdent, infoRe):
+    return InfoLogSummarizer(name, successIdent, failureIdent, otherIdent,
+                             infoRe).processLog(log)
+
+def summarizeLogMochitest(name, log):
+    return MochitestSummarizer(name).processLog(log)
+
+def summarizeLogRemoteMochitest(name, log):
+    return RemoteMochitestSummarizer(name).processLog(log)
+
+def summarizeLogReftest(name, log):
+    return ReftestSummarizer(name).processLog(log)
+
+def summarizeLogXpcshelltests(name, log):
+    return XpcshellSummarizer(name).processLog(log)
+
+def summarizeLogJetpacktests(name, log):
+    return JetpackSummarizer(name).processLog(log)
+
+def summarizeTUnit(name, log):
+    return TUnitSummarizer(name).processLog(log)
+
+def summarizeMozmillLog(name, log):
+    return MozmillSummarizer(name).processLog(log)
 
 def evaluateMochitest(name, log, superResult):
     # When a unittest fails we mark it orange, indicating with the
@@ -321,8 +399,8 @@ class MochitestMixin(object):
         else:
             return []
 
-    def createSummary(self, log):
-        self.addCompleteLog('summary', summarizeLogMochitest(self.name, log))
+    def createSummarizer(self):
+        return MochitestSummarizer(self.name)
 
     def evaluateCommand(self, cmd):
         superResult = self.super_class.evaluateCommand(self, cmd)
@@ -363,8 +441,8 @@ class ReftestMixin(object):
         elif suite == 'reftest-sanity':
             return ['reftest/tests/layout/reftests/reftest-sanity/reftest.list']
 
-    def createSummary(self, log):
-        self.addCompleteLog('summary', summarizeLogReftest(self.name, log))
+    def createSummarizer(self):
+        return ReftestSummarizer(self.name)
 
     def evaluateCommand(self, cmd):
         superResult = self.super_class.evaluateCommand(self, cmd)
@@ -385,10 +463,32 @@ class ShellCommandReportTimeout(ShellCommand):
     """We subclass ShellCommand so that we can bubble up the timeout errors
     to tinderbox that normally only get appended to the buildbot slave logs.
     """
+    summarizer = None
+    summaryObserver = None
+
     def __init__(self, **kwargs):
         self.my_shellcommand = ShellCommand
         ShellCommand.__init__(self, **kwargs)
 
+    def createSummarizer(self):
+        """Return a LogSummarizer to be fed the stdio log as it arrives, or
+        None if this step doesn't produce a summary."""
+        return None
+
+    def start(self):
+        # The summarizer is created here rather than in __init__ because
+        # subclasses set self.name after calling our constructor.
+        self.summarizer = self.createSummarizer()
+        if self.summarizer is not None:
+            self.summaryObserver = SummaryLogObserver(self.summarizer)
+            self.addLogObserver('stdio', self.summaryObserver)
+        return self.my_shellcommand.start(self)
+
+    def createSummary(self, log):
+        if self.summarizer is not None:
+            self.summaryObserver.finish()
+            self.addCompleteLog('summary', self.summarizer.summary())
+
     def evaluateCommand(self, cmd):
         superResult = self.my_shellcommand.evaluateCommand(self, cmd)
         for line in cmd.logs["stdio"].readlines(channel=HEADER):
@@ -456,8 +556,8 @@ class MozillaPackagedMozmillTests(ShellCommandReportTimeout):
             ]
         self.command = ['bash', '-c', WithProperties(' '.join(script))]
             
-    def createSummary(self, log):
-        self.addCompleteLog('summary', summarizeMozmillLog(self.name, log))
+    def createSummarizer(self):
+        return MozmillSummarizer(self.name)
 
     def evaluateCommand(self, cmd):
         superResult = self.super_class.evaluateCommand(self, cmd)
@@ -614,11 +714,11 @@ class MozillaCheck(ShellCommandReportTimeout):
         ShellCommandReportTimeout.__init__(self, **kwargs)
         self.addFactoryArguments(test_name=test_name)
 
-    def createSummary(self, log):
+    def createSummarizer(self):
         if 'xpcshell' in self.name:
-            self.addCompleteLog('summary', summarizeLogXpcshelltests(self.name, log))
+            return XpcshellSummarizer(self.name)
         else:
-            self.addCompleteLog('summary', summarizeTUnit(self.name, log))
+            return TUnitSummarizer(self.name)
 
     def evaluateCommand(self, cmd):
         superResult = self.super_class.evaluateCommand(self, cmd)
@@ -662,8 +762,8 @@ class MozillaReftest(ShellCommandReportTimeout):
         self.addFactoryArguments(test_name=test_name,
                                  leakThreshold=leakThreshold)
    
-    def createSummary(self, log):
-        self.addCompleteLog('summary', summarizeLogReftest(self.name, log))
+    def createSummarizer(self):
+        return ReftestSummarizer(self.name)
 
     def evaluateCommand(self, cmd):
         superResult = self.super_class.evaluateCommand(self, cmd)
@@ -704,8 +804,8 @@ class MozillaMochitest(ShellCommandReportTimeout):
         self.addFactoryArguments(test_name=test_name,
                                  leakThreshold=leakThreshold)
     
-    def createSummary(self, log):
-        self.addCompleteLog('summary', summarizeLogMochitest(self.name, log))
+    def createSummarizer(self):
+        return MochitestSummarizer(self.name)
 
     def evaluateCommand(self, cmd):
         superResult = self.super_class.evaluateCommand(self, cmd)
@@ -760,8 +860,8 @@ class MozillaPackagedXPCShellTests(ShellCommandReportTimeout):
 
         self.command = ['bash', '-c', WithProperties(script)]
 
-    def createSummary(self, log):
-        self.addCompleteLog('summary', summarizeLogXpcshelltests(self.name, log))
+    def createSummarizer(self):
+        return XpcshellSummarizer(self.name)
 
     def evaluateCommand(self, cmd):
         superResult = self.super_class.evaluateCommand(self, cmd)
@@ -865,8 +965,8 @@ class MozillaPackagedJetpackTests(ShellCommandReportTimeout):
         # TODO: When jetpack can handle symbols path and leak testing, add those
         # until then, we skip that.
 
-    def createSummary(self, log):
-        self.addCompleteLog('summary', summarizeLogJetpacktests(self.name, log))
+    def createSummarizer(self):
+        return JetpackSummarizer(self.name)
 
     def evaluateCommand(self, cmd):
         superResult = self.super_class.evaluateCommand(self, cmd)
@@ -927,8 +1027,8 @@ class RemoteMochitestBrowserChromeStep(RemoteMochitestStep):
         self.super_class = RemoteMochitestStep
         RemoteMochitestStep.__init__(self, **kwargs)
 
-    def createSummary(self, log):
-        self.addCompleteLog('summary', summarizeLogRemoteMochitest(self.name, log))
+    def createSummarizer(self):
+        return RemoteMochitestSummarizer(self.name)
 
     def evaluateCommand(self, cmd):
         superResult = self.super_class.evaluateCommand(self, cmd)
@@ -0,0 +1,89 @@
+from twisted.trial import unittest
+from twisted.internet import reactor
+from twisted.web import resource, server, http
+
+from buildbotcustom.changes.ftppoller import LocalesFtpPoller
+
+SHIPPED_LOCALES = """\
+de
+en-US
+fr
+ja linux win32
+ja-JP-mac osx
+"""
+
+LISTING = """\
+<html><body>
+<a href="/pub/mozilla.org/firefox/nightly/10.0-candidates/build1/linux-i686/de/">de/</a>
+<a href="/pub/mozilla.org/firefox/nightly/10.0-candidates/build1/linux-i686/en-US/">en-US/</a>
+<a href="/pub/mozilla.org/firefox/nightly/10.0-candidates/build1/linux-i686/ja/">ja/</a>
+</body></html>
+"""
+
+class LocalesFile(resource.Resource):
+    """Serves the shipped-locales file with an ETag, counting the times the
+    contents are actually sent."""
+    isLeaf = True
+
+    def __init__(self):
+        resource.Resource.__init__(self)
+        self.sent = 0
+        self.etag = '"1"'
+
+    def render_GET(self, request):
+        if request.setETag(self.etag) == http.CACHED:
+            return ''
+        self.sent += 1
+        return SHIPPED_LOCALES
+
+class TestLocalesFtpPoller(unittest.TestCase):
+    def setUp(self):
+        self.localesFile = LocalesFile()
+        self.port = reactor.listenTCP(0, server.Site(self.localesFile),
+                                      interface='127.0.0.1')
+        self.poller = LocalesFtpPoller(
+            localesFile='http://127.0.0.1:%i/shipped-locales' % \
+                self.port.getHost().port,
+            platform='linux',
+            sl_platform_map={'linux': 'linux', 'macosx': 'osx'})
+
+    def tearDown(self):
+        return self.port.stopListening()
+
+    def getLocales(self):
+        d = self.poller._get_locales_page()
+        d.addCallback(self.poller._get_locales)
+        return d
+
+    def testLocales(self):
+        d = self.getLocales()
+        def check(locales):
+            self.assertEquals(locales, set(['de', 'en-US', 'fr', 'ja']))
+        d.addCallback(check)
+        return d
+
+    def testNotModified(self):
+        d = self.getLocales()
+        d.addCallback(lambda ign: self.getLocales())
+        def check(locales):
+            self.assertEquals(self.localesFile.sent, 1)
+            self.assertEquals(locales, set(['de', 'en-US', 'fr', 'ja']))
+        d.addCallback(check)
+        return d
+
+    def testModified(self):
+        d = self.getLocales()
+        def change(ign):
+            self.localesFile.etag = '"2"'
+            return self.getLocales()
+        d.addCallback(change)
+        def check(locales):
+            self.assertEquals(self.localesFile.sent, 2)
+        d.addCallback(check)
+        return d
+
+    def testSearchAllStrings(self):
+        self.assertTrue(self.poller.searchAllStrings(LISTING,
+                        frozenset(['de', 'en-US', 'ja'])))
+        self.assertFalse(self.poller.searchAllStrings(LISTING,
+                         frozenset(['de', 'fr'])))
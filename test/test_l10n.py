@@ -0,0 +1,103 @@
+from twisted.trial import unittest
+from twisted.internet import reactor, defer
+from twisted.web import resource, server
+
+import buildbotcustom.l10n
+from buildbotcustom.l10n import L10nMixin, ParseLocalesFile
+
+ALL_LOCALES = """\
+de
+en-US
+fr
+ja linux win32
+ja-JP-mac osx
+"""
+
+class RawFile(resource.Resource):
+    """Stands in for hg's raw-file, serving the same locales file for any
+    revision and counting the requests."""
+    isLeaf = True
+
+    def __init__(self):
+        resource.Resource.__init__(self)
+        self.requests = []
+
+    def render_GET(self, request):
+        self.requests.append(request.path)
+        return ALL_LOCALES
+
+class TestGetLocales(unittest.TestCase):
+    def setUp(self):
+        buildbotcustom.l10n._localesCache = buildbotcustom.l10n.LRUCache()
+        self.rawfile = RawFile()
+        self.port = reactor.listenTCP(0, server.Site(self.rawfile),
+                                      interface='127.0.0.1')
+        url = 'http://127.0.0.1:%i/' % self.port.getHost().port
+        self.mixin = L10nMixin(platform='linux', repo=url,
+                               branch='mozilla-central')
+
+    def tearDown(self):
+        return self.port.stopListening()
+
+    def testParsed(self):
+        d = self.mixin.getLocales('abcdef123456')
+        def check(locales):
+            self.assertEquals(locales, ParseLocalesFile(ALL_LOCALES))
+        d.addCallback(check)
+        return d
+
+    def testRevisionCached(self):
+        d = self.mixin.getLocales('abcdef123456')
+        d.addCallback(lambda ign: self.mixin.getLocales('abcdef123456'))
+        def check(locales):
+            self.assertEquals(len(self.rawfile.requests), 1)
+            self.assertEquals(locales['ja'], ['linux', 'win32'])
+        d.addCallback(check)
+        return d
+
+    def testConcurrentRequestsShared(self):
+        d = defer.gatherResults([self.mixin.getLocales('abcdef123456')
+                                 for i in range(5)])
+        def check(results):
+            self.assertEquals(len(self.rawfile.requests), 1)
+            self.assertEquals(len(results), 5)
+        d.addCallback(check)
+        return d
+
+    def testReloadWhileFetching(self):
+        d = self.mixin.getLocales('abcdef123456')
+        # misc.py reloads this module on every reconfig
+        reload(buildbotcustom.l10n)
+        def check(locales):
+            self.assertEquals(locales['ja'], ['linux', 'win32'])
+            self.assertEquals(buildbotcustom.l10n._localesPending, {})
+        d.addCallback(check)
+        return d
+
+    def testBranchNotCached(self):
+        d = self.mixin.getLocales()
+        d.addCallback(lambda ign: self.mixin.getLocales())
+        def check(ign):
+            self.assertEquals(self.rawfile.requests,
+                ['/mozilla-central/raw-file/default/browser/locales/all-locales'] * 2)
+        d.addCallback(check)
+        return d
+
+class TestFilterLocales(unittest.TestCase):
+    def setUp(self):
+        self.locales = ParseLocalesFile(ALL_LOCALES)
+
+    def testPlatform(self):
+        m = L10nMixin(platform='macosx', localesURL='unused')
+        self.assertEquals(m.filterLocales(self.locales),
+                          ['de', 'fr', 'ja-JP-mac'])
+
+    def testChunks(self):
+        m = L10nMixin(platform='linux', localesURL='unused', l10nChunks=2)
+        self.assertEquals(m.filterLocales(self.locales),
+                          [['de', 'fr'], ['ja']])
+
+    def testMoreChunksThanLocales(self):
+        m = L10nMixin(platform='linux', localesURL='unused', l10nChunks=5)
+        self.assertEquals(m.filterLocales(self.locales),
+                          [['de'], ['fr'], ['ja']])
@@ -0,0 +1,74 @@
+import unittest
+
+from buildbot.changes.changes import Change
+
+from buildbotcustom.misc import makeFileIsImportant, isImportantL10nFile, \
+        sharedFileIsImportant, classificationStats, classificationResults
+
+class TestFileIsImportant(unittest.TestCase):
+    def makeChange(self, files):
+        return Change(who='me', files=files, comments='')
+
+    def testPrefixes(self):
+        f = makeFileIsImportant(prefixes=['browser', 'toolkit/locales'])
+        self.assertFalse(f(self.makeChange(['de/browser/foo.dtd'])))
+        self.assertTrue(f(self.makeChange(['docs/x', 'browser/foo.dtd'])))
+        self.assertTrue(f(self.makeChange(['toolkit/locales/en-US/a.dtd'])))
+        self.assertFalse(f(self.makeChange(['toolkit/content/a.js'])))
+        self.assertFalse(f(self.makeChange([])))
+
+    def testPatterns(self):
+        f = makeFileIsImportant(patterns=['*.dtd', 'js/src/*.py'])
+        self.assertTrue(f(self.makeChange(['browser/foo.dtd'])))
+        self.assertTrue(f(self.makeChange(['js/src/build.py'])))
+        self.assertFalse(f(self.makeChange(['js/src/jsapi.cpp'])))
+
+    def testMatchesIsImportantL10nFile(self):
+        modules = ['browser', 'dom', 'netwerk']
+        f = makeFileIsImportant(prefixes=modules)
+        for files in (['browser/a'], ['other/a', 'dom/b'], ['other/a'], []):
+            c = self.makeChange(files)
+            self.assertEqual(f(c), isImportantL10nFile(c, modules))
+
+class TestSharedFileIsImportant(unittest.TestCase):
+    def testShared(self):
+        calls = []
+        def fileIsImportant(change):
+            calls.append(change)
+            return True
+        f1 = sharedFileIsImportant('test shared', fileIsImportant)
+        f2 = sharedFileIsImportant('test shared', fileIsImportant)
+        c = Change(who='me', files=['a'], comments='')
+        c.number = 1
+        self.assertTrue(f1(c))
+        self.assertTrue(f2(c))
+        self.assertEqual(calls, [c])
+        stats = classificationStats['test shared']
+        self.assertEqual((stats['changes'], stats['shared']), (1, 1))
+        self.assertFalse('_fileIsImportant' in c.__dict__)
+
+    def testUnnumberedChange(self):
+        calls = []
+        f = sharedFileIsImportant('test unnumbered', calls.append)
+        c = Change(who='me', files=['a'], comments='')
+        f(c)
+        f(c)
+        self.assertEqual(calls, [c, c])
+
+    def testPruned(self):
+        f = sharedFileIsImportant('test pruned', lambda c: True)
+        for number in range(1, 1002):
+            c = Change(who='me', files=['a'], comments='')
+            c.number = number
+            f(c)
+        results = classificationResults['test pruned']
+        self.assertEqual(sorted(results)[0], 501)
+        self.assertEqual(len(results), 501)
+
+    def testDifferentKeys(self):
+        f1 = sharedFileIsImportant('test key 1', lambda c: True)
+        f2 = sharedFileIsImportant('test key 2', lambda c: False)
+        c = Change(who='me', files=['a'], comments='')
+        c.number = 1
+        self.assertTrue(f1(c))
+        self.assertFalse(f2(c))
@@ -0,0 +1,60 @@
+from twisted.trial import unittest
+
+from buildbot.sourcestamp import SourceStamp
+from buildbot.changes.changes import Change
+from buildbot.buildrequest import BuildRequest
+
+import buildbotcustom.misc
+from buildbotcustom.misc import mergeRequests, generateFuzzingObjects
+
+class FakeBuilder(object):
+    def __init__(self, name):
+        self.name = name
+
+class TestMergeRequests(unittest.TestCase):
+    def setUp(self):
+        self.builder = FakeBuilder('b')
+        c1 = Change('me', ['a'], 'c1', branch='b1', revision='1')
+        c2 = Change('me', ['a'], 'c2', branch='b1', revision='2')
+        self.sourcestamps = [
+            SourceStamp(branch='b1', revision='1'),
+            SourceStamp(branch='b1', revision='1'),
+            SourceStamp(branch='b1', revision='2'),
+            SourceStamp(branch='b2', revision='1'),
+            SourceStamp(branch='b1', revision=None),
+            SourceStamp(branch='b1', revision='1', patch=(1, 'diff')),
+            SourceStamp(branch='b1', changes=[c1]),
+            SourceStamp(branch='b1', changes=[c2]),
+            SourceStamp(branch='b1', changes=[c1], project='p'),
+        ]
+
+    def tearDown(self):
+        buildbotcustom.misc.nomergeBuilders.clear()
+
+    def testMatchesCanBeMergedWith(self):
+        reqs = [BuildRequest('r', ss, 'b') for ss in self.sourcestamps]
+        for r1 in reqs:
+            for r2 in reqs:
+                if r1 is r2:
+                    continue
+                self.assertEquals(mergeRequests(self.builder, r1, r2),
+                                  r1.canBeMergedWith(r2))
+
+    def testNoMergeBuilders(self):
+        buildbotcustom.misc.nomergeBuilders.append('b')
+        r1 = BuildRequest('r', self.sourcestamps[0], 'b')
+        r2 = BuildRequest('r', self.sourcestamps[1], 'b')
+        self.assertFalse(mergeRequests(self.builder, r1, r2))
+
+    def testGeneratorsAddBuilderNames(self):
+        config = {'scripts_repo': 'http://hg/build/tools',
+                  'platforms': ['linux', 'win32'],
+                  'fuzzing_repo': 'http://hg/fuzzing',
+                  'fuzzing_remote_host': 'fuzz',
+                  'fuzzing_base_dir': '/fuzz',
+                  'idle_slaves': 3}
+        objects = generateFuzzingObjects(config, {'linux': ['l1'],
+                                                  'win32': ['w1']})
+        self.assertEquals(len(objects['builders']), 2)
+        self.assertEquals(sorted(buildbotcustom.misc.nomergeBuilders),
+                          ['fuzzer-linux', 'fuzzer-win32'])
@@ -1,6 +1,10 @@
 import unittest
 
-from buildbotcustom.process.factory import ReleaseUpdatesFactory
+from twisted.python import log
+
+from buildbotcustom.process.factory import ReleaseUpdatesFactory, \
+        BaseRepackFactory, UnittestPackagedBuildFactory, getFactory, \
+        logFactoryStats
 
 class SimpleUpdatesFactory(ReleaseUpdatesFactory):
     def __init__(self, version, releaseChannel, useBetaChannelForRelease):
@@ -74,3 +78,99 @@ class TestReleaseUpdatesFactory(unittest.TestCase):
         self.assertEqual(uf.channels, expectedChannels)
         self.assertEqual(uf.dirMap, expectedDirMap)
         self.assertEqual(uf.testChannel, 'esrtest')
+
+class FakeFactory(object):
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+class TestGetFactory(unittest.TestCase):
+    def testSameArgumentsShareFactory(self):
+        f1 = getFactory(FakeFactory, platform='linux', env={'A': ['b']})
+        f2 = getFactory(FakeFactory, platform='linux', env={'A': ['b']})
+        self.assert_(f1 is f2)
+
+    def testDifferentArgumentsDontShareFactory(self):
+        f1 = getFactory(FakeFactory, platform='linux', chunk=1)
+        f2 = getFactory(FakeFactory, platform='linux', chunk=True)
+        self.assert_(f1 is not f2)
+
+    def testUnhashableArguments(self):
+        f1 = getFactory(FakeFactory, platform='linux', sets=[set()])
+        f2 = getFactory(FakeFactory, platform='linux', sets=[set()])
+        self.assert_(f1 is not f2)
+
+    def testLogStats(self):
+        class StatsFactory(FakeFactory):
+            pass
+        getFactory(StatsFactory, platform='linux')
+        getFactory(StatsFactory, platform='linux')
+        messages = []
+        observer = lambda e: messages.append(''.join(e['message']))
+        log.addObserver(observer)
+        try:
+            logFactoryStats('mozilla-central')
+            # the counts start over after each call
+            logFactoryStats('mozilla-central')
+        finally:
+            log.removeObserver(observer)
+        self.assertEqual([m for m in messages if 'StatsFactory' in m and
+                          m.startswith('factory mozilla-central StatsFactory: '
+                                       '1 built, 1 reused')],
+                         [m for m in messages if 'StatsFactory' in m])
+        self.assertEqual(len([m for m in messages if 'StatsFactory' in m]), 1)
+
+class SimpleRepackFactory(BaseRepackFactory):
+    def __init__(self):
+        # shared, locale source, shared including the en-US download and
+        # unpack, then the repack itself
+        self.steps = [('checkout', {}), ('get_locale_src', {}),
+                      ('configure', {}), ('wget_enUS', {}),
+                      ('make_unpack', {}), ('tinderboxprint_locale', {}),
+                      ('repack', {}), ('upload', {})]
+        self.perLocaleSteps = [1]
+        self.localeStepsStart = 5
+
+class TestBaseRepackFactory(unittest.TestCase):
+    def getNames(self, steps):
+        names = []
+        for factory, kwargs in steps:
+            if 'property_name' in kwargs:
+                names.append('%s=%s' % (kwargs['property_name'],
+                                        kwargs['value']))
+            else:
+                names.append(factory)
+        return names
+
+    def testLocaleSteps(self):
+        f = SimpleRepackFactory()
+        steps = f.getLocaleStepFactories(['de', 'fr'], 'default')
+        self.assertEqual(self.getNames(steps), [
+            'checkout', 'configure', 'wget_enUS', 'make_unpack',
+            'locale=de', 'l10n_revision=default',
+            'get_locale_src', 'tinderboxprint_locale', 'repack', 'upload',
+            'locale=fr', 'l10n_revision=default',
+            'get_locale_src', 'tinderboxprint_locale', 'repack', 'upload',
+        ])
+
+class SimpleUnittestFactory(UnittestPackagedBuildFactory):
+    def __init__(self):
+        self.steps = []
+        self.unpackedTests = set()
+
+class TestUnittestPackagedBuildFactory(unittest.TestCase):
+    def getUnpacked(self, f):
+        return [kwargs['testtype'] for factory, kwargs in f.steps]
+
+    def testUnpackOnce(self):
+        f = SimpleUnittestFactory()
+        for testtype in ('mochitest', 'mochitest', 'jsreftest', 'reftest',
+                         'xpcshell'):
+            f.addUnpackTestStep(testtype, 'unpack %s tests' % testtype)
+        self.assertEqual(self.getUnpacked(f),
+                         ['mochitest', 'jsreftest', 'xpcshell'])
+
+    def testUnpackEverything(self):
+        f = SimpleUnittestFactory()
+        for testtype in ('mozmill', 'mochitest', 'mozmill'):
+            f.addUnpackTestStep(testtype, 'unpack %s tests' % testtype)
+        self.assertEqual(self.getUnpacked(f), ['mozmill'])
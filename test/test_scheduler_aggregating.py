@@ -0,0 +1,126 @@
+import os, shutil
+
+from twisted.trial import unittest
+
+from buildbot.db import dbspec, connector
+from buildbot.db.schema.manager import DBSchemaManager
+from buildbot.util.eventual import flushEventualQueue
+from buildbot.sourcestamp import SourceStamp
+from buildbot.process.properties import Properties
+from buildbot.status.builder import SUCCESS, FAILURE
+
+from buildbotcustom.scheduler import AggregatingScheduler
+
+import mock
+
+class TestAggregatingScheduler(unittest.TestCase):
+    basedir = "test_scheduler_aggregating"
+    def setUp(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        spec = dbspec.DBSpec.from_url("sqlite:///state.sqlite", self.basedir)
+        manager = DBSchemaManager(spec, self.basedir)
+        manager.upgrade()
+
+        self.dbc = connector.DBConnector(spec)
+        self.dbc.start()
+
+        self.s = AggregatingScheduler(name="agg", branch="b",
+                                      builderNames=["down"],
+                                      upstreamBuilders=["up1", "up2"])
+        self.s.parent = mock.Mock()
+        self.s.parent.db = self.dbc
+        d = self.dbc.addSchedulers([self.s])
+        d.addCallback(lambda ign: self.s.startService())
+        return d
+
+    def tearDown(self):
+        self.s.stopService()
+        self.dbc.stop()
+        shutil.rmtree(self.basedir)
+
+    def addRequest(self, builderName):
+        def _add(t):
+            ssid = self.dbc.get_sourcestampid(SourceStamp(), t)
+            bsid = self.dbc.create_buildset(ssid, "test", Properties(),
+                                            [builderName], t)
+            t.execute(self.dbc.quoteq("SELECT id FROM buildrequests"
+                                      " WHERE buildsetid=?"), (bsid,))
+            return t.fetchone()[0]
+        return self.dbc.runInteractionNow(_add)
+
+    def finishBuild(self, builderName, results=SUCCESS):
+        brid = self.addRequest(builderName)
+        self.dbc.retire_buildrequests([brid], results)
+        d = flushEventualQueue()
+        d.addCallback(lambda ign: self.s.run())
+        return d
+
+    def downstreamRequests(self):
+        return self.dbc.runQueryNow("SELECT id FROM buildrequests"
+                                    " WHERE buildername='down'")
+
+    def remainingBuilders(self):
+        return self.dbc.runInteractionNow(
+            lambda t: self.s.get_state(t)['remainingBuilders'])
+
+    def testNoWorkWithoutNotifications(self):
+        # only asks to be woken up for the next catch-up scan
+        self.assertEquals(self.s.run(), self.s._nextCatchup)
+
+    def testPeriodicCatchup(self):
+        # as if another master finished the build: no notification here
+        brid = self.addRequest("up1")
+        self.dbc.retire_buildrequests([brid], SUCCESS)
+        d = flushEventualQueue()
+        def run(ign):
+            self.s._modifiedBsids = []
+            self.assertEquals(self.s.run(), self.s._nextCatchup)
+            self.assertEquals(self.remainingBuilders(), ["up1", "up2"])
+            # once pollInterval has passed, run() scans the table anyway
+            self.s._nextCatchup = 0
+            return self.s.run()
+        d.addCallback(run)
+        def check(nextCatchup):
+            self.assertEquals(self.remainingBuilders(), ["up2"])
+            self.assertEquals(nextCatchup, self.s._nextCatchup)
+            self.assert_(nextCatchup > 0)
+        d.addCallback(check)
+        return d
+
+    def testTriggersAfterAllUpstream(self):
+        d = self.finishBuild("up1")
+        def check1(ign):
+            self.assertEquals(self.remainingBuilders(), ["up2"])
+            self.assertEquals(len(self.downstreamRequests()), 0)
+        d.addCallback(check1)
+        d.addCallback(lambda ign: self.finishBuild("up2"))
+        def check2(ign):
+            self.assertEquals(self.remainingBuilders(), ["up1", "up2"])
+            self.assertEquals(len(self.downstreamRequests()), 1)
+        d.addCallback(check2)
+        return d
+
+    def testIgnoresFailuresAndOtherBuilders(self):
+        d = self.finishBuild("up1", FAILURE)
+        d.addCallback(lambda ign: self.finishBuild("other"))
+        def check(ign):
+            self.assertEquals(self.remainingBuilders(), ["up1", "up2"])
+        d.addCallback(check)
+        return d
+
+    def testCatchupOnStartup(self):
+        self.s.stopService()
+        brid = self.addRequest("up2")
+        self.dbc.retire_buildrequests([brid], SUCCESS)
+        d = flushEventualQueue()
+        def restart(ign):
+            # the stopped scheduler doesn't hear about the build...
+            self.assertEquals(self.s._modifiedBsids, [])
+            self.assertEquals(self.s._subscription, None)
+            # ...but picks it up when it starts again
+            self.s.startService()
+            self.assertEquals(self.remainingBuilders(), ["up1"])
+        d.addCallback(restart)
+        return d
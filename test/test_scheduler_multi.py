@@ -0,0 +1,74 @@
+import os, shutil
+
+from twisted.trial import unittest
+
+from buildbot.db import dbspec, connector
+from buildbot.db.schema.manager import DBSchemaManager
+from buildbot.changes.changes import Change
+
+from buildbotcustom.scheduler import MultiScheduler, makePropertiesScheduler
+from buildbotcustom.misc_scheduler import buildIDSchedFunc
+
+import mock
+
+class TestMultiScheduler(unittest.TestCase):
+    basedir = "test_scheduler_multi"
+    def setUp(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        spec = dbspec.DBSpec.from_url("sqlite:///state.sqlite", self.basedir)
+        manager = DBSchemaManager(spec, self.basedir)
+        manager.upgrade()
+
+        self.dbc = connector.DBConnector(spec)
+        self.dbc.start()
+
+    def tearDown(self):
+        self.dbc.stop()
+        shutil.rmtree(self.basedir)
+
+    def runScheduler(self, s, changes):
+        s.parent = mock.Mock()
+        s.parent.db = self.dbc
+        for c in changes:
+            self.dbc.addChangeToDatabase(c)
+
+        d = self.dbc.addSchedulers([s])
+        d.addCallback(lambda ign: self.dbc.runInteraction(
+            s._add_build_and_remove_changes, changes, []))
+        return d
+
+    def makeChanges(self, n):
+        return [Change(who='me!', branch='b1', revision=str(i), files=[],
+                       comments='change %i' % i) for i in range(n)]
+
+    def testSourceStampsShared(self):
+        s = MultiScheduler(name="s", branch="b1", treeStableTimer=None,
+                           builderNames=["b1", "b2"], numberOfBuildsToTrigger=3)
+        d = self.runScheduler(s, self.makeChanges(2))
+
+        def check(ign):
+            buildsets = self.dbc.runQueryNow("select sourcestampid from buildsets")
+            self.assertEquals(len(buildsets), 6)
+            ssids = self.dbc.runQueryNow("select id from sourcestamps")
+            self.assertEquals(len(ssids), 2)
+            self.assertEquals(sorted(set(b[0] for b in buildsets)),
+                              sorted(s[0] for s in ssids))
+            requests = self.dbc.runQueryNow("select * from buildrequests")
+            self.assertEquals(len(requests), 12)
+        d.addCallback(check)
+        return d
+
+    def testPropsPerBuildset(self):
+        S = makePropertiesScheduler(MultiScheduler, propfuncs=[buildIDSchedFunc])
+        s = S(name="s", branch="b1", treeStableTimer=None,
+              builderNames=["b1"], numberOfBuildsToTrigger=2)
+        d = self.runScheduler(s, self.makeChanges(1))
+
+        def check(ign):
+            props = self.dbc.runQueryNow("select buildsetid from buildset_properties"
+                                         " where property_name='buildid'")
+            self.assertEquals(len(props), 2)
+        d.addCallback(check)
+        return d
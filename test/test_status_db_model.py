@@ -0,0 +1,128 @@
+import datetime
+import imp
+import os
+import unittest
+
+import sqlalchemy
+
+from buildbot.changes.changes import Change as BBChange
+from buildbot.sourcestamp import SourceStamp as BBSourceStamp
+
+import buildbotcustom.status.db.model as model
+
+add_status_digests = imp.load_source('add_status_digests',
+        os.path.join(os.path.dirname(__file__), '..', 'bin',
+                     'add_status_digests.py'))
+
+class TestDigest(unittest.TestCase):
+    def testNoneIsNotAString(self):
+        self.assertNotEqual(model._digest([None]), model._digest(['N']))
+        self.assertNotEqual(model._digest([None]), model._digest(['None']))
+
+    def testNesting(self):
+        self.assertNotEqual(model._digest([['a', 'b'], 'c']),
+                            model._digest(['a', ['b', 'c']]))
+        self.assertNotEqual(model._digest(['ab']), model._digest(['a', 'b']))
+
+    def testTypes(self):
+        when = datetime.datetime(2012, 3, 1, 3, 4, 5)
+        self.assertEqual(model._digest([when, u'caf\xe9', 1]),
+                         model._digest([when.isoformat(), 'caf\xc3\xa9', '1']))
+
+    def testLegacyRevision(self):
+        when = datetime.datetime(2012, 3, 1)
+        self.assertEqual(
+            model.Change.makeDigest(1, u'b', None, u'me', u'c', when, ['f']),
+            model.Change.makeDigest(1, u'b', u'None', u'me', u'c', when, ['f']))
+        self.assertEqual(model.SourceStamp.makeDigest(u'b', None, None, []),
+                         model.SourceStamp.makeDigest(u'b', u'None', None, []))
+
+class TestBackfill(unittest.TestCase):
+    def setUp(self):
+        self.session = model.connect('sqlite://')()
+
+    def tearDown(self):
+        self.session.close()
+        model.Base.metadata.drop_all()
+
+    def addLegacyRows(self):
+        # As written before the digest columns existed
+        change = model.Change(number=1, branch=u'mozilla-central',
+                revision=u'None', who=u'me', comments=u'Bug 1',
+                when=datetime.datetime.utcfromtimestamp(1330570000))
+        change.files = [model.File.get(self.session, u'a.txt')]
+        ss = model.SourceStamp(branch=u'mozilla-central', revision=u'None',
+                changes=[model.SourceChange(change=change, order=0)])
+        self.session.add(ss)
+        self.session.commit()
+        return change, ss
+
+    def makeBBChange(self):
+        c = BBChange(who='me', files=['a.txt'], comments='Bug 1',
+                     branch='mozilla-central', when=1330570000)
+        c.number = 1
+        return c
+
+    def testExistingRowsReused(self):
+        change, ss = self.addLegacyRows()
+        add_status_digests.fillDigests(self.session)
+        self.assert_(change.digest and ss.digest)
+
+        bbChange = self.makeBBChange()
+        self.assert_(model.Change.fromBBChange(self.session, bbChange)
+                     is change)
+        self.assert_(model.SourceStamp.fromBBSourcestamp(self.session,
+                     BBSourceStamp(changes=[bbChange])) is ss)
+
+    def testNewRowsMatchBackfill(self):
+        bbChange = self.makeBBChange()
+        new = model.Change.fromBBChange(self.session, bbChange)
+        change, ss = self.addLegacyRows()
+        add_status_digests.fillDigests(self.session)
+        self.assertEqual(change.digest, new.digest)
+
+    def testAddColumn(self):
+        engine = sqlalchemy.create_engine('sqlite://')
+        engine.execute("CREATE TABLE changes (id INTEGER PRIMARY KEY)")
+        add_status_digests.addColumn(engine, 'changes')
+        # Running it again is harmless
+        add_status_digests.addColumn(engine, 'changes')
+        engine.execute("INSERT INTO changes (id, digest) VALUES (1, 'abc')")
+        self.assertEqual(list(engine.execute("SELECT digest FROM changes")),
+                         [('abc',)])
+
+class FakeStep(object):
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+
+class TestSteps(unittest.TestCase):
+    def setUp(self):
+        self.session = model.connect('sqlite://')()
+        master = model.Master.get(self.session, 'http://master/')
+        self.session.flush()
+        self.build = model.Build(buildnumber=1,
+                builder=model.Builder.get(self.session, 'b', master.id),
+                slave=model.Slave.get(self.session, 's'), master=master)
+        self.session.add(self.build)
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        model.Base.metadata.drop_all()
+
+    def testInsertBBSteps(self):
+        step_ids = model.Step.insertBBSteps(self.session, self.build.id,
+                [FakeStep('checkout', ['checkout']),
+                 FakeStep('compile', ['compile', 'failed'])])
+        self.session.commit()
+        steps = self.session.query(model.Step).order_by(model.Step.order).all()
+        self.assertEqual([(s.name, s.order, s.description) for s in steps],
+                         [('checkout', 0, ['checkout']),
+                          ('compile', 1, ['compile', 'failed'])])
+        self.assertEqual(step_ids, dict((s.name, s.id) for s in steps))
+
+    def testInsertNoSteps(self):
+        self.assertEqual(model.Step.insertBBSteps(self.session,
+                                                  self.build.id, []), {})
+        self.assertEqual(self.session.query(model.Step).count(), 0)
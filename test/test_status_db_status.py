@@ -0,0 +1,163 @@
+import calendar
+import datetime
+import unittest
+
+from buildbot.sourcestamp import SourceStamp as BBSourceStamp
+
+import buildbotcustom.status.db.status as status
+# status reloads model, so import it afterwards to get the same classes
+import buildbotcustom.status.db.model as model
+
+class FakePending(object):
+    def __init__(self, submitTime, source):
+        self.submitTime = submitTime
+        self.source = source
+
+    def getSubmitTime(self):
+        return self.submitTime
+
+class FakeBuilder(object):
+    def __init__(self, pending):
+        self.pending = pending
+
+    def getPendingBuilds(self):
+        return self.pending
+
+class FakeStatus(object):
+    def __init__(self, builders):
+        self.builders = builders
+        self.subscribers = []
+
+    def getBuildbotURL(self):
+        return 'http://master/'
+
+    def getSlaveNames(self):
+        return []
+
+    def getBuilderNames(self):
+        return self.builders.keys()
+
+    def getBuilder(self, name):
+        return self.builders[name]
+
+    def subscribe(self, receiver):
+        self.subscribers.append(receiver)
+
+class FakeParent(object):
+    def __init__(self, status):
+        self.status = status
+
+    def getStatus(self):
+        return self.status
+
+class TestSetup(unittest.TestCase):
+    def setUp(self):
+        self.Session = model.connect('sqlite://')
+        self.session = self.Session()
+        self.master = model.Master.get(self.session, 'http://master/')
+        self.session.flush()
+        self.builder = model.Builder.get(self.session, 'b', self.master.id)
+        self.source = BBSourceStamp(branch='b', revision='abc')
+        self.db_source = model.SourceStamp.fromBBSourcestamp(self.session,
+                                                             self.source)
+
+    def tearDown(self):
+        self.session.close()
+        model.Base.metadata.drop_all()
+
+    def addRequest(self, submittime):
+        r = model.Request(submittime=submittime, builder=self.builder,
+                          source=self.db_source)
+        self.session.add(r)
+        return r
+
+    def runSetup(self, pending):
+        self.session.commit()
+        s = status.DBStatus('sqlite://')
+        s.Session = self.Session
+        s.parent = FakeParent(FakeStatus({'b': FakeBuilder(pending)}))
+        s.setup()
+        self.assertEqual(s.parent.status.subscribers, [s])
+        return s
+
+    def lostIds(self):
+        return set(r.id for r in self.Session().query(model.Request).
+                   filter_by(lost=True))
+
+    def testManyLostRequests(self):
+        # More than one batch of the lost UPDATE
+        start = datetime.datetime(2012, 3, 1)
+        lost = [self.addRequest(start + datetime.timedelta(seconds=i))
+                for i in range(1100)]
+        kept = self.addRequest(start - datetime.timedelta(seconds=1))
+        submitTime = calendar.timegm(kept.submittime.timetuple())
+        s = self.runSetup([FakePending(submitTime, self.source)])
+        self.assertEqual(self.lostIds(), set(r.id for r in lost))
+        self.assertEqual([self.session.merge(r).id
+                          for r in s.request_mapping.values()],
+                         [kept.id])
+
+    def testSubmitTimeTruncated(self):
+        # The database kept whole seconds, the master has the fraction
+        kept = self.addRequest(datetime.datetime(2012, 3, 1, 0, 0, 5))
+        other = self.addRequest(datetime.datetime(2012, 3, 1, 0, 0, 6))
+        pending = FakePending(1330560005.75, self.source)
+        s = self.runSetup([pending])
+        self.assertEqual(self.session.merge(s.request_mapping[pending]).id,
+                         kept.id)
+        self.assertEqual(self.lostIds(), set([other.id]))
+
+class FakeStep(object):
+    def __init__(self, name):
+        self.name = name
+        self.text = [name]
+
+class TestGetStep(unittest.TestCase):
+    def setUp(self):
+        model.connect('sqlite://')
+        self.session = model.Session()
+        master = model.Master.get(self.session, 'http://master/')
+        self.session.flush()
+        build = model.Build(buildnumber=1,
+                builder=model.Builder.get(self.session, 'b', master.id),
+                slave=model.Slave.get(self.session, 's'), master=master)
+        self.session.add(build)
+        self.session.flush()
+        self.build_id = build.id
+        self.step_ids = model.Step.insertBBSteps(self.session, build.id,
+                [FakeStep('checkout'), FakeStep('compile')])
+        self.session.commit()
+        self.status = status.DBBuildStatus(self.build_id,
+                                           step_ids=dict(self.step_ids))
+
+    def tearDown(self):
+        self.session.close()
+        model.Base.metadata.drop_all()
+
+    def testKnownStep(self):
+        # Known steps are found by id, not by name
+        row = self.session.query(model.Step).get(self.step_ids['compile'])
+        row.name = 'renamed'
+        self.session.commit()
+        s = self.status.getStep(self.session, 'compile')
+        self.assertEqual(s.id, self.step_ids['compile'])
+        self.assertEqual(self.session.query(model.Step).count(), 2)
+
+    def testStaleStepId(self):
+        # A step id that no longer exists falls back to the lookup by name
+        compile_id = self.step_ids['compile']
+        self.status.step_ids['compile'] = compile_id + 100
+        s = self.status.getStep(self.session, 'compile')
+        self.assertEqual(s.id, compile_id)
+
+    def testNewStep(self):
+        checkout = self.session.query(model.Step).get(self.step_ids['checkout'])
+        checkout.endtime = datetime.datetime(2012, 3, 1)
+        self.session.commit()
+        s = self.status.getStep(self.session, 'upload')
+        self.session.commit()
+        self.assert_(s.id not in self.step_ids.values())
+        # goes after the last finished step
+        build = self.session.query(model.Build).get(self.build_id)
+        self.assertEqual([step.name for step in build.steps],
+                         ['checkout', 'upload', 'compile'])
@@ -0,0 +1,188 @@
+import hashlib
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import zipfile
+
+from twisted.trial import unittest
+from twisted.internet import reactor, utils
+from twisted.web import server, static
+
+import buildbotcustom.steps.misc
+
+class ServerMixin:
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.served = os.path.join(self.tmpdir, 'served')
+        self.workdir = os.path.join(self.tmpdir, 'build')
+        os.makedirs(self.served)
+        os.makedirs(self.workdir)
+        for name in ('a.zip', 'b.zip'):
+            open(os.path.join(self.served, name), 'w').write(name * 1024)
+        self.port = reactor.listenTCP(0, server.Site(static.File(self.served)),
+                                      interface='127.0.0.1')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        return self.port.stopListening()
+
+    def url(self, name):
+        return 'http://127.0.0.1:%i/%s' % (self.port.getHost().port, name)
+
+class TestDownloadFileCache(ServerMixin, unittest.TestCase):
+    def download(self, name, cache_size=None):
+        # process.factory reloads steps.misc, so look the class up each time
+        step = buildbotcustom.steps.misc.DownloadFile(url=self.url(name),
+                cache_dir='../cache', cache_size=cache_size)
+        cmd = step.getCacheCommand(['wget', '-N', self.url(name)],
+                                   self.url(name))
+        return utils.getProcessOutputAndValue(cmd[0], cmd[1:],
+                path=self.workdir, env=os.environ)
+
+    def testHit(self):
+        d = self.download('a.zip')
+        def check(result, expectHit):
+            out, err, rc = result
+            out += err
+            self.assertEqual(rc, 0, out)
+            hit = re.search('not retrieving|not modified on server', out)
+            self.assertEqual(expectHit, bool(hit), out)
+            self.assertEqual(open(os.path.join(self.workdir, 'a.zip')).read(),
+                             'a.zip' * 1024)
+            os.unlink(os.path.join(self.workdir, 'a.zip'))
+        d.addCallback(check, False)
+        d.addCallback(lambda _: self.download('a.zip'))
+        d.addCallback(check, True)
+        return d
+
+    def testEviction(self):
+        d = self.download('a.zip', cache_size=0)
+        d.addCallback(lambda _: self.download('b.zip', cache_size=0))
+        def check(result):
+            self.assertEqual(result[2], 0, result[1])
+            entries = os.listdir(os.path.join(self.tmpdir, 'cache'))
+            self.assertEqual(len(entries), 1)
+            self.assertEqual(os.listdir(os.path.join(self.tmpdir, 'cache',
+                                                     entries[0])), ['b.zip'])
+            self.assert_(os.path.exists(os.path.join(self.workdir, 'a.zip')))
+        d.addCallback(check)
+        return d
+
+class TestDownloadAndUnpackFiles(ServerMixin, unittest.TestCase):
+    def makeArchives(self):
+        src = os.path.join(self.tmpdir, 'src')
+        os.makedirs(src)
+        open(os.path.join(src, 'firefox.txt'), 'w').write('firefox')
+        tar = tarfile.open(os.path.join(self.served, 'firefox.tar.bz2'), 'w:bz2')
+        tar.add(os.path.join(src, 'firefox.txt'), 'firefox/firefox.txt')
+        tar.close()
+        z = zipfile.ZipFile(os.path.join(self.served,
+                                         'firefox.crashreporter-symbols.zip'), 'w')
+        z.writestr('symbols.txt', 'symbols')
+        z.close()
+        shutil.copy(os.path.join(self.served, 'firefox.tar.bz2'),
+                    os.path.join(self.served, 'firefox.tests.tar.bz2'))
+
+    def download(self, artifacts, urls):
+        step = buildbotcustom.steps.misc.DownloadAndUnpackFiles(
+                artifacts=artifacts)
+        cmd = step.getDownloadCommand(urls)
+        return utils.getProcessOutputAndValue(cmd[0], cmd[1:],
+                path=self.workdir, env=os.environ)
+
+    def testDownloadAndUnpack(self):
+        self.makeArchives()
+        artifacts = [dict(name='build'),
+                     dict(name='symbols', subdir='symbols'),
+                     dict(name='tests', unpack=False)]
+        d = self.download(artifacts, [self.url('firefox.tar.bz2'),
+                                 self.url('firefox.crashreporter-symbols.zip'),
+                                 self.url('firefox.tests.tar.bz2')])
+        def check((out, err, rc)):
+            self.assertEqual(rc, 0, out + err)
+            join = os.path.join
+            self.assertEqual(open(join(self.workdir, 'firefox',
+                                       'firefox.txt')).read(), 'firefox')
+            self.assertEqual(open(join(self.workdir, 'symbols',
+                                       'symbols.txt')).read(), 'symbols')
+            self.assert_(os.path.exists(join(self.workdir, 'firefox.tar.bz2')))
+            self.assert_(os.path.exists(join(self.workdir,
+                                             'firefox.tests.tar.bz2')))
+            timings = re.findall(r'^TIMING (\S+) (\S+)', out, re.M)
+            self.assertEqual(sorted(timings),
+                    [('build', 'download'), ('symbols', 'download'),
+                     ('symbols', 'unpack'), ('tests', 'download')])
+            self.assertEqual(os.listdir(self.workdir).count('.download-build.log'), 0)
+        d.addCallback(check)
+        return d
+
+    def testCacheTrimmedOnce(self):
+        cache = os.path.join(self.tmpdir, 'cache')
+        artifacts = [dict(name='a', unpack=False, cache_dir=cache,
+                          cache_size=0),
+                     dict(name='b', unpack=False, cache_dir=cache,
+                          cache_size=0, subdir='b')]
+        urls = [self.url('a.zip'), self.url('b.zip')]
+        step = buildbotcustom.steps.misc.DownloadAndUnpackFiles(
+                artifacts=artifacts)
+        self.assertEqual(step.getDownloadCommand(urls)[2].count('du -sm'), 1)
+        d = self.download(artifacts, urls)
+        def check((out, err, rc)):
+            self.assertEqual(rc, 0, out + err)
+            self.assertEqual(len(os.listdir(cache)), 1)
+            self.assert_(os.path.exists(os.path.join(self.workdir, 'a.zip')))
+            self.assert_(os.path.exists(os.path.join(self.workdir, 'b',
+                                                     'b.zip')))
+        d.addCallback(check)
+        return d
+
+    def testFailure(self):
+        self.makeArchives()
+        d = self.download([dict(name='build'), dict(name='missing')],
+                     [self.url('firefox.tar.bz2'), self.url('missing.zip')])
+        def check((out, err, rc)):
+            self.assertNotEqual(rc, 0)
+            self.assert_('=== missing ===' in out)
+        d.addCallback(check)
+        return d
+
+class TestSetFileProperties(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = ''.join([chr(i % 251) for i in range(3 * 1024 * 1024 + 7)])
+        os.makedirs(os.path.join(self.tmpdir, 'dist', 'update'))
+        for name in ('firefox.complete.mar', 'firefox.partial.mar'):
+            open(os.path.join(self.tmpdir, 'dist', 'update', name),
+                 'w').write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_step(self, filename, maxDepth=1):
+        step = buildbotcustom.steps.misc.SetFileProperties(
+                filename=filename, directory='dist', fileType='completeMar',
+                hashTypes=['sha512', 'sha1'], maxDepth=maxDepth)
+        cmd = step.command
+        return utils.getProcessOutputAndValue(cmd[0], cmd[1:],
+                path=self.tmpdir, env=os.environ)
+
+    def testProperties(self):
+        d = self.run_step('*.complete.mar', maxDepth=2)
+        def check((out, err, rc)):
+            self.assertEqual(rc, 0, out + err)
+            self.assertEqual(out.splitlines(), [
+                'filename: firefox.complete.mar',
+                'size: %i' % len(self.data),
+                'sha512: %s' % hashlib.sha512(self.data).hexdigest(),
+                'sha1: %s' % hashlib.sha1(self.data).hexdigest()])
+        d.addCallback(check)
+        return d
+
+    def testMaxDepth(self):
+        d = self.run_step('*.complete.mar')
+        def check((out, err, rc)):
+            self.assertEqual(rc, 1, out + err)
+        d.addCallback(check)
+        return d
@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+
+from twisted.trial import unittest
+from twisted.internet import utils
+
+from buildbot.status.builder import SUCCESS, WARNINGS, FAILURE
+
+import buildbotcustom.steps.release
+
+SNIPPET = """\
+version=1
+type=complete
+url=http://download.mozilla.org/?product=firefox-4.0-complete&os=linux&lang=en-US
+hashFunction=sha512
+hashValue=abcdef
+size=123
+build=20110318052756
+appv=4.0
+extv=4.0
+"""
+
+class FakeLog(object):
+    def __init__(self, text):
+        self.text = text
+
+    def getText(self):
+        return self.text
+
+class FakeCommand(object):
+    def __init__(self, rc, text):
+        self.rc = rc
+        self.logs = {'stdio': FakeLog(text)}
+
+class TestSnippetComparison(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def writeSnippet(self, top, chan, version, locale, text=SNIPPET):
+        d = os.path.join(self.tmpdir, top, 'Firefox', version, 'Linux_x86-gcc3',
+                         '20110101010101', locale, chan)
+        if not os.path.isdir(d):
+            os.makedirs(d)
+        open(os.path.join(d, 'complete.txt'), 'w').write(text)
+
+    def compare(self, workers=2):
+        # process.factory reloads steps.release, so look the class up each time
+        step = buildbotcustom.steps.release.SnippetComparison(
+                chan1='releasetest', chan2='release', dir1='aus2.test',
+                dir2='aus2', workers=workers)
+        step.addCompleteLog = lambda name, text: self.logs.__setitem__(name, text)
+        self.logs = {}
+        cmd = step.command
+        d = utils.getProcessOutputAndValue(cmd[0], cmd[1:], path=self.tmpdir,
+                                           env=os.environ)
+        def summarize((out, err, rc)):
+            step.createSummary(FakeLog(out))
+            self.assertEqual(err, '')
+            self.assertEqual(rc, 0, out)
+            return step, out, step.evaluateCommand(FakeCommand(rc, out))
+        d.addCallback(summarize)
+        return d
+
+    def testIdentical(self):
+        for locale in ('de', 'en-US', 'fr'):
+            self.writeSnippet('aus2.test', 'releasetest', '3.6.15', locale)
+            self.writeSnippet('aus2', 'release', '3.6.15', locale)
+        d = self.compare()
+        def check((step, out, result)):
+            self.assertEqual(result, SUCCESS)
+            self.assertEqual(out, 'COMPARED 3\n')
+            self.assertEqual(step.compared, 3)
+            self.assertEqual(self.logs, {})
+        d.addCallback(check)
+        return d
+
+    def testProblems(self):
+        self.writeSnippet('aus2.test', 'releasetest', '3.6.15', 'de')
+        self.writeSnippet('aus2', 'release', '3.6.15', 'de',
+                          SNIPPET.replace('size=123', 'size=124'))
+        self.writeSnippet('aus2.test', 'releasetest', '3.6.15', 'fr')
+        self.writeSnippet('aus2.test', 'releasetest', '4.0b12', 'fr')
+        self.writeSnippet('aus2', 'release', '3.6.15', 'it')
+        d = self.compare(workers=1)
+        def check((step, out, result)):
+            self.assertEqual(result, WARNINGS)
+            self.assertEqual(step.compared, 1)
+            self.assertEqual(sorted(self.logs), ['Diffs', 'Warnings'])
+            self.assertEqual(self.logs['Warnings'],
+                'MISSING: Firefox/3.6.15/Linux_x86-gcc3/20110101010101/fr/releasetest/complete.txt\n'
+                'EXTRA: Firefox/3.6.15/Linux_x86-gcc3/20110101010101/it/releasetest/complete.txt\n')
+            self.assertEqual(self.logs['Diffs'],
+                'The following files have differences:\n\n'
+                'Firefox/3.6.15/Linux_x86-gcc3/20110101010101/de/releasetest/complete.txt\n'
+                '  size: 123 -> 124\n')
+        d.addCallback(check)
+        return d
+
+    def testPositionalSnippets(self):
+        self.writeSnippet('aus2.test', 'releasetest', '3.6.15', 'de',
+                          'complete\nhttp://a\nsha1\nabc\n')
+        self.writeSnippet('aus2', 'release', '3.6.15', 'de',
+                          'complete\nhttp://b\nsha1\nabc\n')
+        d = self.compare()
+        def check((step, out, result)):
+            self.assertEqual(result, WARNINGS)
+            self.assert_('  #1: http://a -> http://b\n' in self.logs['Diffs'])
+        d.addCallback(check)
+        return d
+
+    def testOnlyPrereleasesMissing(self):
+        self.writeSnippet('aus2.test', 'releasetest', '3.6.15', 'de')
+        self.writeSnippet('aus2', 'release', '3.6.15', 'de')
+        self.writeSnippet('aus2.test', 'releasetest', '4.0b12', 'de')
+        self.writeSnippet('aus2', 'release', '4.0b11', 'de')
+        d = self.compare()
+        def check((step, out, result)):
+            self.assert_('MISSING\t' in out and 'EXTRA\t' in out, out)
+            self.assertEqual(self.logs, {})
+            self.assertEqual(result, SUCCESS)
+        d.addCallback(check)
+        return d
+
+    def testNoReport(self):
+        step = buildbotcustom.steps.release.SnippetComparison(
+                chan1='releasetest', chan2='release', dir1='aus2.test',
+                dir2='aus2')
+        step.createSummary(FakeLog('Traceback (most recent call last):\n'))
+        self.assertEqual(step.evaluateCommand(FakeCommand(1, '')), FAILURE)
+        self.assertEqual(step.evaluateCommand(FakeCommand(0, '')), WARNINGS)
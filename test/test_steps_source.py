@@ -0,0 +1,119 @@
+import os
+import shutil
+import tempfile
+
+from twisted.trial import unittest
+from twisted.internet import utils
+
+from buildbot.status.builder import SUCCESS, FAILURE, RETRY
+
+from buildbotcustom.steps.source import hgUpdateOrCloneCommand, \
+        hgUpdateOrCloneEvaluator, hgUpdateOrCloneMarker
+
+# Stands in for hg, logging its arguments.  clone creates the .hg directory,
+# pull always fails when the repository is 'unrelated' and fails once when
+# it is 'flaky'.
+FAKE_HG = '''#!/bin/sh
+echo "$@" >> "$HGLOG"
+case "$1" in
+    clone) mkdir -p "$4/.hg" ;;
+    -R) [ "$3" = pull ] && [ "$4" = unrelated ] && exit 255
+        if [ "$3" = pull ] && [ "$4" = flaky ] && [ ! -f flaky.ok ]; then
+            touch flaky.ok
+            echo "abort: HTTP Error 500: Internal Server Error" >&2
+            exit 255
+        fi ;;
+esac
+exit 0
+'''
+
+class TestHgUpdateOrClone(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.hg = os.path.join(self.tmpdir, 'hg')
+        self.log = os.path.join(self.tmpdir, 'hg.log')
+        open(self.hg, 'w').write(FAKE_HG)
+        os.chmod(self.hg, 0755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_hg(self, repo):
+        cmd = hgUpdateOrCloneCommand(repo, 'tools', 'abcdef', self.hg,
+                                     retrySleep=0)
+        env = os.environ.copy()
+        env['HGLOG'] = self.log
+        d = utils.getProcessOutputAndValue(cmd[0], cmd[1:], path=self.tmpdir,
+                                           env=env)
+        def getLog((out, err, rc)):
+            self.assertEqual(rc, 0, out + err)
+            lines = open(self.log).read().splitlines()
+            os.unlink(self.log)
+            return lines
+        d.addCallback(getLog)
+        return d
+
+    def testCloneThenUpdate(self):
+        d = self.run_hg('http://hg/tools')
+        def checkClone(lines):
+            self.assertEqual(lines, ['clone -U http://hg/tools tools',
+                                     '-R tools update -C -r abcdef'])
+            return self.run_hg('http://hg/tools')
+        def checkUpdate(lines):
+            self.assertEqual(lines, ['-R tools pull http://hg/tools',
+                                     '-R tools update -C -r abcdef',
+                                     '-R tools --config extensions.purge= purge --all'])
+        d.addCallback(checkClone)
+        d.addCallback(checkUpdate)
+        return d
+
+    def testRecloneWhenPullFails(self):
+        os.makedirs(os.path.join(self.tmpdir, 'tools', '.hg'))
+        d = self.run_hg('unrelated')
+        def check(lines):
+            self.assertEqual(lines, ['-R tools pull unrelated'] * 3 +
+                                    ['clone -U unrelated tools',
+                                     '-R tools update -C -r abcdef'])
+        d.addCallback(check)
+        return d
+
+    def testRetryPull(self):
+        os.makedirs(os.path.join(self.tmpdir, 'tools', '.hg'))
+        d = self.run_hg('flaky')
+        def check(lines):
+            self.assertEqual(lines, ['-R tools pull flaky',
+                                     '-R tools pull flaky',
+                                     '-R tools update -C -r abcdef',
+                                     '-R tools --config extensions.purge= purge --all'])
+        d.addCallback(check)
+        return d
+
+class FakeLog(object):
+    def __init__(self, text):
+        self.text = text
+
+    def getText(self):
+        return self.text
+
+class FakeCommand(object):
+    def __init__(self, rc, text):
+        self.rc = rc
+        self.logs = {'stdio': FakeLog(text)}
+
+class TestHgUpdateOrCloneEvaluator(unittest.TestCase):
+    def evaluate(self, rc, *attempts):
+        text = ''.join(['%s %i\n%s' % (hgUpdateOrCloneMarker, i, output)
+                        for i, output in enumerate(attempts)])
+        return hgUpdateOrCloneEvaluator(FakeCommand(rc, text), None)
+
+    def testEarlierErrorIgnored(self):
+        self.assertEqual(self.evaluate(0, 'abort: HTTP Error 500\n',
+                                       'Updated tools in place\n'), SUCCESS)
+
+    def testLastError(self):
+        self.assertEqual(self.evaluate(255, 'pulling\n',
+                                       'abort: HTTP Error 503\n'), RETRY)
+
+    def testFailure(self):
+        self.assertEqual(self.evaluate(1, 'abort: unknown revision\n'),
+                         FAILURE)
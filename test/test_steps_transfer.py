@@ -0,0 +1,155 @@
+import os
+import shutil
+import stat
+import tempfile
+
+from twisted.trial import unittest
+from twisted.internet import utils
+
+import buildbotcustom.steps.transfer
+
+# Stands in for ssh by running the remote command locally
+FAKE_SSH = '''#!/bin/sh
+while [ "$1" = -l ] || [ "$1" = -i ] || [ "$1" = -p ]; do shift 2; done
+shift
+exec sh -c "$*"
+'''
+
+class TestMozillaStageUpload(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bindir = os.path.join(self.tmpdir, 'bin')
+        self.remote = os.path.join(self.tmpdir, 'remote')
+        self.objdir = os.path.join(self.tmpdir, 'objdir')
+        os.makedirs(self.bindir)
+        open(os.path.join(self.bindir, 'ssh'), 'w').write(FAKE_SSH)
+        os.chmod(os.path.join(self.bindir, 'ssh'), 0755)
+        for f in ('dist/firefox.tar.bz2', 'dist/update/firefox.complete.mar'):
+            os.makedirs(os.path.dirname(os.path.join(self.objdir, f)))
+            open(os.path.join(self.objdir, f), 'w').write(f)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def upload(self, objdir=None, **kwargs):
+        step = buildbotcustom.steps.transfer.MozillaStageUpload(
+                objdir=objdir or self.objdir, username='ffxbld',
+                milestone='mozilla-central', platform='linux',
+                remoteHost='stage', remoteBasePath=self.remote,
+                singleUpload=True, **kwargs)
+        dated = os.path.join(self.remote, 'nightly', '2012', '03',
+                             '2012-03-01-03-mozilla-central')
+        cmd = step.singleUploadCommand(dated, step.getLatestPath(),
+                os.path.join(self.remote, 'tinderbox-builds', 'linux'), None)
+        env = os.environ.copy()
+        env['PATH'] = '%s:%s' % (self.bindir, env['PATH'])
+        return utils.getProcessOutputAndValue('/bin/sh', ['-c', cmd],
+                path=self.tmpdir, env=env)
+
+    def listdir(self, *dirs):
+        return sorted(os.listdir(os.path.join(self.remote, *dirs)))
+
+    def testFanOut(self):
+        d = self.upload()
+        def check((out, err, rc)):
+            self.assertEqual(rc, 0, out + err)
+            both = ['firefox.complete.mar', 'firefox.tar.bz2']
+            self.assertEqual(self.listdir('nightly', '2012', '03',
+                    '2012-03-01-03-mozilla-central'), both)
+            self.assertEqual(self.listdir('nightly', 'latest-mozilla-central'),
+                             both)
+            self.assertEqual(self.listdir('tinderbox-builds', 'linux'),
+                             ['firefox.tar.bz2'])
+            link = os.path.join(self.remote, 'nightly',
+                                '2012-03-01-03-mozilla-central')
+            self.assertEqual(os.readlink(link),
+                             '2012/03/2012-03-01-03-mozilla-central')
+            mode = os.stat(os.path.join(self.remote, 'tinderbox-builds',
+                                        'linux', 'firefox.tar.bz2')).st_mode
+            self.assertEqual(stat.S_IMODE(mode), 0755)
+        d.addCallback(check)
+        return d
+
+    def testRelativeObjdir(self):
+        d = self.upload(objdir='objdir')
+        def check((out, err, rc)):
+            self.assertEqual(rc, 0, out + err)
+            self.assertEqual(self.listdir('nightly', 'latest-mozilla-central'),
+                             ['firefox.complete.mar', 'firefox.tar.bz2'])
+        d.addCallback(check)
+        return d
+
+    def testMissingFiles(self):
+        os.unlink(os.path.join(self.objdir, 'dist', 'update',
+                               'firefox.complete.mar'))
+        d = self.upload()
+        def check((out, err, rc)):
+            self.assertNotEqual(rc, 0)
+            self.assertFalse(os.path.exists(self.remote))
+        d.addCallback(check)
+        return d
+
+# Stands in for scp by copying locally
+FAKE_SCP = '''#!/bin/sh
+while [ "$1" = -P ] || [ "$1" = -i ]; do shift 2; done
+echo "$1" >> "$SCPLOG"
+exec cp "$1" "${2#*:}"
+'''
+
+class TestChunkedUpload(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bindir = os.path.join(self.tmpdir, 'bin')
+        self.remote = os.path.join(self.tmpdir, 'remote')
+        self.scplog = os.path.join(self.tmpdir, 'scp.log')
+        os.makedirs(self.bindir)
+        for name, script in (('ssh', FAKE_SSH), ('scp', FAKE_SCP)):
+            open(os.path.join(self.bindir, name), 'w').write(script)
+            os.chmod(os.path.join(self.bindir, name), 0755)
+        self.data = ''.join([chr(i % 251) for i in range(10000)])
+        self.package = os.path.join(self.tmpdir, 'firefox.tar.bz2')
+        open(self.package, 'w').write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def upload(self):
+        script = buildbotcustom.steps.transfer.chunkedUploadCommand(
+                self.package, 'ffxbld', 'stage', self.remote,
+                chunkSize=4096, retries=1, retrySleep=0)
+        env = os.environ.copy()
+        env['PATH'] = '%s:%s' % (self.bindir, env['PATH'])
+        env['SCPLOG'] = self.scplog
+        d = utils.getProcessOutputAndValue('bash', ['-c', script],
+                path=self.tmpdir, env=env)
+        def check((out, err, rc)):
+            self.assertEqual(rc, 0, out + err)
+            self.assertEqual(open(os.path.join(self.remote,
+                                               'firefox.tar.bz2')).read(),
+                             self.data)
+            self.assertEqual(os.listdir(self.remote), ['firefox.tar.bz2'])
+            sent = [os.path.basename(l) for l in
+                    open(self.scplog).read().splitlines()]
+            return sorted(sent)
+        d.addCallback(check)
+        return d
+
+    def testUpload(self):
+        d = self.upload()
+        d.addCallback(self.assertEqual, ['firefox.tar.bz2.part.aaaa',
+                                         'firefox.tar.bz2.part.aaab',
+                                         'firefox.tar.bz2.part.aaac'])
+        return d
+
+    def testResume(self):
+        # A previous attempt left one good and one damaged chunk behind
+        chunks = os.path.join(self.remote, '.firefox.tar.bz2.chunks')
+        os.makedirs(chunks)
+        open(os.path.join(chunks, 'firefox.tar.bz2.part.aaaa'),
+             'w').write(self.data[:4096])
+        open(os.path.join(chunks, 'firefox.tar.bz2.part.aaab'),
+             'w').write('garbage')
+        d = self.upload()
+        d.addCallback(self.assertEqual, ['firefox.tar.bz2.part.aaab',
+                                         'firefox.tar.bz2.part.aaac'])
+        return d
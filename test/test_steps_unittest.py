@@ -0,0 +1,80 @@
+import unittest
+
+from buildbotcustom.steps.unittest import MochitestSummarizer, \
+        RemoteMochitestSummarizer, TUnitSummarizer, SummaryLogObserver, \
+        summarizeLogMochitest
+
+MOCHITEST_LOG = """\
+1 INFO TEST-START | Shutdown
+2 INFO Passed: 1234
+3 INFO Failed: 0
+4 INFO Todo: 5
+TEST-UNEXPECTED-FAIL | automationutils.processLeakLog() | leaked 42 bytes during test execution
+"""
+
+class FakeLog(object):
+    def __init__(self, text):
+        self.text = text
+
+    def readlines(self):
+        return self.text.splitlines(True)
+
+class TestSummarizers(unittest.TestCase):
+    def testMochitestIncremental(self):
+        s = MochitestSummarizer('mochitest-plain')
+        for line in MOCHITEST_LOG.splitlines():
+            s.processLine(line)
+        self.assertEqual(s.summary(),
+            'TinderboxPrint: mochitest-plain<br/>1234/0/5&nbsp;'
+            '<em class="testfail">LEAK</em>\n')
+
+    def testIncrementalMatchesFullLog(self):
+        s = MochitestSummarizer('mochitest-plain')
+        for line in MOCHITEST_LOG.splitlines():
+            s.processLine(line)
+        self.assertEqual(s.summary(),
+                summarizeLogMochitest('mochitest-plain', FakeLog(MOCHITEST_LOG)))
+
+    def testNoResults(self):
+        s = MochitestSummarizer('mochitest-plain')
+        self.assertEqual(s.summary(),
+            'TinderboxPrint: mochitest-plain<br/>'
+            '<em class="testfail">T-FAIL</em>\n')
+
+    def testRemoteMochitest(self):
+        s = RemoteMochitestSummarizer('mochitest-browser-chrome')
+        for line in ['Passed: 3', 'Browser Chrome Test Summary',
+                     '\tPassed: 10', '\tFailed: 2', '\tTodo: 1']:
+            s.processLine(line)
+        self.assertEqual(s.summary(),
+            'TinderboxPrint: mochitest-browser-chrome<br/>'
+            '10/<em class="testfail">2</em>/1\n')
+
+    def testTUnit(self):
+        s = TUnitSummarizer('check')
+        for line in ['TEST-PASS | a', 'TEST-PASS | b',
+                     'TEST-UNEXPECTED-FAIL | c | oops']:
+            s.processLine(line)
+        self.assertEqual(s.summary(),
+            'TinderboxPrint: check<br/>2/<em class="testfail">1</em>\n')
+
+    def testObserver(self):
+        s = TUnitSummarizer('check')
+        o = SummaryLogObserver(s)
+        o.outReceived('TEST-PASS | a\nTEST-PA')
+        o.outReceived('SS | b\n')
+        self.assertEqual(s.passCount, 2)
+
+    def testObserverLongLine(self):
+        s = TUnitSummarizer('check')
+        o = SummaryLogObserver(s)
+        o.outReceived('TEST-PASS | a\n' + 'x' * 20000 + '\nTEST-PASS | b\n')
+        self.assertEqual(s.passCount, 2)
+
+    def testObserverUnterminatedLine(self):
+        s = TUnitSummarizer('check')
+        o = SummaryLogObserver(s)
+        o.outReceived('TEST-PASS | a\nTEST-PASS | b')
+        o.finish()
+        o.finish()
+        self.assertEqual(s.passCount, 2)